@@ -0,0 +1,73 @@
+"""
+Startup benchmark based on `python -X importtime`.
+
+Imports each module in a fresh interpreter (without OPENAI_API_KEY, so it also
+checks that importing needs no credentials), repeats the run and reports the
+median total import time and the slowest modules.
+
+Usage:
+    python benchmarks/importtime.py [module ...] [--repeat N] [--top N] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_MODULES = ["services.openaiapi", "engine", "models", "main"]
+
+
+def measure(module: str) -> dict:
+    """Imports module once in a fresh interpreter and parses the -X importtime report."""
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        cumulative[name] = int(cumulative_us)
+    return {"total_us": cumulative.get(module, 0), "modules": cumulative}
+
+
+def run(modules, repeat: int, top: int) -> dict:
+    report = {}
+    for module in modules:
+        runs = [measure(module) for _ in range(repeat)]
+        slowest = sorted(runs[-1]["modules"].items(), key=lambda item: item[1], reverse=True)
+        report[module] = {
+            "median_ms": round(statistics.median(r["total_us"] for r in runs) / 1000, 2),
+            "min_ms": round(min(r["total_us"] for r in runs) / 1000, 2),
+            "imported_modules": len(runs[-1]["modules"]),
+            "slowest": [{"module": name, "cumulative_ms": round(us / 1000, 2)}
+                        for name, us in slowest[1:top + 1]],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure package import time.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args.modules, args.repeat, args.top)
+    for module, result in report.items():
+        print(f"{module}: {result['median_ms']} ms median ({result['min_ms']} ms min, "
+              f"{result['imported_modules']} modules)")
+        for entry in result["slowest"]:
+            print(f"    {entry['cumulative_ms']:>8} ms  {entry['module']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
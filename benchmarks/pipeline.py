@@ -0,0 +1,435 @@
+"""
+End-to-end pipeline benchmark based on recorded responses.
+
+Replays recorded responses through connect_api (ReplayBackend) with an optional
+simulated latency, so it runs fully offline. Every scenario runs in a fresh
+interpreter and temporary directory, first against an empty cache ("cold"),
+then again against the cache the cold run filled ("warm", with a new in-process
+memory tier). Reported per run: wall time, API calls, recording misses, and the
+time spent in cache I/O, prompt building, rendering and file writes (summed over
+threads, so batch figures can exceed the wall time); per scenario: the peak RSS.
+
+The opt-in "scale" scenario streams a large batch of distinct ideas (cold only)
+through BatchRunner and reports how much the peak RSS grows per 1,000 ideas once
+the first tenth has warmed up the process; a flat pipeline stays near zero.
+
+The client-side rate limits are lifted, so the figures measure the pipeline
+rather than the configured budgets. Without a recording, the deterministic
+FakeBackend stands in for the provider.
+
+Usage:
+    python benchmarks/pipeline.py record recording.jsonl [--live]
+    python benchmarks/pipeline.py run [--recording recording.jsonl] [--latency fixed:0.05]
+                                      [--repeat 3] [--json out.json] [--baseline base.json]
+    python benchmarks/pipeline.py run --scenarios scale [--scale-ideas 1000] [--repeat 1]
+    python benchmarks/pipeline.py compare out.json base.json [--threshold 0.1]
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SCENARIOS = ("single", "batch", "scale")
+DEFAULT_SCENARIOS = ("single", "batch")
+
+# Peak RSS samples taken over a scale run
+SCALE_CHECKPOINTS = 10
+
+# Two industries, so the batch also exercises requests shared across ideas
+IDEAS = [
+    ("Financial", "A system that provide tax optimization strategies for traders"),
+    ("Financial", "Automated expense categorization for small businesses"),
+    ("Financial", "Invoice financing marketplace for freelancers"),
+    ("Financial", "Credit scoring from open banking data"),
+    ("Healthcare", "Telehealth triage assistant for rural clinics"),
+    ("Healthcare", "Clinical note summarization for physicians"),
+    ("Healthcare", "Medication adherence coaching app"),
+    ("Healthcare", "Hospital bed capacity forecasting"),
+]
+
+TIMED = ("cache_io_s", "prompt_building_s", "rendering_s", "file_writes_s")
+
+# Metrics compared against a baseline, with the smallest change worth reporting
+COMPARED = {"wall_s": 0.005, "cache_io_s": 0.002, "prompt_building_s": 0.002, "rendering_s": 0.002,
+            "file_writes_s": 0.002, "peak_rss_mb": 5.0, "peak_rss_per_1000_ideas_mb": 2.0}
+
+
+class Timers:
+    """Thread-safe time accumulators by category."""
+
+    def __init__(self) -> None:
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, category: str, seconds: float) -> None:
+        with self._lock:
+            self._totals[category] = self._totals.get(category, 0.0) + seconds
+
+    def wrap(self, function, category: str):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(category, time.perf_counter() - started)
+        return timed
+
+    def wrap_coroutine(self, function, category: str):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.add(category, time.perf_counter() - started)
+        return timed
+
+    def wrap_generator(self, function, category: str):
+        """Times only the steps of a generator, not the consumer's work between them."""
+        def timed(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration as stop:
+                    self.add(category, time.perf_counter() - started)
+                    return stop.value
+                self.add(category, time.perf_counter() - started)
+                yield item
+        return timed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+        # Renderer.render writes the chunks it generates; the difference is the writing
+        writes = totals.get("render", 0.0) - totals.get("rendering", 0.0) + totals.get("save_artifact", 0.0)
+        return {"cache_io_s": totals.get("cache_io", 0.0), "prompt_building_s": totals.get("prompt_building", 0.0),
+                "rendering_s": totals.get("rendering", 0.0), "file_writes_s": max(writes, 0.0)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+@contextlib.contextmanager
+def instrumented(timers: Timers):
+    """Wraps the cache, prompt building, rendering and artifact writes in timers for the block."""
+    import services.openaiapi as oai
+    from engine import rendering
+    from engine.promptpatterncatalog import promptcatalog
+    from engine.solutiondesign import genma
+    from services.cache import TieredCache
+
+    targets = [
+        (TieredCache, "lookup", "cache_io", "call"),
+        (TieredCache, "set", "cache_io", "call"),
+        (TieredCache, "find_by_prompt", "cache_io", "call"),
+        (TieredCache, "alookup", "cache_io", "coroutine"),
+        (TieredCache, "aset", "cache_io", "coroutine"),
+        (TieredCache, "afind_by_prompt", "cache_io", "coroutine"),
+        (oai, "_request", "prompt_building", "call"),
+        (genma, "stage_messages", "prompt_building", "call"),
+        (promptcatalog.PatternCatalog, "format_prompts", "prompt_building", "call"),
+        (rendering.Renderer, "chunks", "rendering", "generator"),
+        (rendering.Renderer, "render", "render", "call"),
+        (rendering.JSONRenderer, "chunks", "rendering", "generator"),
+        (genma, "save_artifact", "save_artifact", "call"),
+        (promptcatalog, "save_artifact", "save_artifact", "call"),
+    ]
+    wrappers = {"call": timers.wrap, "generator": timers.wrap_generator, "coroutine": timers.wrap_coroutine}
+    originals = [(owner, name, owner.__dict__[name]) for owner, name, _, _ in targets]
+    for owner, name, category, kind in targets:
+        setattr(owner, name, wrappers[kind](getattr(owner, name), category))
+    try:
+        yield timers
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _backend(recording: str, latency: str):
+    from services.backends import FakeBackend, ReplayBackend
+
+    if recording:
+        return ReplayBackend(recording, latency=latency, fallback=FakeBackend(latency=latency))
+    return FakeBackend(latency=latency)
+
+
+def _config():
+    from services.config import Config
+
+    return Config(cache_dir="cache", backend="fake", rate_limit_rpm=1e9, rate_limit_tpm=1e12, max_concurrency=64)
+
+
+def _jobs(count: int) -> list:
+    return [{"industry": industry, "idea": idea, "output_dir": "output"} for industry, idea in IDEAS[:count]]
+
+
+def run_scenario(name: str, ideas: int, workers: int, latency: str, recording: str = None) -> dict:
+    """Runs one scenario cold and warm in the current directory and returns its figures."""
+    import models as m
+    import services.openaiapi as oai
+
+    startup_rss = _peak_rss_mb()
+    jobs = _jobs(1 if name == "single" else ideas)
+    timers = Timers()
+    result = {"ideas": len(jobs)}
+    with instrumented(timers):
+        for phase in ("cold", "warm"):
+            # A new cache object (empty memory tier) on the cache directory of the previous phase
+            oai.configure(_config())
+            backend = _backend(recording, latency)
+            oai.set_backend(backend)
+            timers.reset()
+            gc.collect()
+            started = time.perf_counter()
+            if name == "single":
+                job = jobs[0]
+                m.SolutionGenerator(job["industry"], job["idea"], job["output_dir"]).generate()
+            else:
+                m.BatchRunner(jobs, f"journal-{phase}.jsonl", workers=workers).run()
+            result[phase] = {"wall_s": time.perf_counter() - started, "api_calls": backend.calls,
+                             "replay_misses": getattr(backend, "misses", 0), **timers.snapshot()}
+    oai.configure(None)
+    result["startup_rss_mb"] = startup_rss
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def run_scale(ideas: int, workers: int, latency: str, recording: str = None) -> dict:
+    """Streams a batch of distinct ideas and samples the peak RSS as the jobs are pulled."""
+    import models as m
+    import services.openaiapi as oai
+
+    startup_rss = _peak_rss_mb()
+    step = max(ideas // SCALE_CHECKPOINTS, 1)
+    checkpoints = []
+
+    def jobs():
+        for number in range(ideas):
+            if number % step == 0:
+                checkpoints.append((number, _peak_rss_mb()))
+            industry, idea = IDEAS[number % len(IDEAS)]
+            yield {"industry": industry, "idea": f"{idea} (variant {number})", "output_dir": "output"}
+
+    timers = Timers()
+    with instrumented(timers):
+        oai.configure(_config())
+        backend = _backend(recording, latency)
+        oai.set_backend(backend)
+        started = time.perf_counter()
+        m.BatchRunner(jobs(), "journal.jsonl", workers=workers).run()
+        cold = {"wall_s": time.perf_counter() - started, "api_calls": backend.calls,
+                "replay_misses": getattr(backend, "misses", 0), **timers.snapshot()}
+    oai.configure(None)
+    peak = _peak_rss_mb()
+    # The first tenth still pays for imports, pools and first-use allocations
+    warmed, warmed_rss = checkpoints[1] if len(checkpoints) > 1 else checkpoints[0]
+    return {"ideas": ideas, "cold": cold, "startup_rss_mb": startup_rss, "peak_rss_mb": peak,
+            "peak_rss_per_1000_ideas_mb": round((peak - warmed_rss) / max(ideas - warmed, 1) * 1000, 2),
+            "checkpoints": checkpoints}
+
+
+def _measure(name: str, args) -> dict:
+    """Runs a scenario in a fresh interpreter and temporary directory."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    ideas = args.scale_ideas if name == "scale" else args.ideas
+    command = [sys.executable, os.path.abspath(__file__), "_scenario", name, "--ideas", str(ideas),
+               "--workers", str(args.workers), "--latency", args.latency]
+    if args.recording:
+        command += ["--recording", os.path.abspath(args.recording)]
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    try:
+        result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"scenario {name} failed:\n{result.stderr[-2000:]}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _median(runs: list):
+    """Median of every numeric leaf across repeated runs."""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: _median([run[key] for run in runs]) for key in first}
+    if isinstance(first, (int, float)):
+        return round(statistics.median(runs), 4)
+    return first
+
+
+def run(args) -> dict:
+    scenarios = {}
+    for name in args.scenarios:
+        scenarios[name] = _median([_measure(name, args) for _ in range(args.repeat)])
+    return {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                     "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": args.repeat,
+                     "ideas": args.ideas, "scale_ideas": args.scale_ideas, "workers": args.workers, "latency": args.latency,
+                     "recording": os.path.basename(args.recording) if args.recording else None},
+            "scenarios": scenarios}
+
+
+def record(path: str, live: bool) -> int:
+    """Runs every benchmark idea once through a RecordingBackend and saves the responses."""
+    import models as m
+    import services.openaiapi as oai
+    from services.backends import FakeBackend, RecordingBackend
+    from services.config import Config
+
+    path = os.path.abspath(path)
+    workdir = tempfile.mkdtemp(prefix="bench-record-")
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # Live mode records the configured provider (LLM_BACKEND, OPENAI_API_KEY)
+        config = Config.from_env() if live else _config()
+        config.cache_dir = "cache"
+        oai.configure(config)
+        recorder = RecordingBackend(oai.get_backend() if live else FakeBackend())
+        oai.set_backend(recorder)
+        for job in _jobs(len(IDEAS)):
+            m.SolutionGenerator(job["industry"], job["idea"], job["output_dir"]).generate()
+        oai.configure(None)
+        return recorder.save(path)
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _flatten(report: dict) -> dict:
+    flat = {}
+    for name, scenario in report["scenarios"].items():
+        for phase in ("cold", "warm"):
+            for metric, value in scenario.get(phase, {}).items():
+                flat[(name, phase, metric)] = value
+        for metric in ("peak_rss_mb", "peak_rss_per_1000_ideas_mb"):
+            if metric in scenario:
+                flat[(name, "-", metric)] = scenario[metric]
+    return flat
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compares two reports.
+
+    Returns:
+        Rows (scenario, phase, metric, baseline, current, relative change, regressed);
+        a metric regressed if it grew by more than threshold and its minimum delta.
+    """
+    rows = []
+    base = _flatten(baseline)
+    for key, value in _flatten(current).items():
+        metric = key[2]
+        if metric not in COMPARED or key not in base or value is None or base[key] is None:
+            continue
+        change = (value - base[key]) / base[key] if base[key] else 0.0
+        regressed = value > base[key] * (1 + threshold) and value - base[key] > COMPARED[metric]
+        rows.append((*key, base[key], value, change, regressed))
+    return rows
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    for name, scenario in report["scenarios"].items():
+        lines.append(f"{name} ({scenario['ideas']} ideas): peak RSS {scenario['peak_rss_mb']} MB "
+                     f"(startup {scenario['startup_rss_mb']} MB)")
+        if "peak_rss_per_1000_ideas_mb" in scenario:
+            lines.append(f"  peak RSS growth {scenario['peak_rss_per_1000_ideas_mb']:+.1f} MB per 1,000 ideas")
+        for phase in ("cold", "warm"):
+            if phase not in scenario:
+                continue
+            figures = scenario[phase]
+            lines.append(f"  {phase:<5} {figures['wall_s'] * 1000:>9.1f} ms wall, {figures['api_calls']:>3} API calls, "
+                         f"{figures['replay_misses']} misses | "
+                         + ", ".join(f"{metric[:-2]} {figures[metric] * 1000:.1f} ms" for metric in TIMED))
+    return "\n".join(lines)
+
+
+def format_comparison(rows: list) -> str:
+    lines = [f"{'scenario':<8} {'phase':<5} {'metric':<26} {'baseline':>10} {'current':>10} {'change':>8}"]
+    for name, phase, metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        lines.append(f"{name:<8} {phase:<5} {metric:<26} {before:>10.4g} {after:>10.4g} {change:>+8.1%}{flag}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline offline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record the responses of the benchmark ideas")
+    record_parser.add_argument("recording", help="JSONL file to write")
+    record_parser.add_argument("--live", action="store_true",
+                               help="record the configured provider instead of the offline fake")
+
+    for command in ("run", "_scenario"):
+        sub = commands.add_parser(command, help="run the benchmark" if command == "run" else argparse.SUPPRESS)
+        if command == "_scenario":
+            sub.add_argument("scenario", choices=SCENARIOS)
+        else:
+            sub.add_argument("--scenarios", type=lambda text: text.split(","), default=list(DEFAULT_SCENARIOS),
+                             help="comma-separated subset of: " + ", ".join(SCENARIOS)
+                                  + " (default: " + ",".join(DEFAULT_SCENARIOS) + ")")
+            sub.add_argument("--scale-ideas", type=int, default=1000, help="ideas of the scale scenario")
+            sub.add_argument("--repeat", type=int, default=3, help="runs per scenario; the median is reported")
+            sub.add_argument("--json", help="write the report to this file")
+            sub.add_argument("--baseline", help="report to compare against; exits with 1 on regressions")
+            sub.add_argument("--threshold", type=float, default=0.10, help="relative growth counted as regression")
+        sub.add_argument("--ideas", type=int, default=len(IDEAS), help="ideas of the batch scenario")
+        sub.add_argument("--workers", type=int, default=4, help="batch workers")
+        sub.add_argument("--latency", default="fixed:0", help="simulated latency: fixed:S, uniform:A,B or "
+                                                              "lognormal:MEDIAN,SIGMA")
+        sub.add_argument("--recording", help="responses recorded with 'record' (default: the offline fake)")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(f"Recorded {record(args.recording, args.live)} responses to {args.recording}")
+    elif args.command == "_scenario":
+        if args.scenario == "scale":
+            result = run_scale(args.ideas, args.workers, args.latency, args.recording)
+        else:
+            result = run_scenario(args.scenario, args.ideas, args.workers, args.latency, args.recording)
+        print(json.dumps(result))
+    else:
+        if args.command == "compare":
+            with open(args.current) as f:
+                report = json.load(f)
+            baseline_path = args.baseline
+        else:
+            report = run(args)
+            print(format_report(report))
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump(report, f, indent=2)
+            baseline_path = args.baseline
+        if baseline_path:
+            with open(baseline_path) as f:
+                rows = compare(report, json.load(f), args.threshold)
+            print(format_comparison(rows))
+            if any(row[-1] for row in rows):
+                sys.exit(1)
@@ -1,3 +1,20 @@
-from .solutiondesign import *
-from .promptpatterncatalog import *
+from services.lazyimport import attach
 
+# Public names resolved lazily on first access, so importing the package is cheap
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "solutiondesign": ".solutiondesign",
+    "promptpatterncatalog": ".promptpatterncatalog",
+    "genma": ".solutiondesign.genma",
+    "promptcatalog": ".promptpatterncatalog.promptcatalog",
+    "generate_multi_agent_architecture": ".solutiondesign.genma",
+    "generate_solution": ".solutiondesign.genma",
+    "write_solution": ".solutiondesign.genma",
+    "agenerate_multi_agent_architecture": ".solutiondesign.genma",
+    "agenerate_solution": ".solutiondesign.genma",
+    "awrite_solution": ".solutiondesign.genma",
+    "PatternCatalog": ".promptpatterncatalog.promptcatalog",
+    "artifact": ".artifact",
+    "rendering": ".rendering",
+    "load_artifact": ".artifact",
+    "render": ".rendering",
+})
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+from typing import Any, Dict
+
+# Bumped whenever the layout of "data" changes incompatibly
+ARTIFACT_VERSION = 1
+
+KINDS = ("architecture", "catalog")
+
+
+def new_artifact(kind: str, data: Dict[str, Any], **meta) -> Dict[str, Any]:
+    """
+    Wraps stage results in a versioned artifact.
+
+    Args:
+        kind: "architecture" (genma) or "catalog" (PatternCatalog).
+        data: The stage results.
+        **meta: Extra top-level fields, e.g. the idea and industry.
+
+    Returns:
+        The artifact dictionary.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown artifact kind: {kind}")
+    return {"artifact_version": ARTIFACT_VERSION, "kind": kind,
+            "created_at": datetime.now().isoformat(timespec="seconds"), **meta, "data": data}
+
+
+def artifact_path(document_path: str) -> str:
+    """Returns the artifact location next to a rendered document."""
+    return os.path.splitext(document_path)[0] + ".json"
+
+
+def document_slug(idea: str, industry: str = None, max_length: int = 60) -> str:
+    """
+    Turns an idea into the filename-safe part of its document names: the start of
+    the idea, then a short hash of the industry and the full idea, so ideas sharing
+    that start (or one idea run for two industries) never share a name.
+    """
+    digest = hashlib.sha1(f"{industry or ''}|{idea}".encode('utf-8')).hexdigest()[:8]
+    return f"{re.sub(r'[^A-Za-z0-9]+', '_', idea).strip('_')[:max_length].rstrip('_')}_{digest}"
+
+
+def save_artifact(path: str, artifact: Dict[str, Any]) -> None:
+    """Writes the artifact atomically, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(artifact, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_artifact(path: str) -> Dict[str, Any]:
+    """
+    Reads an artifact written by save_artifact.
+
+    Raises:
+        ValueError: The file is not an artifact or has an unsupported version.
+    """
+    with open(path) as f:
+        artifact = json.load(f)
+    if not isinstance(artifact, dict) or artifact.get("kind") not in KINDS or "data" not in artifact:
+        raise ValueError(f"{path} is not a generation artifact")
+    if artifact.get("artifact_version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path}: unsupported artifact version {artifact.get('artifact_version')} "
+                         f"(expected {ARTIFACT_VERSION})")
+    return artifact
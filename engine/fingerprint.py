@@ -0,0 +1,77 @@
+"""
+Per-stage fingerprints for incremental regeneration.
+
+Every stage (genma stage, agent profile or catalog topic) is fingerprinted by
+the request that produces it: template text, the upstream results it embeds and
+the model parameters. An incremental run reuses the results of the previous
+artifact whose fingerprint is unchanged and only requests the others.
+"""
+import logging
+import os
+from typing import Dict, Optional
+
+from engine.artifact import load_artifact
+
+logger = logging.getLogger(__name__)
+
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+NEW = "new"
+REMOVED = "removed"
+# Depends on an upstream stage that is recomputed, so the fingerprint is not known yet
+PENDING = "pending"
+
+
+def load_previous(path: str) -> Optional[dict]:
+    """Returns the artifact at path, or None if there is none or it cannot be reused."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return load_artifact(path)
+    except ValueError as e:
+        logger.warning(f"Ignoring previous artifact: {str(e)}")
+        return None
+
+
+def previous_fingerprints(artifact: Optional[dict]) -> Dict[str, str]:
+    if artifact is None:
+        return {}
+    return artifact["data"].get("fingerprints") or {}
+
+
+def compare(current: Dict[str, Optional[str]], previous: Dict[str, str]) -> Dict[str, str]:
+    """
+    Classifies every stage as unchanged, changed, new, removed or pending.
+
+    Args:
+        current: Fingerprint of each stage of this run; None for stages whose
+            fingerprint depends on a recomputed upstream result.
+        previous: The fingerprints recorded in the previous artifact.
+
+    Returns:
+        The status of each stage.
+    """
+    changes = {}
+    for stage, fingerprint in current.items():
+        if fingerprint is None:
+            changes[stage] = PENDING
+        elif stage not in previous:
+            changes[stage] = NEW
+        elif previous[stage] != fingerprint:
+            changes[stage] = CHANGED
+        else:
+            changes[stage] = UNCHANGED
+    for stage in previous:
+        if stage not in current:
+            changes[stage] = REMOVED
+    return changes
+
+
+def format_changes(document: str, changes: Dict[str, str]) -> str:
+    """Formats a compare result as a dry-run report."""
+    recompute = [stage for stage, status in changes.items() if status in (CHANGED, NEW, PENDING)]
+    lines = [f"{document}: {len(recompute)} of {len(changes)} stages to recompute"]
+    for stage, status in changes.items():
+        action = "reuse" if status == UNCHANGED else "drop" if status == REMOVED else "recompute"
+        lines.append(f"  {action:<9} {stage} ({status})")
+    return "\n".join(lines)
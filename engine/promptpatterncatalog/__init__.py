@@ -1,2 +1,6 @@
-from .promptcatalog import *
+from services.lazyimport import attach
 
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "promptcatalog": ".promptcatalog",
+    "PatternCatalog": ".promptcatalog",
+})
@@ -1,26 +1,24 @@
+import asyncio
+import contextlib
+import contextvars
 import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Optional
 
+import services.openaiapi as oai
+from engine import rendering
+from engine.artifact import artifact_path, document_slug, new_artifact, save_artifact
+from engine.fingerprint import compare, load_previous, previous_fingerprints
+from engine.streaming import OrderedSectionWriter
+from services import telemetry
+from services.backends import RequestDeferred
 
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    filename='business_idea_generation.log',
-                    filemode='w')
 
 logger = logging.getLogger(__name__)
 
-# Also log to console
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-logger.info("Script execution started")
-
 
 class PatternCatalog:
     def __init__(self) -> None:
@@ -37,54 +35,333 @@ class PatternCatalog:
             "Scalability Assessment": "Evaluate the scalability potential of [BUSINESS_IDEA]. What factors would facilitate or hinder its growth, and how could it expand into new markets or segments?"
         }
         logger.info(f"Loaded {len(self.PROMPT_PATTERNS)} prompt patterns")
+        # Topics of the last generated document whose request failed (written as an error marker)
+        self.failed_topics = []
 
-    def generate_content(self,industry = "technology",idea = "AI-powered personal productivity assistant"
-    ):
-        logger.info("Starting markdown generation")
-        markdown_content = f"# Business Idea Generation Session\n\nDate: {datetime.now().strftime('%Y-%m-%d')}\n\n"
-
-        # Placeholder for industry and business idea
-        for topic, prompt in self.PROMPT_PATTERNS.items():
-            logger.info(f"Processing topic: {topic}")
-            formatted_prompt = prompt.replace("[INDUSTRY]", industry).replace("[BUSINESS_IDEA]", idea)
-            markdown_content += f"## {topic}\n\n"
-            markdown_content += f"**Prompt:** {formatted_prompt}\n\n"
-            try:
-                response = oai.connect_api(formatted_prompt)
-                markdown_content += f"**Response:**\n\n{response}\n\n"
-            except Exception as e:
-                logger.error(f"Failed to get AI response for topic '{topic}': {str(e)}")
-                markdown_content += f"**Response:** Error occurred while fetching response.\n\n"
-            markdown_content += "---\n\n"
-            logger.info(f"Completed processing for topic: {topic}")
+    def request_response(self, topic: str, formatted_prompt: str) -> Optional[str]:
+        """
+        Requests the response for a single topic.
+
+        Args:
+            topic: The catalog topic being processed.
+            formatted_prompt: The prompt with [INDUSTRY] and [BUSINESS_IDEA] filled in.
+
+        Returns:
+            The response text, or None if the request failed.
+        """
+        logger.info(f"Processing topic: {topic}")
+        try:
+            with telemetry.span("catalog.topic", topic=topic):
+                response = oai.connect_api(prompt=formatted_prompt, stage=f"catalog:{topic}")
+        except Exception as e:
+            logger.error(f"Failed to get AI response for topic '{topic}': {str(e)}")
+            response = None
+        logger.info(f"Completed processing for topic: {topic}")
+        return response
+
+    async def arequest_response(self, topic: str, formatted_prompt: str) -> Optional[str]:
+        """Async variant of request_response, through aconnect_api."""
+        logger.info(f"Processing topic: {topic}")
+        try:
+            with telemetry.span("catalog.topic", topic=topic):
+                response = await oai.aconnect_api(prompt=formatted_prompt, stage=f"catalog:{topic}")
+        except Exception as e:
+            logger.error(f"Failed to get AI response for topic '{topic}': {str(e)}")
+            response = None
+        logger.info(f"Completed processing for topic: {topic}")
+        return response
+
+    def fetch_response(self, topic: str, formatted_prompt: str) -> str:
+        """Fetches the markdown fragment for the response part of a section, falling back to an error marker."""
+        return rendering.response_markdown(self.request_response(topic, formatted_prompt))
+
+    def stream_response(self, topic: str, formatted_prompt: str, writer: OrderedSectionWriter) -> Optional[str]:
+        """
+        Streams a single topic section into the writer as the tokens arrive.
+
+        Args:
+            topic: The catalog topic being processed.
+            formatted_prompt: The prompt with [INDUSTRY] and [BUSINESS_IDEA] filled in.
+            writer: The writer assembling the document in catalog order.
+
+        Returns:
+            The complete response text, or None if the request failed.
+        """
+        logger.info(f"Processing topic: {topic}")
+        writer.write(topic, rendering.topic_heading(topic, formatted_prompt))
+        parts = []
+        try:
+            with telemetry.span("catalog.topic", topic=topic, stream=True):
+                for text in oai.connect_api_stream(prompt=formatted_prompt, stage=f"catalog:{topic}"):
+                    if not parts:
+                        writer.write(topic, rendering.RESPONSE_LABEL)
+                    parts.append(text)
+                    writer.write(topic, text)
+            if not parts:
+                writer.write(topic, rendering.RESPONSE_LABEL)
+            writer.write(topic, "\n\n")
+            response = "".join(parts)
+        except Exception as e:
+            logger.error(f"Failed to get AI response for topic '{topic}': {str(e)}")
+            if parts:
+                writer.write(topic, "\n\n")
+            writer.write(topic, rendering.RESPONSE_ERROR)
+            response = None
+        writer.write(topic, rendering.SECTION_BREAK)
+        writer.finish(topic)
+        logger.info(f"Completed processing for topic: {topic}")
+        return response
+
+    def format_prompts(self, industry: str, idea: str) -> dict:
+        """Fills the [INDUSTRY] and [BUSINESS_IDEA] placeholders of every topic."""
+        return {
+            topic: prompt.replace("[INDUSTRY]", industry).replace("[BUSINESS_IDEA]", idea)
+            for topic, prompt in self.PROMPT_PATTERNS.items()
+        }
+
+    def header(self) -> str:
+        return rendering.catalog_header(datetime.now().strftime('%Y-%m-%d'))
+
+    def artifact(self, industry: str, idea: str, sections: list, date: str = None) -> dict:
+        """Wraps the per-topic results in a versioned artifact (see engine.artifact)."""
+        fingerprints = {section["topic"]: self.topic_fingerprint(section["topic"], section["prompt"])
+                        for section in sections}
+        return new_artifact("catalog", {"industry": industry, "idea": idea,
+                                        "date": date or datetime.now().strftime('%Y-%m-%d'),
+                                        "sections": sections, "fingerprints": fingerprints},
+                            industry=industry, idea=idea)
+
+    def topic_fingerprint(self, topic: str, formatted_prompt: str) -> str:
+        """Fingerprints a topic by its request: pattern text, placeholders and routed model parameters."""
+        return oai.request_fingerprint(prompt=formatted_prompt, stage=f"catalog:{topic}")
+
+    def reusable(self, prompts: dict, previous: dict = None) -> dict:
+        """Returns the previous responses of the topics whose fingerprint is unchanged."""
+        if previous is None:
+            return {}
+        known = previous_fingerprints(previous)
+        responses = {section["topic"]: section["response"] for section in previous["data"]["sections"]}
+        return {topic: responses[topic] for topic, formatted_prompt in prompts.items()
+                if responses.get(topic) is not None
+                and known.get(topic) == self.topic_fingerprint(topic, formatted_prompt)}
+
+    def changes(self, industry: str, idea: str, output_dir: str = "output") -> dict:
+        """Dry run of generate(incremental=True): the status of each topic."""
+        previous = load_previous(artifact_path(self.output_path(output_dir, idea, stable=True, industry=industry)))
+        current = {topic: self.topic_fingerprint(topic, formatted_prompt)
+                   for topic, formatted_prompt in self.format_prompts(industry, idea).items()}
+        return compare(current, previous_fingerprints(previous))
+
+    def collect(self, industry: str, idea: str, max_workers: int = None, previous: dict = None) -> dict:
+        """
+        Requests every catalog topic and returns the results as an artifact.
+
+        The topics are independent, so they are sent concurrently through a bounded
+        worker pool. Sections are still kept in catalog order.
+
+        Args:
+            industry: Value for the [INDUSTRY] placeholder.
+            idea: Value for the [BUSINESS_IDEA] placeholder.
+            max_workers: Maximum number of concurrent API calls. Defaults to one per
+                topic; 1 runs the topics sequentially.
+            previous: Artifact of an earlier run; topics whose fingerprint is
+                unchanged reuse its responses.
 
+        Returns:
+            The catalog artifact.
+        """
+        prompts = self.format_prompts(industry, idea)
+        reused = self.reusable(prompts, previous)
+        logger.info(f"Reusing {len(reused)} of {len(prompts)} topics from the previous run")
+        workers = max_workers or len(prompts)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {topic: executor.submit(contextvars.copy_context().run, self.request_response, topic,
+                                              formatted_prompt)
+                       for topic, formatted_prompt in prompts.items() if topic not in reused}
+            sections = [{"topic": topic, "prompt": formatted_prompt,
+                         "response": reused[topic] if topic in reused else futures[topic].result()}
+                        for topic, formatted_prompt in prompts.items()]
+        return self.artifact(industry, idea, sections)
+
+    async def acollect(self, industry: str, idea: str, max_in_flight: int = None, previous: dict = None) -> dict:
+        """
+        Async variant of collect: the topics are requested as tasks on the running
+        event loop instead of worker threads.
+
+        Args:
+            industry: Value for the [INDUSTRY] placeholder.
+            idea: Value for the [BUSINESS_IDEA] placeholder.
+            max_in_flight: Maximum number of concurrent requests. Defaults to one per topic.
+            previous: Artifact of an earlier run; topics whose fingerprint is
+                unchanged reuse its responses.
+
+        Returns:
+            The catalog artifact.
+        """
+        prompts = self.format_prompts(industry, idea)
+        reused = self.reusable(prompts, previous)
+        logger.info(f"Reusing {len(reused)} of {len(prompts)} topics from the previous run")
+        limit = asyncio.Semaphore(max_in_flight or len(prompts))
+
+        async def request(topic: str, formatted_prompt: str) -> Optional[str]:
+            async with limit:
+                return await self.arequest_response(topic, formatted_prompt)
+
+        topics = [topic for topic in prompts if topic not in reused]
+        responses = dict(zip(topics, await asyncio.gather(*(request(topic, prompts[topic]) for topic in topics))))
+        sections = [{"topic": topic, "prompt": formatted_prompt,
+                     "response": reused[topic] if topic in reused else responses[topic]}
+                    for topic, formatted_prompt in prompts.items()]
+        return self.artifact(industry, idea, sections)
+
+    def generate_content(self,industry = "technology",idea = "AI-powered personal productivity assistant",
+                         max_workers: int = None):
+        """
+        Generates the markdown for every catalog topic (see collect).
+
+        Returns:
+            The markdown document.
+        """
+        logger.info("Starting markdown generation")
+        markdown_content = rendering.render_to_string(self.collect(industry, idea, max_workers), "markdown")
         logger.info("Markdown generation completed")
         return markdown_content
 
-    def save_content(self,content, filename="business_idea_generation.md",topic=""):
-        logger.info(f"Saving markdown content to file: {filename}")
+    def stream_content(self, file, industry: str, idea: str, max_workers: int = None, previous: dict = None) -> dict:
+        """
+        Writes the markdown for every catalog topic to file while the responses stream in.
+
+        All topics are requested concurrently; the section being written streams
+        token by token while later sections are buffered, so the file is always a
+        prefix of the final document in catalog order.
+
+        Args:
+            file: The open output file.
+            industry: Value for the [INDUSTRY] placeholder.
+            idea: Value for the [BUSINESS_IDEA] placeholder.
+            max_workers: Maximum number of concurrent API calls.
+            previous: Artifact of an earlier run; topics whose fingerprint is
+                unchanged reuse its responses.
+
+        Returns:
+            The catalog artifact.
+        """
+        logger.info("Starting streaming markdown generation")
+        date = datetime.now().strftime('%Y-%m-%d')
+        file.write(rendering.catalog_header(date))
+        file.flush()
+
+        prompts = self.format_prompts(industry, idea)
+        reused = self.reusable(prompts, previous)
+        writer = OrderedSectionWriter(file, prompts)
+        for topic, response in reused.items():
+            writer.write(topic, rendering.topic_heading(topic, prompts[topic]) + rendering.response_markdown(response)
+                         + rendering.SECTION_BREAK)
+            writer.finish(topic)
+        with ThreadPoolExecutor(max_workers=max_workers or len(prompts)) as executor:
+            futures = {topic: executor.submit(contextvars.copy_context().run, self.stream_response, topic,
+                                              formatted_prompt, writer)
+                       for topic, formatted_prompt in prompts.items() if topic not in reused}
+            sections = [{"topic": topic, "prompt": formatted_prompt,
+                         "response": reused[topic] if topic in reused else futures[topic].result()}
+                        for topic, formatted_prompt in prompts.items()]
+
+        logger.info("Streaming markdown generation completed")
+        return self.artifact(industry, idea, sections, date)
 
+    def plan(self, industry: str, idea: str) -> None:
+        """Requests every topic once, for offline batch planning; deferred requests are skipped."""
+        for topic, formatted_prompt in self.format_prompts(industry, idea).items():
+            with contextlib.suppress(RequestDeferred):
+                oai.connect_api(prompt=formatted_prompt, stage=f"catalog:{topic}")
+
+    def output_path(self, output_dir="output", idea="", stable: bool = False, industry: str = None):
+        """
+        Location of the catalog document of an idea in output_dir. Nothing is created,
+        so dry runs can use it.
+
+        Args:
+            output_dir: Directory of the document.
+            idea: The business idea the catalog is generated for.
+            stable: Use the untimestamped name incremental runs update in place.
+            industry: Industry of the idea; only distinguishes the document name.
+        """
         # Format the timestamp to be filename-friendly (without spaces, colons, etc.)
         timestamp = time.strftime('%Y%m%d_%H%M%S')
+        slug = document_slug(idea, industry)
+        if stable:
+            # Incremental runs update one document per idea in place
+            return os.path.join(output_dir, f"pattern_catalog_{slug}.md")
+        return os.path.join(output_dir, f"pattern_catalog_{slug}_{timestamp}.md")
 
-        topic=topic.replace(' ',"_")
-        output="output"
-        filename=f'{filename}_{topic}_{timestamp}.md'
+    def save_content(self,content, output_dir="output",idea=""):
+        output_path = self.output_path(output_dir, idea)
+        os.makedirs(output_dir, exist_ok=True)
+        logger.info(f"Saving markdown content to file: {output_path}")
 
-        output_path = os.path.join( os.path.join(output,f"{filename}_{timestamp}.md"))
-    
-    
-        os.makedirs(output, exist_ok=True)
-        
-        
         try:
             with open(output_path, "w") as f:
                 f.write(content)
-            logger.info(f"Successfully saved markdown file: {filename}")
+            logger.info(f"Successfully saved markdown file: {output_path}")
         except Exception as e:
             logger.error(f"Error saving markdown file: {str(e)}")
             raise
     
-    def generate(self,industry:str,topic:str,output_file_name:str):
-        content=self.generate_content(industry,topic)
-        self.save_content(content,output_file_name,topic)
\ No newline at end of file
+    def generate(self,industry:str,topic:str,output_dir:str="output",max_workers:int=None,stream:bool=False,
+                 incremental:bool=False):
+        """
+        Generates the catalog markdown in output_dir and saves the stage results as a
+        JSON artifact next to it, from which engine.rendering can produce other
+        formats offline.
+
+        With incremental, the document is written to a stable, untimestamped path and
+        only the topics whose fingerprint differs from the artifact there are requested.
+
+        Topics whose request failed are written as an error marker and listed in
+        failed_topics.
+
+        Returns:
+            The path of the markdown document.
+        """
+        output_path = self.output_path(output_dir, topic, stable=incremental, industry=industry)
+        os.makedirs(output_dir, exist_ok=True)
+        previous = load_previous(artifact_path(output_path)) if incremental else None
+        if stream:
+            logger.info(f"Streaming markdown content to file: {output_path}")
+            with open(output_path, "w") as f:
+                artifact = self.stream_content(f, industry, topic, max_workers=max_workers, previous=previous)
+        else:
+            artifact = self.collect(industry, topic, max_workers=max_workers, previous=previous)
+            self._write(output_path, artifact)
+        save_artifact(artifact_path(output_path), artifact)
+        self._check(artifact)
+        return output_path
+
+    async def agenerate(self, industry: str, topic: str, output_dir: str = "output", max_in_flight: int = None,
+                        incremental: bool = False) -> str:
+        """
+        Async variant of generate (without streaming): the topics are requested on the
+        running event loop and the files are written in a worker thread.
+
+        Returns:
+            The path of the markdown document.
+        """
+        output_path = self.output_path(output_dir, topic, stable=incremental, industry=industry)
+        os.makedirs(output_dir, exist_ok=True)
+        previous = load_previous(artifact_path(output_path)) if incremental else None
+        artifact = await self.acollect(industry, topic, max_in_flight=max_in_flight, previous=previous)
+        await asyncio.to_thread(self._write, output_path, artifact)
+        await asyncio.to_thread(save_artifact, artifact_path(output_path), artifact)
+        self._check(artifact)
+        return output_path
+
+    def _check(self, artifact: dict) -> None:
+        self.failed_topics = [section["topic"] for section in artifact["data"]["sections"]
+                              if section["response"] is None]
+        if self.failed_topics:
+            logger.warning(f"{len(self.failed_topics)} catalog topics failed: {', '.join(self.failed_topics)}")
+
+    def _write(self, output_path: str, artifact: dict) -> None:
+        logger.info(f"Saving markdown content to file: {output_path}")
+        with open(output_path, "w") as f:
+            rendering.render(artifact, "markdown", f)
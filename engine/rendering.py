@@ -0,0 +1,241 @@
+"""
+Renders generation artifacts (see engine.artifact) as Marp, Markdown, HTML or JSON.
+
+Rendering works only from the stored stage results, so a document can be
+re-skinned without calling the API. Renderers produce the document as a sequence
+of chunks that are written to the file one by one.
+"""
+import html
+import io
+import json
+from typing import Any, Dict, Iterator, List, TextIO
+
+DEFAULT_THEME = "gaia"
+
+# Marp deck of the multi-agent architecture; the streaming path of genma writes the same pieces
+AGENTS_HEADING = """
+
+---
+
+## Agents Needed
+
+"""
+
+PLANS_HEADING = """
+
+---
+
+## Plans and Skills:
+
+"""
+
+ORCHESTRATION_HEADING = """
+
+---
+
+## Orchestration Operation
+
+"""
+
+# Catalog sections
+RESPONSE_LABEL = "**Response:**\n\n"
+RESPONSE_ERROR = "**Response:** Error occurred while fetching response.\n\n"
+SECTION_BREAK = "---\n\n"
+
+
+def marp_front_matter(theme: str = DEFAULT_THEME) -> str:
+    return f"---\nmarp : true\ntheme : {theme}\n---\n\n"
+
+
+def architecture_header(saas_idea: str, theme: str = DEFAULT_THEME) -> str:
+    return marp_front_matter(theme) + f"""# Multi-Agent Architecture for {saas_idea}
+
+---
+
+## Queries to Handle
+
+    """ + "\n"
+
+
+def lines_markdown(lines: List[str]) -> str:
+    return "".join(f"{line.strip()}\n" for line in lines)
+
+
+def agents_markdown(agents: List[Dict[str, str]]) -> str:
+    return "".join(f"{agent['name']}: {agent['description']}\n" if agent.get("description") else f"{agent['name']}\n"
+                   for agent in agents)
+
+
+def plans_markdown(plans_and_skills: Dict[str, Dict[str, List[str]]]) -> str:
+    markdown = ""
+    for agent, profile in plans_and_skills.items():
+        markdown += f"{agent.strip()} \n"
+        markdown += f"**Plans:**\n"
+        for plan in profile["plans"]:
+            markdown += f" {plan.strip()}\n"
+        markdown += f"**Skills:**\n"
+        for skill in profile["skills"]:
+            markdown += f" {skill.strip()}\n"
+    return markdown
+
+
+def catalog_header(date: str) -> str:
+    return f"# Business Idea Generation Session\n\nDate: {date}\n\n"
+
+
+def topic_heading(topic: str, prompt: str) -> str:
+    return f"## {topic}\n\n**Prompt:** {prompt}\n\n"
+
+
+def response_markdown(response: str) -> str:
+    """The response part of a catalog section; None marks a topic whose request failed."""
+    if response is None:
+        return RESPONSE_ERROR
+    return f"{RESPONSE_LABEL}{response}\n\n"
+
+
+class Renderer:
+    """Base class of the output formats. Subclasses yield the document for each artifact kind."""
+
+    extension = ".txt"
+
+    def chunks(self, artifact: Dict[str, Any]) -> Iterator[str]:
+        if artifact["kind"] == "architecture":
+            return self.architecture(artifact["data"])
+        return self.catalog(artifact["data"])
+
+    def architecture(self, data: Dict[str, Any]) -> Iterator[str]:
+        raise NotImplementedError
+
+    def catalog(self, data: Dict[str, Any]) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self, artifact: Dict[str, Any], file: TextIO) -> None:
+        for chunk in self.chunks(artifact):
+            file.write(chunk)
+        file.flush()
+
+
+class MarpRenderer(Renderer):
+    """Marp slide deck; the format generate_solution has always written."""
+
+    extension = ".md"
+
+    def __init__(self, theme: str = DEFAULT_THEME) -> None:
+        self.theme = theme
+
+    def architecture(self, data: Dict[str, Any]) -> Iterator[str]:
+        yield architecture_header(data["idea"], self.theme)
+        yield lines_markdown(data["queries"])
+        yield AGENTS_HEADING
+        yield agents_markdown(data["agents"])
+        yield PLANS_HEADING
+        yield plans_markdown(data["plans_and_skills"])
+        yield ORCHESTRATION_HEADING
+        yield lines_markdown(data["orchestration"])
+
+    def catalog(self, data: Dict[str, Any]) -> Iterator[str]:
+        # The catalog sections are already separated by slide breaks
+        yield marp_front_matter(self.theme)
+        yield from MarkdownRenderer().catalog(data)
+
+
+class MarkdownRenderer(Renderer):
+    """Plain Markdown document; the format the pattern catalog has always written."""
+
+    extension = ".md"
+
+    def architecture(self, data: Dict[str, Any]) -> Iterator[str]:
+        yield f"# Multi-Agent Architecture for {data['idea']}\n\n## Queries to Handle\n\n"
+        yield "".join(f"- {query}\n" for query in data["queries"])
+        yield "\n## Agents Needed\n\n"
+        yield "".join(f"- **{agent['name']}**: {agent['description']}\n" if agent.get("description")
+                      else f"- **{agent['name']}**\n" for agent in data["agents"])
+        yield "\n## Plans and Skills\n"
+        for agent, profile in data["plans_and_skills"].items():
+            yield (f"\n### {agent}\n\n**Plans:**\n\n" + "".join(f"- {plan}\n" for plan in profile["plans"])
+                   + "\n**Skills:**\n\n" + "".join(f"- {skill}\n" for skill in profile["skills"]))
+        yield "\n## Orchestration Operation\n\n"
+        yield "".join(f"{number}. {step}\n" for number, step in enumerate(data["orchestration"], 1))
+
+    def catalog(self, data: Dict[str, Any]) -> Iterator[str]:
+        yield catalog_header(data["date"])
+        for section in data["sections"]:
+            yield topic_heading(section["topic"], section["prompt"])
+            yield response_markdown(section["response"])
+            yield SECTION_BREAK
+
+
+class HTMLRenderer(Renderer):
+    """Standalone HTML page."""
+
+    extension = ".html"
+
+    def _page(self, title: str) -> str:
+        return (f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{html.escape(title)}</title>\n"
+                f"<style>body {{ font-family: sans-serif; max-width: 60em; margin: auto; }} "
+                f".response {{ white-space: pre-wrap; }}</style>\n</head>\n<body>\n<h1>{html.escape(title)}</h1>\n")
+
+    def _list(self, items: List[str], tag: str = "ul") -> str:
+        return f"<{tag}>\n" + "".join(f"<li>{html.escape(item)}</li>\n" for item in items) + f"</{tag}>\n"
+
+    def architecture(self, data: Dict[str, Any]) -> Iterator[str]:
+        yield self._page(f"Multi-Agent Architecture for {data['idea']}")
+        yield "<h2>Queries to Handle</h2>\n" + self._list(data["queries"])
+        yield "<h2>Agents Needed</h2>\n<dl>\n" + "".join(
+            f"<dt>{html.escape(agent['name'])}</dt>\n<dd>{html.escape(agent.get('description', ''))}</dd>\n"
+            for agent in data["agents"]) + "</dl>\n"
+        yield "<h2>Plans and Skills</h2>\n"
+        for agent, profile in data["plans_and_skills"].items():
+            yield (f"<h3>{html.escape(agent)}</h3>\n<h4>Plans</h4>\n" + self._list(profile["plans"])
+                   + "<h4>Skills</h4>\n" + self._list(profile["skills"]))
+        yield "<h2>Orchestration Operation</h2>\n" + self._list(data["orchestration"], "ol")
+        yield "</body>\n</html>\n"
+
+    def catalog(self, data: Dict[str, Any]) -> Iterator[str]:
+        yield self._page("Business Idea Generation Session")
+        yield f"<p>Date: {html.escape(data['date'])}</p>\n"
+        for section in data["sections"]:
+            response = section["response"]
+            yield (f"<h2>{html.escape(section['topic'])}</h2>\n"
+                   f"<p><strong>Prompt:</strong> {html.escape(section['prompt'])}</p>\n"
+                   + ("<p><strong>Response:</strong> Error occurred while fetching response.</p>\n" if response is None
+                      else f"<div class=\"response\">{html.escape(response)}</div>\n"))
+        yield "</body>\n</html>\n"
+
+
+class JSONRenderer(Renderer):
+    """The artifact itself, pretty-printed."""
+
+    extension = ".json"
+
+    def chunks(self, artifact: Dict[str, Any]) -> Iterator[str]:
+        yield from json.JSONEncoder(indent=2).iterencode(artifact)
+        yield "\n"
+
+
+RENDERERS = {
+    "marp": MarpRenderer,
+    "markdown": MarkdownRenderer,
+    "html": HTMLRenderer,
+    "json": JSONRenderer,
+}
+
+
+def get_renderer(name: str, **options) -> Renderer:
+    """Creates the renderer of a format; options (e.g. theme) are passed to formats that accept them."""
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown format '{name}' (choose from {', '.join(RENDERERS)})")
+    if name == "marp":
+        return MarpRenderer(**options)
+    return RENDERERS[name]()
+
+
+def render(artifact: Dict[str, Any], name: str, file: TextIO, **options) -> None:
+    get_renderer(name, **options).render(artifact, file)
+
+
+def render_to_string(artifact: Dict[str, Any], name: str, **options) -> str:
+    buffer = io.StringIO()
+    render(artifact, name, buffer, **options)
+    return buffer.getvalue()
@@ -1,2 +1,15 @@
-from .genma import *
+from services.lazyimport import attach
 
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "genma": ".genma",
+    "scheduler": ".scheduler",
+    "schema": ".schema",
+    "Architecture": ".schema",
+    "StageOutputError": ".schema",
+    "generate_multi_agent_architecture": ".genma",
+    "generate_solution": ".genma",
+    "agenerate_multi_agent_architecture": ".genma",
+    "agenerate_solution": ".genma",
+    "Task": ".scheduler",
+    "TaskGraph": ".scheduler",
+})
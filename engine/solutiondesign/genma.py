@@ -1,31 +1,35 @@
+import asyncio
+import contextlib
+import inspect
 import logging
 import services.openaiapi as oai
 import os
-import sys
+from dataclasses import asdict
 from datetime import datetime
 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-# Set your OpenAI API key
+from engine import rendering
+from engine.artifact import artifact_path, document_slug, new_artifact, save_artifact
+from engine.fingerprint import compare, load_previous, previous_fingerprints
+from engine.streaming import OrderedSectionWriter
+from services import telemetry
+from services.backends import RequestDeferred
+from .scheduler import Task, TaskGraph
+from .schema import (AGENTS_FORMAT, ORCHESTRATION_FORMAT, PROFILE_FORMAT, QUERIES_FORMAT, Agent, AgentProfile,
+                     Architecture, StageOutputError, parse_agents, parse_orchestration, parse_profile, parse_queries,
+                     with_format)
 
-def generate_multi_agent_architecture(saas_idea: str,output_dir="output") -> dict:
-    """
-    Generates a multi-agent architecture for a given SaaS idea using an LLM.
+logger = logging.getLogger(__name__)
 
-    Args:
-        saas_idea: A brief description of the SaaS idea.
+# Maximum number of stage calls in flight at the same time
+MAX_IN_FLIGHT = 6
 
-    Returns:
-        A dictionary containing the generated multi-agent architecture, including:
-            - queries
-            - agents
-            - plans_and_skills
-            - orchestration
-    """
+# Requests per stage before a malformed response is given up on
+STAGE_ATTEMPTS = 3
 
-    # 1. Generate Queries
-    
-    queries_prompt=f"""
-    Based on the SaaS idea '{saas_idea}', what are 10 common user queries that the system would need to handle?
+# Models accepting response_format={"type": "json_object"}; others rely on the prompt instructions
+JSON_MODE_MODEL_PREFIXES = ("gpt-4o", "gpt-4-turbo", "gpt-4-1106", "gpt-4-0125", "gpt-3.5-turbo")
+
+QUERIES_CRITERIA = """
     use te following criteria to define the queries of a multi-agent architecture:
     1. Relevance: The query should be relevant to the system's purpose and goals[1][2].
 
@@ -69,12 +73,19 @@ def generate_multi_agent_architecture(saas_idea: str,output_dir="output") -> dic
     
     
     """
-    queries = oai.connect_api(prompt=queries_prompt).split('\n')
 
-    # 2. Generate Agents
-    
-    agents_prompt=f"""
-        Based on the SaaS idea '{saas_idea}', what are 5 agents that could be used to build a multi-agent architecture?
+
+def queries_question(saas_idea: str) -> str:
+    """The variable part of the user queries stage prompt."""
+    return f"Based on the SaaS idea '{saas_idea}', what are 10 common user queries that the system would need to handle?"
+
+
+def queries_prompt(saas_idea: str) -> str:
+    """Builds the prompt for the user queries stage."""
+    return f"\n    {queries_question(saas_idea)}{QUERIES_CRITERIA}"
+
+
+AGENTS_CRITERIA = """
         
         Use te following criteria to define the agents in a multi-agent architecture
 
@@ -130,12 +141,19 @@ def generate_multi_agent_architecture(saas_idea: str,output_dir="output") -> dic
 
         
         """
-    agents = oai.connect_api(prompt=agents_prompt).split("\n")
 
-    # 3. Generate Plans and Skills
-    plans_and_skills = {}
-    for agent in agents:
-       agent_prompt=f"""For the agent '{agent}', what are its 3 main plans and 3 core skills?
+
+def agents_question(saas_idea: str) -> str:
+    """The variable part of the agents stage prompt."""
+    return f"Based on the SaaS idea '{saas_idea}', what are 5 agents that could be used to build a multi-agent architecture?"
+
+
+def agents_prompt(saas_idea: str) -> str:
+    """Builds the prompt for the agents stage."""
+    return f"\n        {agents_question(saas_idea)}{AGENTS_CRITERIA}"
+
+
+PROFILE_CRITERIA = """
        Use the following criteria to define the plans and skills of an agent in a multi-agent architecture:
        
         ## Agent Specialization
@@ -230,15 +248,18 @@ def generate_multi_agent_architecture(saas_idea: str,output_dir="output") -> dic
        
        """
 
-       response = oai.connect_api(prompt=agent_prompt)
-       plans_and_skills[agent] = {
-            "plans": response.split("\n")[0:3],
-            "skills": response.split("\n")[3:6]
-        }
 
-    # 4. Generate Orchestration
-    
-    orchestrator_prompt=f"""Based on the SaaS idea '{saas_idea}' and the agents you generated, describe the orchestration process for handling user queries.
+def agent_question(agent: str) -> str:
+    """The variable part of the plans and skills of a single agent prompt."""
+    return f"For the agent '{agent}', what are its 3 main plans and 3 core skills?"
+
+
+def agent_prompt(agent: str) -> str:
+    """Builds the prompt for the plans and skills of a single agent."""
+    return f"{agent_question(agent)}{PROFILE_CRITERIA}"
+
+
+ORCHESTRATION_CRITERIA = """
     
     Use the following criteria to define the orchestration process in a multi-agent architecture:
     
@@ -327,95 +348,357 @@ def generate_multi_agent_architecture(saas_idea: str,output_dir="output") -> dic
                             
     
     """
-    
-    orchestration = oai.connect_api(prompt=orchestrator_prompt).split("\n")
-    
+
+
+def orchestrator_question(saas_idea: str) -> str:
+    """The variable part of the orchestration stage prompt."""
+    return f"Based on the SaaS idea '{saas_idea}' and the agents you generated, describe the orchestration process for handling user queries."
+
+
+def orchestrator_prompt(saas_idea: str) -> str:
+    """Builds the prompt for the orchestration stage."""
+    return f"{orchestrator_question(saas_idea)}{ORCHESTRATION_CRITERIA}"
+
+
+def stage_messages(question: str, criteria: str, instructions: str) -> tuple:
+    """
+    Lays out a stage request as (system message, user message).
+
+    With the default "inline" layout the criteria and format instructions follow the
+    question in the user message. The "prefix" layout (PROMPT_LAYOUT=prefix) moves
+    them into the system message, so every request of a stage starts with the same
+    static block and only the short question varies, which lets the provider reuse
+    its cached prefix across ideas and agents.
+    """
+    layout = oai.get_config().prompt_layout
+    if layout == "prefix":
+        return f"{oai.DEFAULT_SYSTEM}\n\n{criteria}\n\n{instructions}", question
+    if layout == "inline":
+        return oai.DEFAULT_SYSTEM, with_format(f"{question}{criteria}", instructions)
+    raise ValueError(f"Unknown prompt layout: {layout}")
+
+
+def _stage(stage: str, question: str, criteria: str, instructions: str, parse):
+    """
+    Requests a stage as JSON and returns the validated, typed result. parse also
+    validates the response before it is cached, so a malformed one is never stored;
+    it is requested again, up to STAGE_ATTEMPTS times in all.
+    """
+    with telemetry.span("genma.stage", stage=stage):
+        system, prompt = stage_messages(question, criteria, instructions)
+        for attempt in range(1, STAGE_ATTEMPTS + 1):
+            try:
+                response = oai.connect_api(system=system, prompt=prompt, stage=stage, validate=parse,
+                                           **json_mode(oai.route(stage)["model"]))
+                return parse(response)
+            except StageOutputError as e:
+                _retry_or_raise(e, attempt)
+
+
+async def _astage(stage: str, question: str, criteria: str, instructions: str, parse):
+    """Async variant of _stage, through aconnect_api."""
+    with telemetry.span("genma.stage", stage=stage):
+        system, prompt = stage_messages(question, criteria, instructions)
+        for attempt in range(1, STAGE_ATTEMPTS + 1):
+            try:
+                response = await oai.aconnect_api(system=system, prompt=prompt, stage=stage, validate=parse,
+                                                  **json_mode(oai.route(stage)["model"]))
+                return parse(response)
+            except StageOutputError as e:
+                _retry_or_raise(e, attempt)
+
+
+def _retry_or_raise(error: StageOutputError, attempt: int) -> None:
+    """Logs a malformed stage response, raising it once the stage is out of attempts."""
+    if attempt >= STAGE_ATTEMPTS:
+        raise error
+    logger.warning(f"{error} (attempt {attempt} of {STAGE_ATTEMPTS}); requesting the stage again")
+
+
+def _then(result, fn):
+    """Applies fn to a stage result, once it is available if the stage is awaitable."""
+    if inspect.isawaitable(result):
+        async def chained():
+            return fn(await result)
+        return chained()
+    return fn(result)
+
+
+def json_mode(model: str) -> dict:
+    """Extra request parameters enabling the provider's JSON mode, for models that support it."""
+    if model.startswith(JSON_MODE_MODEL_PREFIXES):
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+def _idea_stages(saas_idea: str) -> dict:
+    """The _stage arguments of the stages that only depend on the idea, by task name."""
     return {
-        "queries": queries,
-        "agents": agents,
-        "plans_and_skills": plans_and_skills,
-        "orchestration": orchestration
+        "queries": ("queries", queries_question(saas_idea), QUERIES_CRITERIA, QUERIES_FORMAT, parse_queries),
+        "agents": ("agents", agents_question(saas_idea), AGENTS_CRITERIA, AGENTS_FORMAT, parse_agents),
+        "orchestration": ("orchestration", orchestrator_question(saas_idea), ORCHESTRATION_CRITERIA,
+                          ORCHESTRATION_FORMAT, parse_orchestration),
     }
 
-def generate_solution(saas_idea: str,output="output") -> str:
+
+def _agent_stage(agent: str) -> tuple:
+    return ("plans_and_skills", agent_question(agent), PROFILE_CRITERIA, PROFILE_FORMAT, parse_profile)
+
+
+def stage_fingerprint(stage: tuple) -> str:
+    """Fingerprints a stage by its request: template, embedded upstream results and model parameters."""
+    name, question, criteria, instructions, _ = stage
+    system, prompt = stage_messages(question, criteria, instructions)
+    return oai.request_fingerprint(system=system, prompt=prompt, stage=name, **json_mode(oai.route(name)["model"]))
+
+
+def generate_multi_agent_architecture(saas_idea: str,output_dir="output",max_in_flight: int = MAX_IN_FLIGHT,
+                                      sink=None, previous: dict = None) -> Architecture:
     """
-Generates Marp Markdown for the multi-agent architecture.
+    Generates a multi-agent architecture for a given SaaS idea using an LLM.
 
-Args:
-    saas_idea: The SaaS idea.
+    The stages are declared as a task graph. Queries, agents and orchestration do
+    not depend on each other and run in parallel; once the agents are known, one
+    plans/skills node per agent is added and those run in parallel too. Every stage
+    is requested as JSON and validated, so the fan-out is exactly one call per agent.
 
-Returns:
-    Marp Markdown string.
-"""
+    Args:
+        saas_idea: A brief description of the SaaS idea.
+        max_in_flight: Maximum number of stage calls running at the same time.
+        sink: Optional OrderedSectionWriter. When given, each section is written to
+            it as soon as its stage completes.
+        previous: Artifact of an earlier run. Stages whose fingerprint is unchanged
+            reuse its results instead of being requested again.
+
+    Returns:
+        The typed Architecture (queries, agents, plans_and_skills, orchestration,
+        the seconds spent in each stage node and the stage fingerprints).
+
+    Raises:
+        StageOutputError: A stage response is not valid JSON of the expected shape.
+    """
+    graph, fingerprints = _architecture_graph(saas_idea, max_in_flight, sink, previous, _stage)
+    return _architecture(graph, graph.run(), fingerprints)
 
-    architecture = generate_multi_agent_architecture(saas_idea)
 
-    markdown = f"""---
-marp : true
-theme : gaia
----
+async def agenerate_multi_agent_architecture(saas_idea: str, max_in_flight: int = MAX_IN_FLIGHT,
+                                             previous: dict = None) -> Architecture:
+    """
+    Async variant of generate_multi_agent_architecture: the same stage graph, run
+    as tasks on the running event loop with every request sent through aconnect_api.
+    """
+    graph, fingerprints = _architecture_graph(saas_idea, max_in_flight, None, previous, _astage)
+    return _architecture(graph, await graph.arun(), fingerprints)
 
-# Multi-Agent Architecture for {saas_idea}
 
----
+def _architecture_graph(saas_idea: str, max_in_flight: int, sink, previous: dict, request) -> tuple:
+    """
+    Declares the stage graph of generate_multi_agent_architecture.
 
-## Queries to Handle
+    Args:
+        request: Runs a stage (_stage, or the async _astage; tasks then return
+            awaitables for TaskGraph.arun).
 
+    Returns:
+        The TaskGraph and the dict its stages record their fingerprints in.
     """
-    markdown += "\n"
-    for query in architecture["queries"]:
-        markdown += f"{query.strip()}\n"
+    stages = _idea_stages(saas_idea)
+    previous_data = previous["data"] if previous else {}
+    known = previous_fingerprints(previous)
+    fingerprints = {}
+
+    def run(name: str, stage: tuple, restore):
+        fingerprints[name] = stage_fingerprint(stage)
+        if known.get(name) == fingerprints[name]:
+            logger.info(f"Stage '{name}' unchanged; reusing the previous result")
+            return restore()
+        return request(*stage)
+
+    def emit(stage: str, render):
+        def written(result):
+            if sink is not None:
+                sink.write(stage, render(result))
+                sink.finish(stage)
+            return result
+        return written
+
+    def queries_task(deps):
+        return _then(run("queries", stages["queries"], lambda: list(previous_data["queries"])),
+                     emit("queries", rendering.lines_markdown))
+
+    def agents_task(deps):
+        return _then(run("agents", stages["agents"], lambda: [Agent(**agent) for agent in previous_data["agents"]]),
+                     emit("agents", lambda agents: rendering.agents_markdown([asdict(agent) for agent in agents])))
+
+    def orchestration_task(deps):
+        return _then(run("orchestration", stages["orchestration"], lambda: list(previous_data["orchestration"])),
+                     emit("orchestration", rendering.lines_markdown))
+
+    def plans_and_skills_task(agent: Agent) -> Task:
+        name = f"agent:{agent.name}"
+        return Task(name,
+                    lambda deps: run(name, _agent_stage(agent.name),
+                                     lambda: AgentProfile(**previous_data["plans_and_skills"][agent.name])),
+                    deps=("agents",))
+
+    graph = TaskGraph(max_in_flight=max_in_flight)
+    # 1. Generate Queries
+    graph.add(Task("queries", queries_task))
+    # 2. Generate Agents, then 3. fan out Plans and Skills per agent
+    graph.add(Task("agents", agents_task, expand=lambda agents: [plans_and_skills_task(a) for a in agents]))
+    # 4. Generate Orchestration
+    graph.add(Task("orchestration", orchestration_task))
+    return graph, fingerprints
 
-    markdown += """
 
----
+def _architecture(graph: TaskGraph, results: dict, fingerprints: dict) -> Architecture:
+    agents = results["agents"]
+    return Architecture(
+        queries=results["queries"],
+        agents=agents,
+        plans_and_skills={agent.name: results[f"agent:{agent.name}"] for agent in agents},
+        orchestration=results["orchestration"],
+        timings=graph.timings,
+        fingerprints=fingerprints
+    )
 
-## Agents Needed
 
-"""
-    i=0
-    for agent in architecture["agents"]:
-        markdown += f"{agent.strip()}\n"
-    markdown += """
+def architecture_changes(saas_idea: str, previous: dict = None) -> dict:
+    """
+    Dry run of an incremental generation: which stages would be recomputed.
 
----
+    Per-agent stages can only be fingerprinted when the agents stage is reused;
+    otherwise they are reported as one pending "agent:*" entry.
 
-## Plans and Skills:
+    Returns:
+        The status of each stage (see engine.fingerprint.compare).
+    """
+    known = previous_fingerprints(previous)
+    current = {name: stage_fingerprint(stage) for name, stage in _idea_stages(saas_idea).items()}
+    if previous is not None and current["agents"] == known.get("agents"):
+        for agent in previous["data"]["agents"]:
+            current[f"agent:{agent['name']}"] = stage_fingerprint(_agent_stage(agent["name"]))
+    else:
+        current["agent:*"] = None
+        known = {name: fingerprint for name, fingerprint in known.items() if not name.startswith("agent:")}
+    return compare(current, known)
+
+
+def plan_architecture(saas_idea: str) -> None:
+    """
+    Walks every stage whose inputs are available, for offline batch planning.
 
-"""
-    for agent, data in architecture["plans_and_skills"].items():
-        markdown += f"{agent.strip()} \n"
-        markdown += f"**Plans:**\n"
-        for plan in data["plans"]:
-            markdown += f" {plan.strip()}\n"
-        markdown += f"**Skills:**\n"
-        for skill in data["skills"]:
-            markdown += f" {skill.strip()}\n"
+    Requests deferred by the planning backend are skipped; the per-agent stages are
+    only reached once the agents response is cached (a later planning round).
+    """
+    stages = _idea_stages(saas_idea)
+    for name in ("queries", "orchestration"):
+        with contextlib.suppress(RequestDeferred):
+            _stage(*stages[name])
+    try:
+        agents = _stage(*stages["agents"])
+    except RequestDeferred:
+        return
+    for agent in agents:
+        with contextlib.suppress(RequestDeferred):
+            _stage(*_agent_stage(agent.name))
+
+
+def _output_path(saas_idea: str, output: str, stable: bool = False, industry: str = None) -> str:
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    # The idea is part of the name so parallel batch jobs do not overwrite each other
+    slug = document_slug(saas_idea, industry)
+    # Incremental runs update one document per idea in place
+    name = f"ma_architecture_{slug}.md" if stable else f"ma_architecture_{slug}_{timestamp}.md"
+
+    return os.path.join( os.path.join(output,name))
 
-    markdown += """
+def architecture_artifact(saas_idea: str, architecture: Architecture) -> dict:
+    """Wraps an Architecture in a versioned artifact (see engine.artifact)."""
+    return new_artifact("architecture", {"idea": saas_idea, **architecture.to_dict()}, idea=saas_idea)
 
----
+def generate_solution(saas_idea: str,output="output",stream: bool = False,incremental: bool = False,
+                      industry: str = None) -> str:
+    """
+Generates Marp Markdown for the multi-agent architecture.
+
+The stage results are also saved as a JSON artifact next to the deck, from which
+engine.rendering can produce other formats without calling the API again.
 
-## Orchestration Operation
+Args:
+    saas_idea: The SaaS idea.
+    stream: Write each section of the deck as soon as its stage completes,
+        instead of once every stage has completed.
+    incremental: Write to a stable, untimestamped path and only recompute the
+        stages whose fingerprint differs from the artifact already there.
+    industry: Industry of the idea; only distinguishes the document name.
 
+Returns:
+    Marp Markdown string.
 """
+    with open(write_solution(saas_idea, output, stream, incremental, industry)) as file:
+        return file.read()
 
-    #markdown += architecture["orchestration"].strip()
-    for orch in architecture["orchestration"]:
-        markdown += f"{orch.strip()}\n"
-        
+def write_solution(saas_idea: str, output="output", stream: bool = False, incremental: bool = False,
+                   industry: str = None) -> str:
+    """Generates the deck and its artifact like generate_solution, and returns the path of the deck."""
+    output_path = _output_path(saas_idea, output, stable=incremental, industry=industry)
+    os.makedirs(output, exist_ok=True)
+    previous = load_previous(artifact_path(output_path)) if incremental else None
+    if stream:
+        return _stream_solution(saas_idea, output_path, previous)
 
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    
-    output_path = os.path.join( os.path.join(output,f"ma_architecture_{timestamp}.md"))
-    
-    
+    architecture = generate_multi_agent_architecture(saas_idea, previous=previous)
+    _save_solution(output_path, architecture_artifact(saas_idea, architecture))
+    return output_path
+
+async def awrite_solution(saas_idea: str, output="output", incremental: bool = False, industry: str = None) -> str:
+    """
+    Async variant of write_solution (without streaming): the stages run on the
+    running event loop and the files are written in a worker thread.
+    """
+    output_path = _output_path(saas_idea, output, stable=incremental, industry=industry)
     os.makedirs(output, exist_ok=True)
+    previous = load_previous(artifact_path(output_path)) if incremental else None
+    architecture = await agenerate_multi_agent_architecture(saas_idea, previous=previous)
+    await asyncio.to_thread(_save_solution, output_path, architecture_artifact(saas_idea, architecture))
+    return output_path
+
+async def agenerate_solution(saas_idea: str, output="output", incremental: bool = False,
+                             industry: str = None) -> str:
+    """Async variant of generate_solution: returns the Marp Markdown of the deck."""
+    with open(await awrite_solution(saas_idea, output, incremental, industry)) as file:
+        return file.read()
+
+def _save_solution(output_path: str, artifact: dict) -> None:
+    save_artifact(artifact_path(output_path), artifact)
     with open(output_path, 'w') as file:
-        file.write(markdown)
+        rendering.render(artifact, "marp", file)
 
-    
-    return markdown
+def _stream_solution(saas_idea: str, output_path: str, previous: dict = None) -> str:
+    """Writes the deck section by section as the stages complete, then its artifact; returns the deck path."""
+    logger.info(f"Streaming solution design to {output_path}")
+    with open(output_path, 'w') as file:
+        file.write(rendering.architecture_header(saas_idea))
+        file.flush()
+        sink = OrderedSectionWriter(file, ["queries", "agents", "plans", "orchestration"])
+        sink.write("agents", rendering.AGENTS_HEADING)
+        sink.write("plans", rendering.PLANS_HEADING)
+        sink.write("orchestration", rendering.ORCHESTRATION_HEADING)
+
+        architecture = generate_multi_agent_architecture(saas_idea, sink=sink, previous=previous)
+
+        artifact = architecture_artifact(saas_idea, architecture)
+        sink.write("plans", rendering.plans_markdown(artifact["data"]["plans_and_skills"]))
+        sink.finish("plans")
+
+    save_artifact(artifact_path(output_path), artifact)
+    return output_path
+
+def solution_changes(saas_idea: str, output: str = "output", industry: str = None) -> dict:
+    """Dry run of generate_solution(incremental=True): the status of each stage."""
+    return architecture_changes(saas_idea, load_previous(artifact_path(
+        _output_path(saas_idea, output, stable=True, industry=industry))))
 
 
 if __name__ == "__main__":  
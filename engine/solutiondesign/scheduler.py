@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    """
+    A node of the stage graph.
+
+    Args:
+        name: Unique name of the node. Its result is stored under this name.
+        fn: Callable receiving a dict with the results of its dependencies.
+        deps: Names of the nodes that must complete before this one starts.
+        expand: Optional callable receiving this node's result and returning new
+            tasks to add to the graph (used for per-item fan-out).
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 expand: Optional[Callable[[Any], List["Task"]]] = None) -> None:
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.expand = expand
+
+
+class TaskGraph:
+    """
+    Runs a small task DAG, executing independent nodes in parallel.
+
+    Args:
+        max_in_flight: Maximum number of nodes running at the same time.
+    """
+
+    def __init__(self, max_in_flight: int = 4) -> None:
+        self.max_in_flight = max_in_flight
+        self.tasks: Dict[str, Task] = {}
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(self, task: Task) -> None:
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task name: {task.name}")
+        self.tasks[task.name] = task
+
+    def _ready(self, pending: Dict[str, Task], running: int) -> List[Task]:
+        """Removes and returns the pending nodes whose dependencies have completed, up to max_in_flight."""
+        ready = []
+        for name, task in list(pending.items()):
+            if running + len(ready) >= self.max_in_flight:
+                break
+            missing = [dep for dep in task.deps if dep not in self.results]
+            if any(dep not in self.tasks for dep in missing):
+                raise ValueError(f"Task '{name}' depends on unknown task(s): {missing}")
+            if missing:
+                continue
+            ready.append(task)
+            del pending[name]
+        return ready
+
+    def _complete(self, task: Task, result: Any, pending: Dict[str, Task]) -> None:
+        self.results[task.name] = result
+        if task.expand is not None:
+            for new_task in task.expand(result):
+                self.add(new_task)
+                pending[new_task.name] = new_task
+
+    def _deps(self, task: Task) -> Dict[str, Any]:
+        return {dep: self.results[dep] for dep in task.deps}
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Executes every node once all of its dependencies have completed.
+
+        Returns:
+            A dictionary mapping node names to their results.
+        """
+        pending = dict(self.tasks)
+        running = {}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while pending or running:
+                for task in self._ready(pending, len(running)):
+                    # Tasks run in a copy of the caller's context, so context variables
+                    # (the current telemetry span, the run deadline) carry over
+                    future = executor.submit(contextvars.copy_context().run, self._timed, task, self._deps(task))
+                    running[future] = task
+
+                if not running:
+                    raise ValueError(f"Dependency cycle between tasks: {sorted(pending)}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    self._complete(task, future.result(), pending)
+
+        logger.info(f"Task graph completed {len(self.results)} nodes in "
+                    f"{time.perf_counter() - started:.2f}s")
+        return self.results
+
+    async def arun(self) -> Dict[str, Any]:
+        """
+        Async variant of run: the nodes run as tasks on the running event loop.
+
+        A node function may return an awaitable, which is awaited; other results
+        are taken as they are. If a node fails, the running nodes are cancelled.
+
+        Returns:
+            A dictionary mapping node names to their results.
+        """
+        pending = dict(self.tasks)
+        running = {}
+        started = time.perf_counter()
+
+        try:
+            while pending or running:
+                for task in self._ready(pending, len(running)):
+                    # Tasks copy the caller's context, like the worker threads of run
+                    running[asyncio.ensure_future(self._atimed(task, self._deps(task)))] = task
+
+                if not running:
+                    raise ValueError(f"Dependency cycle between tasks: {sorted(pending)}")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    self._complete(task, future.result(), pending)
+        finally:
+            for future in running:
+                future.cancel()
+
+        logger.info(f"Task graph completed {len(self.results)} nodes in "
+                    f"{time.perf_counter() - started:.2f}s")
+        return self.results
+
+    def _timed(self, task: Task, deps: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            return task.fn(deps)
+        finally:
+            self.timings[task.name] = time.perf_counter() - started
+            logger.info(f"Task '{task.name}' finished in {self.timings[task.name]:.2f}s")
+
+    async def _atimed(self, task: Task, deps: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = task.fn(deps)
+            return await result if inspect.isawaitable(result) else result
+        finally:
+            self.timings[task.name] = time.perf_counter() - started
+            logger.info(f"Task '{task.name}' finished in {self.timings[task.name]:.2f}s")
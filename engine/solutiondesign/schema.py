@@ -0,0 +1,106 @@
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List
+
+# Output format instructions appended to each stage prompt
+QUERIES_FORMAT = ('Respond only with a JSON object of the form {"queries": ["<query>", ...]} '
+                  'containing the 10 queries, one sentence each.')
+AGENTS_FORMAT = ('Respond only with a JSON object of the form '
+                 '{"agents": [{"name": "<agent name>", "description": "<one sentence role>"}, ...]} '
+                 'containing the 5 agents.')
+PROFILE_FORMAT = ('Respond only with a JSON object of the form '
+                  '{"plans": ["<plan>", "<plan>", "<plan>"], "skills": ["<skill>", "<skill>", "<skill>"]}.')
+ORCHESTRATION_FORMAT = ('Respond only with a JSON object of the form {"steps": ["<step>", ...]} '
+                        'with at most 10 steps of one or two sentences each.')
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class StageOutputError(ValueError):
+    """A stage response is not valid JSON or does not match the expected shape."""
+
+    def __init__(self, stage: str, message: str, response: str = "") -> None:
+        super().__init__(f"Invalid '{stage}' output: {message}")
+        self.stage = stage
+        self.response = response
+
+
+@dataclass
+class Agent:
+    name: str
+    description: str = ""
+
+
+@dataclass
+class AgentProfile:
+    plans: List[str]
+    skills: List[str]
+
+
+@dataclass
+class Architecture:
+    """Typed result of generate_multi_agent_architecture."""
+
+    queries: List[str]
+    agents: List[Agent]
+    plans_and_skills: Dict[str, AgentProfile]
+    orchestration: List[str]
+    timings: Dict[str, float] = field(default_factory=dict)
+    fingerprints: Dict[str, str] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def with_format(prompt: str, instructions: str) -> str:
+    return f"{prompt}\n\n{instructions}"
+
+
+def _load(stage: str, response: str) -> dict:
+    try:
+        data = json.loads(_FENCE.sub("", response.strip()))
+    except ValueError as e:
+        raise StageOutputError(stage, f"not valid JSON ({e})", response) from e
+    if not isinstance(data, dict):
+        raise StageOutputError(stage, "expected a JSON object", response)
+    return data
+
+
+def _strings(stage: str, data: dict, name: str, response: str) -> List[str]:
+    value = data.get(name)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise StageOutputError(stage, f"'{name}' must be a list of strings", response)
+    items = [item.strip() for item in value if item.strip()]
+    if not items:
+        raise StageOutputError(stage, f"'{name}' is empty", response)
+    return items
+
+
+def parse_queries(response: str) -> List[str]:
+    return _strings("queries", _load("queries", response), "queries", response)
+
+
+def parse_agents(response: str) -> List[Agent]:
+    data = _load("agents", response)
+    value = data.get("agents")
+    if not isinstance(value, list) or not value:
+        raise StageOutputError("agents", "'agents' must be a non-empty list", response)
+    agents = {}
+    for item in value:
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str) or not item["name"].strip():
+            raise StageOutputError("agents", "each agent needs a 'name'", response)
+        description = item.get("description") if isinstance(item.get("description"), str) else ""
+        # Duplicate names would only repeat the same per-agent call
+        agents.setdefault(item["name"].strip(), Agent(item["name"].strip(), description.strip()))
+    return list(agents.values())
+
+
+def parse_profile(response: str) -> AgentProfile:
+    data = _load("plans_and_skills", response)
+    return AgentProfile(plans=_strings("plans_and_skills", data, "plans", response),
+                        skills=_strings("plans_and_skills", data, "skills", response))
+
+
+def parse_orchestration(response: str) -> List[str]:
+    return _strings("orchestration", _load("orchestration", response), "steps", response)
@@ -0,0 +1,49 @@
+import threading
+from typing import Dict, Iterable, List, TextIO
+
+
+class OrderedSectionWriter:
+    """
+    Writes document sections produced concurrently to a file, in document order.
+
+    Text for the section currently being written goes straight to the file (and is
+    flushed); text for later sections is buffered until every section before them
+    has finished.
+
+    Args:
+        file: The open output file.
+        sections: The section names, in document order.
+    """
+
+    def __init__(self, file: TextIO, sections: Iterable[str]) -> None:
+        self.file = file
+        self.sections: List[str] = list(sections)
+        self._buffers: Dict[str, List[str]] = {name: [] for name in self.sections}
+        self._finished = set()
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def write(self, section: str, text: str) -> None:
+        with self._lock:
+            if self._is_current(section):
+                self.file.write(text)
+                self.file.flush()
+            else:
+                self._buffers[section].append(text)
+
+    def finish(self, section: str) -> None:
+        """Marks a section as complete, writing any buffered sections that follow it."""
+        with self._lock:
+            self._finished.add(section)
+            while self._current < len(self.sections) and self.sections[self._current] in self._finished:
+                self._current += 1
+                if self._current < len(self.sections):
+                    self._flush_buffer(self.sections[self._current])
+            self.file.flush()
+
+    def _is_current(self, section: str) -> bool:
+        return self._current < len(self.sections) and self.sections[self._current] == section
+
+    def _flush_buffer(self, section: str) -> None:
+        self.file.write("".join(self._buffers[section]))
+        self._buffers[section] = []
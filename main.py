@@ -1,11 +1,210 @@
+import argparse
 import models as m
-import logging
+import services.openaiapi as oai
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from engine.fingerprint import format_changes
+from services import telemetry
+from services.config import Config, setup_logging
+from services.usage import format_routing, format_usage
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate business idea catalogs and multi-agent solution designs.")
+    parser.add_argument("--stream", action="store_true", help="write the documents while the responses stream in")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update one document per idea, recomputing only stages whose inputs changed")
+    parser.add_argument("--timeout", type=float,
+                        help="deadline in seconds for generating one idea (default: RUN_TIMEOUT, none)")
+    parser.add_argument("--profile",
+                        help="routing profile: default, fast, balanced, quality or one of ROUTING_FILE "
+                             "(default: ROUTING_PROFILE)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --incremental: report which stages would be recomputed, without generating")
+    commands = parser.add_subparsers(dest="command")
+
+    batch = commands.add_parser("batch", help="generate every (industry, idea, output_dir) row of a CSV/JSONL file")
+    batch.add_argument("jobs", help="CSV (with header) or JSONL file with industry, idea and optional output_dir")
+    batch.add_argument("--workers", type=int, default=4, help="number of ideas generated in parallel")
+    batch.add_argument("--journal", help="progress journal used to resume (default: <jobs>.journal)")
+    batch.add_argument("--output-dir", default="output", help="output directory for rows that do not set one")
+    batch.add_argument("--dedup", action="store_true",
+                       help="send requests shared across ideas (e.g. industry-only topics) once, before generating")
+
+    offline = commands.add_parser("offline", help="two-phase generation through the provider's Batch API")
+    phases = offline.add_subparsers(dest="phase", required=True)
+    plan = phases.add_parser("plan", help="write every uncached request of the jobs to a Batch API requests file")
+    plan.add_argument("jobs", help="CSV (with header) or JSONL file with industry, idea and optional output_dir")
+    plan.add_argument("requests", help="requests JSONL to write")
+    plan.add_argument("--output-dir", default="output", help="output directory for rows that do not set one")
+    ingest = phases.add_parser("ingest", help="load a Batch API results file into the response cache")
+    ingest.add_argument("results", help="results JSONL downloaded from the Batch API")
+    ingest.add_argument("--requests", help="the matching requests JSONL, for cache-miss attribution")
+    simulate = phases.add_parser("simulate", help="answer a requests file with the local fake backend")
+    simulate.add_argument("requests", help="requests JSONL")
+    simulate.add_argument("results", help="results JSONL to write")
+
+    serve = commands.add_parser("serve", help="run the generation service: an HTTP job queue with warm client/cache")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8090)
+    serve.add_argument("--workers", type=int, default=2, help="number of jobs generated in parallel")
+    serve.add_argument("--max-queue", type=int, default=100, help="queued jobs accepted before refusing new ones")
+    serve.add_argument("--output-dir", default="output", help="output directory for jobs that do not set one")
+
+    cache = commands.add_parser("cache", help="inspect and maintain the response cache (SQLite backend)")
+    actions = cache.add_subparsers(dest="action", required=True)
+    stats = actions.add_parser("stats", help="size, entries, age histogram and per-stage breakdown")
+    stats.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    prune = actions.add_parser("prune", help="remove entries by age, total size or reachability")
+    prune.add_argument("--older-than", help="remove entries not read for this long, e.g. 30d or 12h")
+    prune.add_argument("--max-size", help="remove the least recently read entries beyond this size, e.g. 500MB")
+    prune.add_argument("--orphans", action="store_true",
+                       help="remove entries of outdated key versions and superseded prompt versions")
+    prune.add_argument("--dry-run", action="store_true", help="only report what would be removed")
+    actions.add_parser("compact", help="fold the write-ahead log into the database and reclaim free space")
+    export = actions.add_parser("export", help="write the entries to a compressed, checksummed bundle")
+    export.add_argument("bundle", help="bundle to write, e.g. cache.jsonl.gz")
+    export.add_argument("--stage", help="only entries of matching stages, e.g. 'catalog:*'")
+    export.add_argument("--newer-than", help="only entries created within this long, e.g. 7d")
+    load = actions.add_parser("import", help="verify a bundle and load its entries")
+    load.add_argument("bundle", help="bundle written by 'cache export'")
+    load.add_argument("--overwrite", action="store_true", help="replace entries the cache already has")
+
+    render = commands.add_parser("render", help="render a saved JSON artifact in another format (no API calls)")
+    render.add_argument("artifact", help="the .json artifact written next to a generated document")
+    render.add_argument("--format", default="marp", choices=["marp", "markdown", "html", "json"])
+    render.add_argument("--theme", help="Marp theme (marp format only)")
+    render.add_argument("--output", help="file to write (default: standard output)")
+    return parser.parse_args()
+
+
+def run_offline(args):
+    from services import batchapi
+    from services.backends import FakeBackend
+
+    if args.phase == "plan":
+        count = m.plan_offline(m.iter_jobs(args.jobs, args.output_dir), args.requests)
+        if count:
+            print(f"{count} requests written to {args.requests}; submit them, ingest the results and plan again")
+        else:
+            print("Every request is cached; run 'batch' to generate the documents from cache")
+    elif args.phase == "ingest":
+        counts = batchapi.ingest_results(args.results, oai.get_cache(), args.requests)
+        print(f"Ingested {counts['ingested']} results ({counts['failed']} failed)")
+    elif args.phase == "simulate":
+        print(f"Wrote {batchapi.simulate_results(args.requests, args.results, FakeBackend())} results")
+
+
+def print_report():
+    print(format_usage(oai.get_usage()))
+    routing = oai.get_routing_report()
+    if routing:
+        print(format_routing(oai.get_routing().name, routing))
+    print(telemetry.format_summary(telemetry.get_telemetry().summary()))
+    hedging = oai.get_hedger().stats()
+    if hedging:
+        print(f"hedging: {hedging['hedged']} of {hedging['calls']} calls hedged, "
+              f"{hedging['hedge_wins']} won by the hedge (hedge after {hedging['hedge_after_ms']} ms)")
+
+
+def print_changes(solution):
+    for document, changes in solution.changes().items():
+        print(format_changes(f"{document} '{solution.idea}'", changes))
+
+
+def run_serve(args):
+    import asyncio
+
+    service = m.JobService(workers=args.workers, max_queue=args.max_queue, output_dir=args.output_dir)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_cache(args):
+    import json
+    from services import cachemaint
+    from services.cache import create_cache
+
+    config = oai.get_config()
+    if config.cache_backend != "sqlite":
+        raise SystemExit("Cache maintenance needs the sqlite backend (import JSON files with python -m services.cache)")
+    # With the configured cap, so an import evicts like any other write
+    store = create_cache("sqlite", config.cache_dir, ttl=config.cache_ttl, max_bytes=config.cache_max_bytes)
+    try:
+        if args.action == "stats":
+            stats = cachemaint.cache_stats(store)
+            print(json.dumps(stats, indent=2) if args.json else cachemaint.format_stats(stats))
+        elif args.action == "prune":
+            result = cachemaint.prune(
+                store, older_than=cachemaint.parse_duration(args.older_than) if args.older_than else None,
+                max_bytes=cachemaint.parse_size(args.max_size) if args.max_size else None,
+                orphans=args.orphans, dry_run=args.dry_run)
+            removed = result["age"] + result["orphan"] + result["size"]
+            print(f"{'Would remove' if args.dry_run else 'Removed'} {removed} entries ({result['bytes']} bytes): "
+                  f"{result['age']} by age, {result['orphan']} orphaned, {result['size']} by size; "
+                  f"{result['left']} left")
+        elif args.action == "compact":
+            sizes = cachemaint.compact(store)
+            print(f"Compacted {sizes['before']} -> {sizes['after']} bytes")
+        elif args.action == "export":
+            count = cachemaint.export_bundle(
+                store, args.bundle, stage=args.stage,
+                newer_than=cachemaint.parse_duration(args.newer_than) if args.newer_than else None)
+            print(f"Exported {count} entries to {args.bundle}")
+        elif args.action == "import":
+            counts = cachemaint.import_bundle(store, args.bundle, overwrite=args.overwrite)
+            print(f"Imported {counts['imported']} of {counts['entries']} entries "
+                  f"({counts['entries'] - counts['imported']} already cached)")
+    finally:
+        store.close()
+
+
+def run_render(args):
+    import sys
+    from engine import rendering
+    from engine.artifact import load_artifact
+
+    artifact = load_artifact(args.artifact)
+    options = {"theme": args.theme} if args.theme and args.format == "marp" else {}
+    if args.output:
+        with open(args.output, "w") as f:
+            rendering.render(artifact, args.format, f, **options)
+    else:
+        rendering.render(artifact, args.format, sys.stdout, **options)
+
 
 if __name__=="__main__":
-    
-    solution=m.SolutionGenerator("Financial","A system that provide tax optimization strategies for traders","output")
-    solution.generate()
\ No newline at end of file
+    args = parse_args()
+    setup_logging()
+    if args.profile:
+        config = Config.from_env()
+        config.routing_profile = args.profile
+        oai.configure(config)
+
+    if args.command == "batch":
+        jobs = m.iter_jobs(args.jobs, args.output_dir)
+        if args.dry_run:
+            for job in jobs:
+                print_changes(m.SolutionGenerator(job["industry"], job["idea"], job["output_dir"]))
+        else:
+            runner = m.BatchRunner(jobs, args.journal or f"{args.jobs}.journal", workers=args.workers,
+                                   incremental=args.incremental, timeout=args.timeout, dedup=args.dedup)
+            print(m.format_summary(runner.run()))
+            print_report()
+    elif args.command == "offline":
+        run_offline(args)
+    elif args.command == "render":
+        run_render(args)
+    elif args.command == "serve":
+        run_serve(args)
+    elif args.command == "cache":
+        run_cache(args)
+    else:
+        solution=m.SolutionGenerator("Financial","A system that provide tax optimization strategies for traders","output",
+                                     stream=args.stream,incremental=args.incremental,timeout=args.timeout)
+        if args.dry_run:
+            print_changes(solution)
+        else:
+            solution.generate()
+            print_report()
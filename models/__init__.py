@@ -1,2 +1,16 @@
-from .solution import *
+from services.lazyimport import attach
 
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "solution": ".solution",
+    "batch": ".batch",
+    "dedup": ".dedup",
+    "service": ".service",
+    "SolutionGenerator": ".solution",
+    "BatchRunner": ".batch",
+    "iter_jobs": ".batch",
+    "read_jobs": ".batch",
+    "format_summary": ".batch",
+    "plan_offline": ".batch",
+    "prefetch": ".dedup",
+    "JobService": ".service",
+})
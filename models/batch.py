@@ -0,0 +1,238 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List
+
+import services.openaiapi as oai
+from services.batchapi import planning
+
+from .dedup import format_dedup, prefetch
+from .solution import SolutionGenerator
+
+logger = logging.getLogger(__name__)
+
+# Jobs submitted to the worker pool ahead of the running ones, per worker
+QUEUED_PER_WORKER = 2
+
+
+def iter_jobs(path: str, default_output_dir: str = "output") -> Iterator[Dict[str, str]]:
+    """
+    Reads the batch rows from a CSV (with a header) or JSONL file, one at a time.
+
+    Every row needs an industry and an idea; output_dir is optional.
+
+    Args:
+        path: The .csv or .jsonl file.
+        default_output_dir: Output directory for rows that do not set one.
+
+    Yields:
+        The jobs, in file order.
+    """
+    with open(path, newline='') as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for number, row in enumerate(rows, 1):
+            if not row.get("industry") or not row.get("idea"):
+                raise ValueError(f"{path}: row {number} needs both 'industry' and 'idea'")
+            yield {
+                "industry": row["industry"].strip(),
+                "idea": row["idea"].strip(),
+                "output_dir": (row.get("output_dir") or default_output_dir).strip(),
+            }
+
+
+def read_jobs(path: str, default_output_dir: str = "output") -> List[Dict[str, str]]:
+    """Reads every batch row into a list (see iter_jobs)."""
+    return list(iter_jobs(path, default_output_dir))
+
+
+def job_id(job: Dict[str, str]) -> str:
+    return f"{job['industry']}|{job['idea']}|{job['output_dir']}"
+
+
+class BatchRunner:
+    """
+    Runs SolutionGenerator over many jobs with a worker pool.
+
+    Progress is appended to a JSONL journal; jobs already recorded as done there are
+    skipped, so an interrupted batch resumes where it stopped. Jobs with sections
+    that failed are recorded as partial (and counted as failed), so they are retried. The journal doubles as
+    the results log: each entry of a finished job lists the documents it wrote.
+
+    Jobs are pulled from the iterable only as workers free up, and nothing of a job
+    is kept once its entry is written, so memory stays flat however large the batch
+    (except with dedup, whose planning needs every pending job at once).
+
+    Args:
+        jobs: The jobs to run (see iter_jobs and read_jobs).
+        journal_path: Location of the progress journal.
+        workers: Number of jobs generated in parallel.
+        incremental: Regenerate each job in place, recomputing only changed stages.
+        timeout: Deadline in seconds per job (see SolutionGenerator).
+        dedup: Send the requests shared across jobs once before generating (see models.dedup).
+    """
+
+    def __init__(self, jobs: Iterable[Dict[str, str]], journal_path: str, workers: int = 4,
+                 incremental: bool = False, timeout: float = None, dedup: bool = False) -> None:
+        self.jobs = jobs
+        self.journal_path = journal_path
+        self.workers = workers
+        self.incremental = incremental
+        self.timeout = timeout
+        self.dedup = dedup
+        self._journal_lock = threading.Lock()
+
+    def completed(self) -> set:
+        """Returns the ids of the jobs recorded as done in the journal."""
+        if not os.path.exists(self.journal_path):
+            return set()
+        done = set()
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line of an interrupted run may be truncated
+                    continue
+                if entry.get("status") == "done":
+                    done.add(entry["id"])
+        return done
+
+    def _record(self, entry: dict) -> None:
+        with self._journal_lock:
+            with open(self.journal_path, "a") as journal:
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def _run_job(self, job: Dict[str, str]) -> bool:
+        started = time.perf_counter()
+        generator = SolutionGenerator(job["industry"], job["idea"], job["output_dir"],
+                                      incremental=self.incremental, timeout=self.timeout)
+        try:
+            documents = generator.generate()
+        except Exception as e:
+            logger.error(f"Job failed for '{job['idea']}': {str(e)}")
+            self._record({"id": job_id(job), "status": "failed", "error": str(e),
+                          "seconds": round(time.perf_counter() - started, 3)})
+            return False
+        if generator.failed_sections:
+            # Not recorded as done, so a resumed batch retries the job
+            logger.error(f"Job incomplete for '{job['idea']}': {generator.failed_sections}")
+            self._record({"id": job_id(job), "status": "partial", "documents": documents,
+                          "failed_sections": generator.failed_sections,
+                          "seconds": round(time.perf_counter() - started, 3)})
+            return False
+        self._record({"id": job_id(job), "status": "done", "documents": documents,
+                      "seconds": round(time.perf_counter() - started, 3)})
+        return True
+
+    def run(self) -> dict:
+        """
+        Runs every job that is not yet done.
+
+        Returns:
+            The throughput summary (see summarize).
+        """
+        done = self.completed()
+        logger.info(f"Batch: {len(done)} jobs already done in {self.journal_path}")
+        skipped = 0
+
+        def pending() -> Iterator[Dict[str, str]]:
+            nonlocal skipped
+            for job in self.jobs:
+                if job_id(job) in done:
+                    skipped += 1
+                else:
+                    yield job
+
+        started = time.perf_counter()
+        jobs = pending()
+        dedup_report = None
+        if self.dedup:
+            jobs = list(jobs)
+            dedup_report = prefetch(jobs) if jobs else None
+        # Planning counts as cache misses, so the run figures start after the prefetch;
+        # the calls the prefetch sent are added to them (see summarize)
+        stats_before = oai.get_cache_stats()
+        succeeded = failed = 0
+
+        def collect(finished: set) -> None:
+            nonlocal succeeded, failed
+            for future in finished:
+                if future.result():
+                    succeeded += 1
+                else:
+                    failed += 1
+                logger.info(f"Batch progress: {succeeded + failed} jobs finished")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = set()
+            for job in jobs:
+                if len(running) >= self.workers * QUEUED_PER_WORKER:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                running.add(executor.submit(self._run_job, job))
+            collect(wait(running).done)
+
+        summary = summarize(succeeded, failed, skipped, time.perf_counter() - started,
+                            stats_before, oai.get_cache_stats(),
+                            prefetch_calls=dedup_report["api_calls"] if dedup_report else 0)
+        if dedup_report is not None:
+            summary["dedup"] = dedup_report
+        return summary
+
+
+def summarize(succeeded: int, failed: int, skipped: int, elapsed: float, before: dict, after: dict,
+              prefetch_calls: int = 0) -> dict:
+    """
+    Computes throughput and cache figures from two get_cache_stats snapshots.
+    prefetch_calls (API calls of a dedup prefetch before the first snapshot) count
+    towards the API calls, but not the cache hit rate of the run.
+    """
+    delta = {name: after[name] - before[name] for name in ("hits", "legacy_hits", "coalesced", "misses")}
+    lookups = sum(delta.values())
+    api_calls = delta["misses"] + prefetch_calls
+    minutes = max(elapsed, 1e-9) / 60
+    return {
+        "succeeded": succeeded,
+        "failed": failed,
+        "skipped": skipped,
+        "seconds": round(elapsed, 2),
+        "ideas_per_min": round(succeeded / minutes, 2),
+        "calls_per_min": round(api_calls / minutes, 2),
+        "api_calls": api_calls,
+        "cache_hit_rate": round((lookups - delta["misses"]) / lookups, 3) if lookups else None,
+    }
+
+
+def format_summary(summary: dict) -> str:
+    hit_rate = "n/a" if summary["cache_hit_rate"] is None else f"{summary['cache_hit_rate']:.1%}"
+    dedup = f"\n{format_dedup(summary['dedup'])}" if "dedup" in summary else ""
+    return (f"Batch finished in {summary['seconds']}s: {summary['succeeded']} done, "
+            f"{summary['failed']} failed, {summary['skipped']} skipped (already done)\n"
+            f"  ideas/min: {summary['ideas_per_min']}\n"
+            f"  calls/min: {summary['calls_per_min']} ({summary['api_calls']} API calls)\n"
+            f"  cache hit rate: {hit_rate}{dedup}")
+
+
+def plan_offline(jobs: Iterable[Dict[str, str]], requests_path: str) -> int:
+    """
+    Collects every uncached request of the jobs into a Batch API requests file.
+
+    Returns:
+        The number of requests written. Zero means every job can now be generated
+        from cache.
+    """
+    with planning() as backend:
+        for job in jobs:
+            SolutionGenerator(job["industry"], job["idea"], job["output_dir"]).plan()
+        count = backend.write(requests_path)
+    logger.info(f"Planned {count} requests into {requests_path}")
+    return count
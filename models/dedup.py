@@ -0,0 +1,101 @@
+"""
+Cross-idea request deduplication for batch runs.
+
+Several catalog topics only depend on the industry, and agents with the same
+name share their profile prompt, so a batch of ideas repeats many requests. The
+planner expands every job against the planning backend (services.batchapi),
+which yields the unique uncached requests and how many documents need each one.
+Every unique request is then sent once, the most shared first, and stored in the
+response cache; the per-job generation that follows reads it from there. Stages
+that depend on earlier responses (the per-agent prompts) only appear once those
+are cached, so planning and dispatching alternate until nothing new is planned.
+"""
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import services.openaiapi as oai
+from services import telemetry
+from services.batchapi import PlanningBackend, planning
+
+from .solution import SolutionGenerator
+
+logger = logging.getLogger(__name__)
+
+# Enough for the two dependency levels of the pipeline, plus headroom
+MAX_ROUNDS = 5
+
+
+def plan_requests(jobs: List[Dict[str, str]]) -> PlanningBackend:
+    """Expands every job and returns the planning backend holding its unique uncached requests."""
+    with planning() as backend:
+        for job in jobs:
+            SolutionGenerator(job["industry"], job["idea"], job["output_dir"]).plan()
+    return backend
+
+
+def _dispatch(request: dict, stage: str) -> bool:
+    """Sends one planned request through connect_api, which caches the response."""
+    body = dict(request["body"])
+    model, messages = body.pop("model"), body.pop("messages")
+    try:
+        oai.connect_api(system=messages[0]["content"], prompt=messages[1]["content"], model=model,
+                        stage=stage or oai.DEFAULT_STAGE, **body)
+    except Exception as e:
+        logger.error(f"Deduplicated request {request['custom_id'][:12]} failed: {str(e)}")
+        return False
+    return True
+
+
+def prefetch(jobs: List[Dict[str, str]], workers: int = None, max_rounds: int = MAX_ROUNDS) -> dict:
+    """
+    Sends every request the jobs need exactly once, so their generation runs from cache.
+
+    Args:
+        jobs: The jobs of the batch (see read_jobs).
+        workers: Requests sent in parallel (default: MAX_CONCURRENCY); the rate
+            limiter still applies.
+        max_rounds: Upper bound of plan/dispatch rounds.
+
+    Returns:
+        The dedup report: documents, rounds, requests (uncached requests of all
+        documents), unique (requests sent), saved, failed and api_calls (calls
+        the sent requests made, after coalescing and retries).
+    """
+    workers = workers or oai.get_config().max_concurrency
+    report = {"documents": len(jobs), "rounds": 0, "requests": 0, "unique": 0, "saved": 0, "failed": 0,
+              "api_calls": 0}
+    failed = set()
+    with telemetry.span("batch.prefetch", documents=len(jobs)) as span:
+        for _ in range(max_rounds):
+            backend = plan_requests(jobs)
+            # Failed requests are left to the per-job runs, which report them
+            keys = sorted((key for key in backend.requests if key not in failed),
+                          key=lambda key: backend.demand[key], reverse=True)
+            if not keys:
+                break
+            report["rounds"] += 1
+            report["requests"] += sum(backend.demand[key] for key in keys)
+            report["unique"] += len(keys)
+            logger.info(f"Dedup round {report['rounds']}: {len(keys)} unique of "
+                        f"{sum(backend.demand[key] for key in keys)} requests")
+            # Planning records misses too, so only the dispatch is counted
+            misses_before = oai.get_cache_stats()["misses"]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {key: executor.submit(contextvars.copy_context().run, _dispatch,
+                                                backend.requests[key], backend.stages.get(key))
+                           for key in keys}
+                failed.update(key for key, future in futures.items() if not future.result())
+            report["api_calls"] += oai.get_cache_stats()["misses"] - misses_before
+        report["saved"] = report["requests"] - report["unique"]
+        report["failed"] = len(failed)
+        span.set(**report)
+    return report
+
+
+def format_dedup(report: dict) -> str:
+    share = f"{report['saved'] / report['requests']:.0%}" if report["requests"] else "n/a"
+    return (f"  dedup: {report['requests']} uncached requests across {report['documents']} documents, "
+            f"{report['unique']} unique sent in {report['rounds']} rounds, {report['saved']} saved ({share}), "
+            f"{report['failed']} failed")
@@ -0,0 +1,413 @@
+"""
+Long-running generation service.
+
+An asyncio HTTP server that queues SolutionGenerator jobs by priority and runs
+them on a bounded worker pool. One process keeps the API client (and its
+keep-alive connection pool), the response cache and the rate limiter warm
+across all jobs, so a job pays neither interpreter startup nor a new TLS
+handshake.
+
+Endpoints:
+    POST   /jobs              Queues a job: {"industry", "idea", "output_dir", "priority",
+                              "incremental", "stream", "timeout"}; only industry and idea
+                              are required, higher priorities run first.
+    GET    /jobs              Every job.
+    GET    /jobs/<id>         One job, with its documents once it is done.
+    GET    /jobs/<id>/events  Progress as server-sent events, ending with the result.
+    DELETE /jobs/<id>         Cancels a queued job.
+    GET    /metrics           Queue depth, throughput and API usage (Prometheus text format).
+    GET    /healthz           Liveness.
+
+Usage:
+    python main.py serve --port 8090 --workers 2
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import services.openaiapi as oai
+from services import eventloop, telemetry
+from services.telemetry import Histogram
+from services.usage import totals
+
+from .solution import SolutionGenerator
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Finished spans of a job reported on its event stream, with these attributes
+PROGRESS_SPANS = ("catalog.topic", "genma.stage", "catalog.generate", "genma.generate")
+PROGRESS_ATTRIBUTES = ("topic", "stage", "error")
+
+# Jobs finished within this many seconds count towards the throughput metric
+THROUGHPUT_WINDOW = 300
+
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 429: "Too Many Requests"}
+
+_current_job = contextvars.ContextVar("service_job", default=None)
+
+
+class Job:
+    """
+    A generation request, its state and its event history.
+
+    Args:
+        request: The POST /jobs body.
+        default_output_dir: Output directory if the request does not set one.
+
+    Raises:
+        ValueError: The request is invalid.
+    """
+
+    def __init__(self, request: dict, default_output_dir: str) -> None:
+        if not isinstance(request, dict):
+            raise ValueError("The job must be a JSON object")
+        for field in ("industry", "idea"):
+            if not isinstance(request.get(field), str) or not request[field].strip():
+                raise ValueError(f"'{field}' is required")
+        try:
+            self.priority = int(request.get("priority", 0))
+            self.timeout = float(request["timeout"]) if request.get("timeout") is not None else None
+        except (TypeError, ValueError):
+            raise ValueError("'priority' must be an integer and 'timeout' a number of seconds")
+        self.id = uuid.uuid4().hex[:12]
+        self.industry = request["industry"].strip()
+        self.idea = request["idea"].strip()
+        self.output_dir = request.get("output_dir") or default_output_dir
+        self.incremental = bool(request.get("incremental", False))
+        self.stream = bool(request.get("stream", False))
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.documents: Dict[str, str] = {}
+        self.error = None
+        self.events = []
+        self._subscribers = set()
+
+    def publish(self, event: dict) -> None:
+        """Records an event and hands it to every open event stream. Runs on the event loop."""
+        event = {"job": self.id, "time": round(time.time(), 3), **event}
+        self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Returns a queue receiving the past events, then every new one."""
+        queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "status": self.status, "industry": self.industry, "idea": self.idea,
+                "output_dir": self.output_dir, "priority": self.priority, "created": self.created,
+                "started": self.started, "finished": self.finished,
+                "progress": sum(1 for event in self.events if event["event"] == "progress"),
+                "documents": self.documents, "error": self.error}
+
+
+async def _preconnect() -> None:
+    await oai.get_async_client().models.list()
+
+
+class JobService:
+    """
+    Queues and runs generation jobs behind the HTTP endpoints of this module.
+
+    Args:
+        workers: Jobs generated in parallel.
+        max_queue: Queued jobs accepted before submissions are refused with 429.
+        output_dir: Output directory of jobs that do not set one.
+        keep_finished: Finished jobs kept for status queries; older ones are forgotten.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 100, output_dir: str = "output",
+                 keep_finished: int = 1000) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.output_dir = output_dir
+        self.keep_finished = keep_finished
+        self.jobs: Dict[str, Job] = {}
+        self.counts = {"submitted": 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        self.running = 0
+        self.job_seconds = Histogram()
+        self.address = None
+        self._finish_times = collections.deque()
+        self._sequence = itertools.count()
+        self._started = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def warm_up(self) -> None:
+        """Imports the pipeline and creates the cache, limiter and API client before the first job."""
+        import engine.promptpatterncatalog.promptcatalog  # noqa: F401
+        import engine.solutiondesign.genma  # noqa: F401
+
+        config = oai.get_config()
+        oai.get_cache()
+        oai.get_limiter()
+        oai.get_routing()
+        oai.get_backend()
+        if config.backend == "openai" and config.api_key:
+            # Opens the first connection of the API loop's pool (every connect_api request
+            # goes through it), so the first job skips the TLS handshake
+            try:
+                eventloop.run(_preconnect())
+            except Exception as e:
+                logger.warning(f"Could not pre-connect to the API: {str(e)}")
+
+    def queue_depth(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def submit(self, request: dict) -> Job:
+        """
+        Queues a job.
+
+        Raises:
+            ValueError: The request is invalid.
+            OverflowError: The queue is full.
+        """
+        job = Job(request, self.output_dir)
+        if self.queue_depth() >= self.max_queue:
+            raise OverflowError(f"The queue is full ({self.max_queue} jobs)")
+        self.jobs[job.id] = job
+        self.counts["submitted"] += 1
+        self._queue.put_nowait((-job.priority, next(self._sequence), job))
+        job.publish({"event": QUEUED, "queue_depth": self.queue_depth()})
+        logger.info(f"Job {job.id} queued (priority {job.priority}): '{job.idea}'")
+        return job
+
+    def cancel(self, job: Job) -> None:
+        """Cancels a queued job; running jobs cannot be cancelled."""
+        if job.status != QUEUED:
+            raise ValueError(f"Job {job.id} is {job.status}")
+        self._finish(job, CANCELLED)
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished = time.time()
+        self.counts[status] += 1
+        event = {"event": status, "documents": job.documents, "error": job.error}
+        if job.started is not None:
+            seconds = job.finished - job.started
+            self.job_seconds.add(seconds * 1000)
+            self._finish_times.append(time.monotonic())
+            event["seconds"] = round(seconds, 3)
+        job.publish(event)
+        self._prune()
+
+    def _prune(self) -> None:
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job.id]
+
+    def _generate(self, job: Job) -> Dict[str, str]:
+        _current_job.set(job)
+        return SolutionGenerator(job.industry, job.idea, job.output_dir, stream=job.stream,
+                                 incremental=job.incremental, timeout=job.timeout).generate()
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != QUEUED:
+                continue
+            job.status = RUNNING
+            job.started = time.time()
+            self.running += 1
+            job.publish({"event": RUNNING})
+            try:
+                # Each job runs in its own context, so the spans it ends can be traced back to it
+                job.documents = await self._loop.run_in_executor(
+                    self._executor, contextvars.copy_context().run, self._generate, job)
+                status = DONE
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}")
+                job.error = str(e)
+                status = FAILED
+            finally:
+                self.running -= 1
+            self._finish(job, status)
+
+    def _on_span(self, span: telemetry.Span) -> None:
+        job = _current_job.get()
+        if job is None or span.name not in PROGRESS_SPANS:
+            return
+        event = {"event": "progress", "span": span.name, "status": span.status,
+                 "ms": round(span.duration_ms, 1),
+                 **{name: span.attributes[name] for name in PROGRESS_ATTRIBUTES if name in span.attributes}}
+        self._loop.call_soon_threadsafe(job.publish, event)
+
+    def metrics(self) -> str:
+        """The service metrics in the Prometheus text exposition format."""
+        now = time.monotonic()
+        while self._finish_times and self._finish_times[0] < now - THROUGHPUT_WINDOW:
+            self._finish_times.popleft()
+        window = min(THROUGHPUT_WINDOW, max(now - self._started, 1e-9))
+        usage = totals(oai.get_usage())
+        metrics = [
+            ("genai_queue_depth", "gauge", "Jobs waiting in the queue.", [("", self.queue_depth())]),
+            ("genai_jobs_running", "gauge", "Jobs being generated.", [("", self.running)]),
+            ("genai_jobs_total", "counter", "Jobs by final status.",
+             [(f'{{status="{status}"}}', self.counts[status]) for status in FINISHED]),
+            ("genai_jobs_submitted_total", "counter", "Jobs accepted.", [("", self.counts["submitted"])]),
+            ("genai_jobs_per_minute", "gauge", f"Jobs finished per minute over the last {THROUGHPUT_WINDOW}s.",
+             [("", round(len(self._finish_times) / window * 60, 3))]),
+            ("genai_job_duration_seconds", "summary", "Run time of the finished jobs.",
+             [(f'{{quantile="{q}"}}', round(self.job_seconds.percentile(q) / 1000, 3)) for q in (0.5, 0.95, 0.99)]
+             + [("_sum", round(self.job_seconds.total / 1000, 3)), ("_count", self.job_seconds.count)]),
+            ("genai_api_calls_total", "counter", "API calls made.", [("", usage["calls"])]),
+            ("genai_cache_hits_total", "counter", "Requests answered from the cache.", [("", usage["cache_hits"])]),
+            ("genai_tokens_total", "counter", "Tokens reported by the API.",
+             [(f'{{kind="{kind}"}}', usage[f"{kind}_tokens"]) for kind in ("prompt", "cached", "completion")]),
+            ("genai_uptime_seconds", "gauge", "Seconds since the service started.", [("", round(now - self._started))]),
+        ]
+        lines = []
+        for name, kind, help_text, samples in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            # The suffix is a label set or, for summaries, the _sum/_count series
+            lines += [f"{name}{suffix} {value}" for suffix, value in samples]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8090, ready: asyncio.Event = None) -> None:
+        """Runs the service until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        await self._loop.run_in_executor(None, self.warm_up)
+        telemetry.get_telemetry().add_listener(self._on_span)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self._handle, host, port)
+        self.address = server.sockets[0].getsockname()[:2]
+        logger.info(f"Generation service listening on http://{self.address[0]}:{self.address[1]} "
+                    f"with {self.workers} workers")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            telemetry.get_telemetry().remove_listener(self._on_span)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, path, body = await _read_request(reader)
+            except ValueError as e:
+                await _send(writer, 413 if "too large" in str(e) else 400, {"error": str(e)})
+                return
+            await self._route(method, path, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        parts = path.strip("/").split("/")
+        if path == "/healthz":
+            await _send(writer, 200, {"status": "ok"})
+        elif path == "/metrics":
+            await _send(writer, 200, self.metrics(), "text/plain; version=0.0.4")
+        elif parts[0] != "jobs" or len(parts) > 3 or (len(parts) == 3 and parts[2] != "events"):
+            await _send(writer, 404, {"error": f"Unknown path {path}"})
+        elif len(parts) == 1:
+            if method == "GET":
+                await _send(writer, 200, {"jobs": [job.to_dict() for job in self.jobs.values()]})
+            elif method == "POST":
+                try:
+                    job = self.submit(json.loads(body or b"{}"))
+                except ValueError as e:
+                    await _send(writer, 400, {"error": str(e)})
+                except OverflowError as e:
+                    await _send(writer, 429, {"error": str(e)})
+                else:
+                    await _send(writer, 202, job.to_dict())
+            else:
+                await _send(writer, 405, {"error": f"{method} not allowed on /jobs"})
+        elif parts[1] not in self.jobs:
+            await _send(writer, 404, {"error": f"Unknown job {parts[1]}"})
+        elif len(parts) == 3:
+            await _stream_events(self.jobs[parts[1]], writer)
+        elif method == "GET":
+            await _send(writer, 200, self.jobs[parts[1]].to_dict())
+        elif method == "DELETE":
+            try:
+                self.cancel(self.jobs[parts[1]])
+            except ValueError as e:
+                await _send(writer, 409, {"error": str(e)})
+            else:
+                await _send(writer, 200, self.jobs[parts[1]].to_dict())
+        else:
+            await _send(writer, 405, {"error": f"{method} not allowed on /jobs/<id>"})
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple:
+    """Reads one HTTP/1.1 request and returns (method, path, body)."""
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionError("Connection closed before the request")
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ValueError("Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY_BYTES:
+        raise ValueError(f"Request body too large ({length} bytes)")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], body
+
+
+async def _send(writer: asyncio.StreamWriter, status: int, body, content_type: str = "application/json") -> None:
+    payload = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload)
+    await writer.drain()
+
+
+async def _stream_events(job: Job, writer: asyncio.StreamWriter) -> None:
+    """Sends the events of a job as server-sent events until it has finished."""
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                 b"Connection: close\r\n\r\n")
+    queue = job.subscribe()
+    try:
+        while True:
+            event = await queue.get()
+            writer.write(f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+            await writer.drain()
+            if event["event"] in FINISHED:
+                break
+    finally:
+        job.unsubscribe(queue)
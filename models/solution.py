@@ -1,22 +1,82 @@
-import sys
-import os 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
 
 import engine as sd
+import services.openaiapi as oai
+from services import deadline, telemetry
 
 class SolutionGenerator:
-    def __init__(self, industry:str,idea:str,output_dir:str):
+    def __init__(self, industry:str,idea:str,output_dir:str,stream:bool=False,incremental:bool=False,
+                 timeout:float=None):
         self.industry = industry
         self.idea = idea
         self.prompt = self.idea
         self.output_dir = output_dir
+        # Write the documents incrementally while the responses stream in
+        self.stream = stream
+        # Keep one document per idea and only recompute the stages whose inputs changed
+        self.incremental = incremental
+        # Deadline in seconds for the whole generation (defaults to the RUN_TIMEOUT setting)
+        self.timeout = timeout
+        # Paths of the documents written, by document name (as in changes())
+        self.documents = {}
+        # Sections written as an error marker, by document name
+        self.failed_sections = {}
         
     def generate_pattern_catalog(self):
-        sd.promptcatalog.PatternCatalog().generate(self.industry,self.idea,self.output_dir)
+        with telemetry.span("catalog.generate"):
+            catalog = sd.promptcatalog.PatternCatalog()
+            self.documents["pattern catalog"] = catalog.generate(
+                self.industry,self.idea,self.output_dir,stream=self.stream,incremental=self.incremental)
+            self._failed("pattern catalog", catalog.failed_topics)
     def generate_solution_design(self):
-        sd.solutiondesign.genma.generate_solution(self.idea,self.output_dir)
+        with telemetry.span("genma.generate"):
+            self.documents["solution design"] = sd.solutiondesign.genma.write_solution(
+                self.idea,self.output_dir,stream=self.stream,incremental=self.incremental,industry=self.industry)
+
+    async def agenerate_pattern_catalog(self):
+        with telemetry.span("catalog.generate"):
+            catalog = sd.promptcatalog.PatternCatalog()
+            self.documents["pattern catalog"] = await catalog.agenerate(
+                self.industry,self.idea,self.output_dir,incremental=self.incremental)
+            self._failed("pattern catalog", catalog.failed_topics)
+    async def agenerate_solution_design(self):
+        with telemetry.span("genma.generate"):
+            self.documents["solution design"] = await sd.solutiondesign.genma.awrite_solution(
+                self.idea,self.output_dir,incremental=self.incremental,industry=self.industry)
         
     
+    def _failed(self, document, sections):
+        if sections:
+            self.failed_sections[document] = sections
+        else:
+            self.failed_sections.pop(document, None)
+
+    def plan(self):
+        """Runs the pipeline against the offline planning backend (see services.batchapi)."""
+        sd.promptcatalog.PatternCatalog().plan(self.industry,self.idea)
+        sd.solutiondesign.genma.plan_architecture(self.idea)
+
+    def changes(self):
+        """Dry run of an incremental generation: the status of each stage, per document."""
+        return {
+            "pattern catalog": sd.promptcatalog.PatternCatalog().changes(self.industry,self.idea,self.output_dir),
+            "solution design": sd.solutiondesign.genma.solution_changes(self.idea,self.output_dir,self.industry),
+        }
+
     def generate(self):
-        self.generate_pattern_catalog()  
-        self.generate_solution_design()  
+        timeout = self.timeout if self.timeout is not None else oai.get_config().run_timeout
+        with deadline.deadline(timeout), telemetry.span("run", industry=self.industry, idea=self.idea):
+            self.generate_pattern_catalog()  
+            self.generate_solution_design()
+        return self.documents
+
+    async def agenerate(self):
+        """
+        Async variant of generate for callers running an event loop: both documents
+        are generated concurrently, every request going through aconnect_api.
+        Streaming is not supported.
+        """
+        timeout = self.timeout if self.timeout is not None else oai.get_config().run_timeout
+        with deadline.deadline(timeout), telemetry.span("run", industry=self.industry, idea=self.idea):
+            await asyncio.gather(self.agenerate_pattern_catalog(), self.agenerate_solution_design())
+        return self.documents  
@@ -0,0 +1,437 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Generator, List, Optional, Union
+
+from services.cachekey import build_cache_key
+
+
+class BackendError(Exception):
+    """Base class of the errors raised by LLM backends."""
+
+
+class RateLimitError(BackendError):
+    """The provider rejected the request with HTTP 429."""
+
+    def __init__(self, message: str = "Rate limit exceeded", retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientError(BackendError):
+    """Timeouts, connection failures and 5xx responses; the request can be retried."""
+
+
+class RequestDeferred(BackendError):
+    """Raised instead of calling the API while planning an offline batch; the request was recorded."""
+
+
+class Completion:
+    """
+    Text and token usage of a chat completion. cached_tokens is the part of
+    prompt_tokens the provider served from its prompt (prefix) cache.
+    """
+
+    def __init__(self, text: str, model: str = None, prompt_tokens: int = None,
+                 completion_tokens: int = None, cached_tokens: int = None) -> None:
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+
+class LLMBackend:
+    """Interface connect_api dispatches chat completions through."""
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        """
+        Returns the completion of messages. A call taking longer than timeout seconds
+        fails with a TransientError.
+        """
+        raise NotImplementedError
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        """
+        Async variant of complete, used by aconnect_api. Backends without native async
+        support run complete in a worker thread.
+        """
+        return await asyncio.to_thread(self.complete, model, messages, timeout=timeout, **params)
+
+    def stream(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+               **params) -> Generator[str, None, Completion]:
+        """
+        Yields the completion text as it arrives and returns the final Completion.
+
+        Use as `completion = yield from backend.stream(...)`.
+        """
+        completion = self.complete(model, messages, timeout=timeout, **params)
+        yield completion.text
+        return completion
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Chat completions through the OpenAI client.
+
+    Args:
+        client_factory: Callable returning the (shared) OpenAI client.
+        async_client_factory: Callable returning the AsyncOpenAI client of the running
+            event loop. Without one, acomplete runs complete in a worker thread.
+    """
+
+    def __init__(self, client_factory: Callable[[], object], async_client_factory: Callable[[], object] = None) -> None:
+        self.client_factory = client_factory
+        self.async_client_factory = async_client_factory
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        with _translate_errors():
+            response = self.client_factory().chat.completions.create(model=model, messages=messages,
+                                                                     **_timeout(timeout), **params)
+        return _completion(response, model)
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        if self.async_client_factory is None:
+            return await super().acomplete(model, messages, timeout=timeout, **params)
+        with _translate_errors():
+            response = await self.async_client_factory().chat.completions.create(
+                model=model, messages=messages, **_timeout(timeout), **params)
+        return _completion(response, model)
+
+    def stream(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+               **params) -> Generator[str, None, Completion]:
+        parts = []
+        usage = None
+        with _translate_errors():
+            stream = self.client_factory().chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True},
+                **_timeout(timeout), **params)
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    parts.append(text)
+                    yield text
+        return Completion("".join(parts), model=model,
+                          prompt_tokens=getattr(usage, "prompt_tokens", None),
+                          completion_tokens=getattr(usage, "completion_tokens", None),
+                          cached_tokens=_cached_tokens(usage))
+
+
+def _completion(response, model: str) -> Completion:
+    usage = getattr(response, "usage", None)
+    return Completion(response.choices[0].message.content, model=model,
+                      prompt_tokens=getattr(usage, "prompt_tokens", None),
+                      completion_tokens=getattr(usage, "completion_tokens", None),
+                      cached_tokens=_cached_tokens(usage))
+
+
+def _timeout(timeout: Optional[float]) -> dict:
+    # Passing timeout=None to the client would disable its default timeout
+    return {} if timeout is None else {"timeout": timeout}
+
+
+@contextlib.contextmanager
+def _translate_errors():
+    """Maps openai exceptions onto the backend error types."""
+    try:
+        yield
+    except BackendError:
+        raise
+    except Exception as exc:
+        import openai
+
+        if isinstance(exc, openai.RateLimitError):
+            raise RateLimitError(str(exc), retry_after=_retry_after(exc)) from exc
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+            raise TransientError(str(exc)) from exc
+        raise
+
+
+def _retry_after(exc) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cached_tokens(usage) -> Optional[int]:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None)
+
+
+_JSON_TEMPLATE = re.compile(r"JSON object of the form (\{.*\})", re.DOTALL)
+_REPEATED = re.compile(r'(\{[^{}]*\}|"<[^>"]*>"), \.\.\.')
+_PLACEHOLDER = re.compile(r'"<([^>"]*)>"')
+
+
+def _fill_json_template(prompt: str, digest: str) -> str:
+    """Answers a prompt asking for a JSON object of a given form with a filled-in example."""
+    template = _JSON_TEMPLATE.search(prompt).group(1)
+    template = template[:template.rfind("}") + 1]
+    template = _REPEATED.sub(lambda m: ", ".join([m.group(1)] * 5), template)
+    counter = iter(range(1, 1000))
+    return _PLACEHOLDER.sub(lambda m: f'"{m.group(1)} {next(counter)} ({digest[:8]})"', template)
+
+
+class Latency:
+    """
+    Latency distribution of the fake backend.
+
+    Build one with Latency.parse("fixed:0.2"), "uniform:0.1,0.5" or
+    "lognormal:<median>,<sigma>".
+    """
+
+    def __init__(self, kind: str = "fixed", a: float = 0.0, b: float = 0.0) -> None:
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        kind, _, args = spec.partition(":")
+        values = [float(v) for v in args.split(",") if v] if args else [0.0]
+        return cls(kind, *values)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        # a is the median, b the sigma of the underlying normal
+        return rng.lognormvariate(0, self.b) * self.a
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic in-process stand-in for the provider, for offline load testing.
+
+    Args:
+        latency: Distribution of the time to complete a request.
+        error_rate: Probability that a request fails with a TransientError.
+        rate_limit_rate: Probability that a request fails with a RateLimitError.
+        retry_after: Retry-After value (seconds) sent with injected 429s.
+        responses: Canned responses: a mapping of prompt substring to text. The first
+            matching substring wins; other prompts get a generated response.
+        seed: Seed of the random generator, for reproducible runs.
+        chunk_size: Characters per chunk when streaming.
+    """
+
+    def __init__(self, latency: Union[Latency, str] = "fixed:0", error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 responses: Dict[str, str] = None, seed: int = 0, chunk_size: int = 16) -> None:
+        self.latency = Latency.parse(latency) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responses = responses or {}
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._prefixes = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "FakeBackend":
+        """Creates a fake whose canned responses are read from a JSON object file."""
+        with open(path) as f:
+            return cls(responses=json.load(f), **kwargs)
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            return self._rng.random(), self.latency.sample(self._rng)
+
+    def respond(self, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        for fragment, text in self.responses.items():
+            if fragment in prompt:
+                return text
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        # The format instructions are in the system message with the "prefix" prompt layout
+        for message in reversed(messages):
+            if "JSON object of the form" in message["content"]:
+                return _fill_json_template(message["content"], digest)
+        return "\n".join(f"{i}. Item {i} ({digest[i * 4:i * 4 + 8]})" for i in range(1, 9))
+
+    def _outcome(self, messages: List[Dict[str, str]]):
+        """Draws (text, injected error, seconds until the response or error)."""
+        roll, delay = self._draw()
+        if roll < self.rate_limit_rate:
+            return None, RateLimitError("Injected rate limit", retry_after=self.retry_after), min(delay, 0.05)
+        if roll < self.rate_limit_rate + self.error_rate:
+            return None, TransientError("Injected server error"), delay
+        return self.respond(messages), None, delay
+
+    def _prepare(self, messages: List[Dict[str, str]]):
+        text, error, delay = self._outcome(messages)
+        if error is not None:
+            time.sleep(delay)
+            raise error
+        return text, delay
+
+    def _check_timeout(self, delay: float, timeout: Optional[float]) -> None:
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TransientError(f"Request timed out after {timeout:.2f}s")
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        text, delay = self._prepare(messages)
+        self._check_timeout(delay, timeout)
+        time.sleep(delay)
+        return self._completion(model, messages, text)
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        text, error, delay = self._outcome(messages)
+        if error is None and timeout is not None and delay > timeout:
+            error, delay = TransientError(f"Request timed out after {timeout:.2f}s"), timeout
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._completion(model, messages, text)
+
+    def stream(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+               **params) -> Generator[str, None, Completion]:
+        text, delay = self._prepare(messages)
+        self._check_timeout(delay, timeout)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        # A fifth of the latency before the first token, the rest spread over the chunks
+        time.sleep(delay * 0.2)
+        for chunk in chunks:
+            time.sleep(delay * 0.8 / len(chunks))
+            yield chunk
+        return self._completion(model, messages, text)
+
+    def _completion(self, model: str, messages: List[Dict[str, str]], text: str) -> Completion:
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        # Mimics provider prefix caching: a system message seen before counts as cached
+        prefix = messages[0]["content"] if len(messages) > 1 else ""
+        with self._lock:
+            cached = len(prefix) // 4 if prefix in self._prefixes else 0
+            self._prefixes.add(prefix)
+        return Completion(text, model=model, prompt_tokens=prompt_chars // 4 + 1,
+                          completion_tokens=len(text) // 4 + 1, cached_tokens=cached)
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Passes requests on to another backend and keeps the responses, keyed by the
+    cache key of the request, for a ReplayBackend.
+
+    Args:
+        backend: The backend answering the requests.
+    """
+
+    def __init__(self, backend: LLMBackend) -> None:
+        self.backend = backend
+        self.recorded: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _keep(self, model: str, messages: List[Dict[str, str]], params: dict, completion: Completion) -> None:
+        with self._lock:
+            self.recorded[build_cache_key(model, messages, **params).key] = {
+                "text": completion.text, "prompt_tokens": completion.prompt_tokens,
+                "completion_tokens": completion.completion_tokens, "cached_tokens": completion.cached_tokens}
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        completion = self.backend.complete(model, messages, timeout=timeout, **params)
+        self._keep(model, messages, params, completion)
+        return completion
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        completion = await self.backend.acomplete(model, messages, timeout=timeout, **params)
+        self._keep(model, messages, params, completion)
+        return completion
+
+    def stream(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+               **params) -> Generator[str, None, Completion]:
+        completion = yield from self.backend.stream(model, messages, timeout=timeout, **params)
+        self._keep(model, messages, params, completion)
+        return completion
+
+    def save(self, path: str) -> int:
+        """Writes the recording as JSONL and returns the number of responses."""
+        with self._lock, open(path, "w") as f:
+            for key, response in self.recorded.items():
+                f.write(json.dumps({"key": key, **response}) + "\n")
+            return len(self.recorded)
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Answers requests with the responses of a RecordingBackend recording, after a
+    simulated latency.
+
+    Args:
+        path: The JSONL recording.
+        latency: Latency distribution of the replayed calls.
+        fallback: Backend answering requests missing from the recording (e.g. after
+            a prompt edit); without one they fail with a KeyError. misses counts them.
+        seed: Seed of the latency draws.
+    """
+
+    def __init__(self, path: str, latency: Union[Latency, str] = "fixed:0", fallback: LLMBackend = None,
+                 seed: int = 0) -> None:
+        with open(path) as f:
+            self.responses = {entry.pop("key"): entry for entry in map(json.loads, f) if entry}
+        self.latency = Latency.parse(latency) if isinstance(latency, str) else latency
+        self.fallback = fallback
+        self.calls = 0
+        self.misses = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _find(self, model: str, messages: List[Dict[str, str]], params: dict):
+        """Returns the recorded response (None on a miss) and the simulated latency."""
+        key = build_cache_key(model, messages, **params).key
+        with self._lock:
+            self.calls += 1
+            delay = self.latency.sample(self._rng)
+            response = self.responses.get(key)
+            if response is None:
+                self.misses += 1
+        if response is None and self.fallback is None:
+            raise KeyError(f"No recorded response for request {key[:12]}")
+        return response, delay
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        response, delay = self._find(model, messages, params)
+        if response is None:
+            return self.fallback.complete(model, messages, timeout=timeout, **params)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TransientError(f"Request timed out after {timeout:.2f}s")
+        time.sleep(delay)
+        return self._completion(model, response)
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        response, delay = self._find(model, messages, params)
+        if response is None:
+            return await self.fallback.acomplete(model, messages, timeout=timeout, **params)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TransientError(f"Request timed out after {timeout:.2f}s")
+        await asyncio.sleep(delay)
+        return self._completion(model, response)
+
+    def _completion(self, model: str, response: dict) -> Completion:
+        return Completion(response["text"], model=model, prompt_tokens=response.get("prompt_tokens"),
+                          completion_tokens=response.get("completion_tokens"),
+                          cached_tokens=response.get("cached_tokens"))
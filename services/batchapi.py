@@ -0,0 +1,162 @@
+"""
+Offline Batch-API mode.
+
+Phase "plan": the pipeline runs against a PlanningBackend, which records every
+request that misses the cache instead of sending it; the requests are written as
+a Batch API requests JSONL file (custom_id = cache key). Phase "ingest": a Batch
+API results JSONL file is loaded into the response cache, after which a normal
+run finishes from cache. Stages that depend on earlier responses (the per-agent
+prompts) only become visible once those responses are cached, so plan/ingest is
+repeated in rounds until the plan comes back empty.
+"""
+import contextlib
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List
+
+from services import telemetry
+from services.backends import Completion, LLMBackend, RequestDeferred
+from services.cachekey import build_cache_key
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class PlanningBackend(LLMBackend):
+    """
+    Records uncached requests in Batch API format instead of sending them.
+
+    Identical requests are recorded once; demand counts how often each was made
+    and stages holds the pipeline stage that first made it.
+    """
+
+    def __init__(self) -> None:
+        self.requests: Dict[str, dict] = {}
+        self.components: Dict[str, dict] = {}
+        self.demand: Counter = Counter()
+        self.stages: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = None, **params) -> Completion:
+        key = build_cache_key(model, messages, **params)
+        span = telemetry.current_span()
+        with self._lock:
+            self.demand[key.key] += 1
+            if key.key not in self.requests:
+                self.requests[key.key] = {
+                    "custom_id": key.key,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": model, "messages": messages, **params},
+                }
+                self.components[key.key] = key.components
+                self.stages[key.key] = span.attributes.get("stage") if span is not None else None
+        raise RequestDeferred(key.key)
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], timeout: float = None,
+                        **params) -> Completion:
+        # Only records the request; no I/O, so no worker thread is needed
+        return self.complete(model, messages, timeout=timeout, **params)
+
+    def write(self, path: str) -> int:
+        """Writes the recorded requests as a Batch API input file and returns how many there are."""
+        with open(path, "w") as f:
+            for request in self.requests.values():
+                f.write(json.dumps(request) + "\n")
+        return len(self.requests)
+
+
+@contextlib.contextmanager
+def planning():
+    """
+    Routes connect_api through a PlanningBackend (without rate limiting) for the
+    duration of the block and yields the backend.
+    """
+    import services.openaiapi as oai
+    from services.ratelimit import NoLimiter
+
+    backend = PlanningBackend()
+    previous_backend, previous_limiter = oai.get_backend(), oai.get_limiter()
+    oai.set_backend(backend)
+    oai.set_limiter(NoLimiter())
+    try:
+        yield backend
+    finally:
+        oai.set_backend(previous_backend)
+        oai.set_limiter(previous_limiter)
+
+
+def _read_jsonl(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ingest_results(results_path: str, cache, requests_path: str = None) -> Dict[str, int]:
+    """
+    Loads a Batch API results file into the response cache.
+
+    Args:
+        results_path: The results JSONL (one {"custom_id", "response", "error"} object per line).
+        cache: The cache backend to fill (keys are the custom_ids).
+        requests_path: The matching requests file. When given, the key components are
+            recomputed from it so cache-miss attribution keeps working.
+
+    Returns:
+        Counts of ingested and failed results.
+    """
+    components = {}
+    if requests_path:
+        for request in _read_jsonl(requests_path):
+            body = dict(request["body"])
+            key = build_cache_key(body.pop("model"), body.pop("messages"), **body)
+            components[request["custom_id"]] = key.components
+
+    counts = {"ingested": 0, "failed": 0}
+    for result in _read_jsonl(results_path):
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            logger.error(f"Batch request {result.get('custom_id')} failed: "
+                         f"{result.get('error') or response.get('status_code')}")
+            counts["failed"] += 1
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        cache.set(result["custom_id"], body["choices"][0]["message"]["content"], model=body.get("model"),
+                  prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+                  components=components.get(result["custom_id"]))
+        counts["ingested"] += 1
+    logger.info(f"Ingested {counts['ingested']} batch results ({counts['failed']} failed)")
+    return counts
+
+
+def simulate_results(requests_path: str, results_path: str, backend: LLMBackend) -> int:
+    """
+    Answers a requests file with a local backend, writing a Batch API results file.
+
+    Lets the whole plan/ingest flow be exercised offline against fixture files.
+    """
+    count = 0
+    with open(results_path, "w") as out:
+        for number, request in enumerate(_read_jsonl(requests_path)):
+            body = dict(request["body"])
+            model, messages = body.pop("model"), body.pop("messages")
+            completion = backend.complete(model, messages, **body)
+            out.write(json.dumps({
+                "id": f"batch_req_{number}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": f"req_{number}", "body": {
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.text},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": completion.prompt_tokens,
+                              "completion_tokens": completion.completion_tokens,
+                              "total_tokens": (completion.prompt_tokens or 0) + (completion.completion_tokens or 0)},
+                }},
+                "error": None,
+            }) + "\n")
+            count += 1
+    return count
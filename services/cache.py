@@ -0,0 +1,650 @@
+import asyncio
+import atexit
+import glob
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Interface of the response cache used by connect_api."""
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response for key, or None on a miss."""
+        raise NotImplementedError
+
+    def get_entry(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        """Returns the cached response and its creation time (None if untracked), or None on a miss."""
+        value = self.get(key)
+        return None if value is None else (value, None)
+
+    def set(self, key: str, value: str, model: str = None, prompt_tokens: int = None,
+            completion_tokens: int = None, created_at: float = None,
+            components: Dict[str, str] = None, stage: str = None) -> None:
+        """Stores a response together with its metadata."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def find_by_prompt(self, prompt_digest: str) -> List[Dict[str, str]]:
+        """Returns the key components of entries stored for the same prompt, if tracked."""
+        return []
+
+    def close(self) -> None:
+        pass
+
+    # Async interface of aconnect_api. Stores doing file or database I/O run the
+    # synchronous methods in a worker thread, so the event loop is never blocked.
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aget_entry(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        return await asyncio.to_thread(self.get_entry, key)
+
+    async def aset(self, key: str, value: str, **metadata) -> None:
+        """Async variant of set; metadata takes set's keyword arguments."""
+        await asyncio.to_thread(self.set, key, value, **metadata)
+
+    async def afind_by_prompt(self, prompt_digest: str) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self.find_by_prompt, prompt_digest)
+
+
+class JsonFileCache(CacheBackend):
+    """Legacy layout: one cache/<key>.json file per response."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self.path(key), 'r') as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: str, model: str = None, prompt_tokens: int = None,
+            completion_tokens: int = None, created_at: float = None,
+            components: Dict[str, str] = None, stage: str = None) -> None:
+        # Write to a temporary file and rename it, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(value, cache_file)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Single-file cache store backed by SQLite in WAL mode.
+
+    Args:
+        path: Location of the database file.
+        ttl: Seconds after which an entry expires. None keeps entries forever.
+        max_bytes: Total size cap of the stored responses. When exceeded, the least
+            recently accessed entries are evicted. None disables the cap.
+
+    Reads do not write: the hits and access times of cache hits are kept in memory
+    and written in one transaction every ACCESS_FLUSH_SECONDS or
+    ACCESS_FLUSH_ENTRIES keys, before anything that relies on them (eviction,
+    entries, dump) and on close or exit.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            model TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL,
+            prompt_hash TEXT,
+            components TEXT,
+            stage TEXT,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+    """
+
+    # Running total of the stored sizes, kept by triggers so every process sees it
+    TOTALS = """
+        CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+        INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+        CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses
+            BEGIN UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0; END;
+        CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses
+            BEGIN UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0; END;
+        CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF size ON responses
+            BEGIN UPDATE totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0; END;
+    """
+
+    # Least recently accessed entries fetched per eviction query
+    EVICT_BATCH = 64
+
+    # Entries copied into the cache per transaction by load()
+    LOAD_BATCH = 500
+
+    # Pending access updates are written after this many seconds or distinct keys
+    ACCESS_FLUSH_SECONDS = 60
+    ACCESS_FLUSH_ENTRIES = 256
+
+    # Columns added after the first schema, with their definitions
+    ADDED_COLUMNS = {"prompt_hash": "TEXT", "components": "TEXT", "stage": "TEXT",
+                     "hits": "INTEGER NOT NULL DEFAULT 0"}
+
+    # Entry metadata returned by entries(), i.e. every column but the value
+    METADATA = ("key", "model", "stage", "prompt_tokens", "completion_tokens", "created_at", "accessed_at",
+                "size", "hits", "prompt_hash", "components")
+
+    def __init__(self, path: str, ttl: float = None, max_bytes: int = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # key -> [hits, last access] not yet written
+        self._accesses = {}
+        self._flushed_at = time.time()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # INSERT OR REPLACE fires the delete trigger of the replaced row only with this on
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate_schema()
+        # Seeded and guarded by the triggers in one transaction, so no write is missed
+        self._conn.executescript(f"BEGIN IMMEDIATE; {self.TOTALS} COMMIT;")
+        atexit.register(self.flush)
+
+    def _migrate_schema(self) -> None:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+        for name, definition in self.ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE responses ADD COLUMN {name} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_prompt_hash ON responses (prompt_hash)")
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._accesses.pop(key, None)
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            access = self._accesses.setdefault(key, [0, now])
+            access[0] += 1
+            access[1] = now
+            if (len(self._accesses) >= self.ACCESS_FLUSH_ENTRIES
+                    or now - self._flushed_at >= self.ACCESS_FLUSH_SECONDS):
+                self._flush_accesses()
+            return value, created_at
+
+    def flush(self) -> None:
+        """Writes the pending hits and access times."""
+        with self._lock:
+            self._flush_accesses()
+
+    def _flush_accesses(self) -> None:
+        """Writes the pending hits and access times, in the open transaction if any. Needs the lock."""
+        self._flushed_at = time.time()
+        if not self._accesses:
+            return
+        updates = [(accessed_at, hits, key) for key, (hits, accessed_at) in self._accesses.items()]
+        self._accesses = {}
+        statement = "UPDATE responses SET accessed_at = MAX(accessed_at, ?), hits = hits + ? WHERE key = ?"
+        if self._conn.in_transaction:
+            self._conn.executemany(statement, updates)
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(statement, updates)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def set(self, key: str, value: str, model: str = None, prompt_tokens: int = None,
+            completion_tokens: int = None, created_at: float = None,
+            components: Dict[str, str] = None, stage: str = None) -> None:
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._accesses.pop(key, None)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._flush_accesses()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, value, model, prompt_tokens, completion_tokens, created_at, accessed_at, size, "
+                    "prompt_hash, components, stage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, value, model, prompt_tokens, completion_tokens, created_at or now, now, size,
+                     components.get("prompt") if components else None,
+                     json.dumps(components) if components else None, stage))
+                if self.max_bytes is not None:
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._accesses.pop(key, None)
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def find_by_prompt(self, prompt_digest: str) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT components FROM responses WHERE prompt_hash = ? ORDER BY accessed_at DESC LIMIT 5",
+                (prompt_digest,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def purge_expired(self) -> int:
+        """Deletes every expired entry and returns how many were removed."""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+            return cursor.rowcount
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        while total > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?",
+                                      (self.EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        logger.info(f"Evicted {evicted} cache entries to stay under {self.max_bytes} bytes")
+
+    def entries(self) -> List[Dict[str, object]]:
+        """Returns the metadata of every entry (without the values), for maintenance."""
+        with self._lock:
+            self._flush_accesses()
+            rows = self._conn.execute(f"SELECT {', '.join(self.METADATA)} FROM responses").fetchall()
+        entries = [dict(zip(self.METADATA, row)) for row in rows]
+        for entry in entries:
+            entry["components"] = json.loads(entry["components"]) if entry["components"] else None
+        return entries
+
+    def delete_keys(self, keys: List[str]) -> int:
+        """Deletes the entries of keys in one transaction and returns how many existed."""
+        with self._lock:
+            for key in keys:
+                self._accesses.pop(key, None)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = sum(self._conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+                              for key in keys)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def dump(self) -> Iterator[Dict[str, object]]:
+        """Yields every entry with its value and the metadata worth carrying to another cache."""
+        columns = ("key", "value", "model", "stage", "prompt_tokens", "completion_tokens", "created_at",
+                   "components")
+        with self._lock:
+            self._flush_accesses()
+            rows = self._conn.execute(f"SELECT {', '.join(columns)} FROM responses ORDER BY created_at").fetchall()
+        for row in rows:
+            entry = dict(zip(columns, row))
+            entry["components"] = json.loads(entry["components"]) if entry["components"] else None
+            yield entry
+
+    def load(self, entries: Iterable[Dict[str, object]], overwrite: bool = False) -> int:
+        """
+        Stores dumped entries.
+
+        The entries are first staged in a temporary table, which does not lock the
+        cache for other writers. Only once entries is exhausted (for a bundle: read
+        and verified) are they copied into the cache, LOAD_BATCH per transaction, so
+        other processes can write in between. If entries raises, nothing is stored.
+
+        Args:
+            entries: Entries as yielded by dump().
+            overwrite: Replace entries that already exist instead of keeping them.
+
+        Returns:
+            The number of entries stored.
+        """
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        columns = ("key, value, model, prompt_tokens, completion_tokens, created_at, accessed_at, size, "
+                   "prompt_hash, components, stage")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS load_staging AS SELECT {columns} FROM responses "
+                               "WHERE 0")
+            self._conn.execute("DELETE FROM temp.load_staging")
+        try:
+            rows = []
+            for entry in entries:
+                components = entry.get("components")
+                rows.append((entry["key"], entry["value"], entry.get("model"), entry.get("prompt_tokens"),
+                             entry.get("completion_tokens"), entry.get("created_at") or now, now,
+                             len(entry["value"].encode('utf-8')), components.get("prompt") if components else None,
+                             json.dumps(components) if components else None, entry.get("stage")))
+                if len(rows) >= self.LOAD_BATCH:
+                    self._stage_rows(columns, rows)
+                    rows = []
+            self._stage_rows(columns, rows)
+            stored = 0
+            copied = 0
+            while True:
+                with self._lock:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        self._flush_accesses()
+                        upper = self._conn.execute(
+                            "SELECT MAX(rowid) FROM (SELECT rowid FROM temp.load_staging WHERE rowid > ? "
+                            "ORDER BY rowid LIMIT ?)", (copied, self.LOAD_BATCH)).fetchone()[0]
+                        if upper is not None:
+                            stored += self._conn.execute(
+                                f"{verb} INTO responses ({columns}) SELECT {columns} FROM temp.load_staging "
+                                "WHERE rowid > ? AND rowid <= ? ORDER BY rowid", (copied, upper)).rowcount
+                            if self.max_bytes is not None:
+                                self._evict()
+                        self._conn.execute("COMMIT")
+                    except Exception:
+                        self._conn.execute("ROLLBACK")
+                        raise
+                if upper is None:
+                    return stored
+                copied = upper
+        finally:
+            with self._lock:
+                self._conn.execute("DROP TABLE IF EXISTS temp.load_staging")
+
+    def _stage_rows(self, columns: str, rows: List[tuple]) -> None:
+        if rows:
+            with self._lock:
+                self._conn.executemany(f"INSERT INTO temp.load_staging ({columns}) VALUES "
+                                       f"({', '.join('?' * len(rows[0]))})", rows)
+
+    def disk_bytes(self) -> int:
+        """Size of the database files on disk, including the write-ahead log."""
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal", "-shm")
+                   if os.path.exists(self.path + suffix))
+
+    def compact(self) -> None:
+        """Folds the write-ahead log into the database and rebuilds it without free pages."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_accesses()
+            self._conn.close()
+
+
+class MemoryCache(CacheBackend):
+    """
+    Bounded in-process LRU cache.
+
+    Args:
+        max_entries: Maximum number of entries held.
+        max_bytes: Maximum total size of the held responses.
+        ttl: Seconds after their creation at which entries expire, as in the disk
+            cache behind this tier. None keeps entries until they are evicted.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes_held = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: str, model: str = None, prompt_tokens: int = None,
+            completion_tokens: int = None, created_at: float = None,
+            components: Dict[str, str] = None, stage: str = None) -> None:
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            # An oversized value is not kept, but must not leave the old one behind either
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, created_at or time.time())
+            self.bytes_held += size
+            while len(self._entries) > self.max_entries or self.bytes_held > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes_held -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    # In-memory operations are fast enough to run on the event loop
+
+    async def aget(self, key: str) -> Optional[str]:
+        return self.get(key)
+
+    async def aset(self, key: str, value: str, **metadata) -> None:
+        self.set(key, value, **metadata)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes_held -= entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TieredCache(CacheBackend):
+    """
+    In-memory LRU tier in front of a persistent backend. Writes go through to both.
+
+    Args:
+        memory: The in-process tier.
+        disk: The persistent backend.
+    """
+
+    def __init__(self, memory: MemoryCache, disk: CacheBackend) -> None:
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.lookup(key)[0]
+
+    def lookup(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns the value and the tier that had it ("memory", "disk", or None on a miss)."""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value, "memory"
+        entry = self.disk.get_entry(key)
+        if entry is None:
+            self._count("misses")
+            return None, None
+        self._count("disk_hits")
+        # Promoted with the disk creation time, so the entry expires from both tiers together
+        self.memory.set(key, entry[0], created_at=entry[1])
+        return entry[0], "disk"
+
+    def set(self, key: str, value: str, model: str = None, prompt_tokens: int = None,
+            completion_tokens: int = None, created_at: float = None,
+            components: Dict[str, str] = None, stage: str = None) -> None:
+        self.disk.set(key, value, model=model, prompt_tokens=prompt_tokens,
+                      completion_tokens=completion_tokens, created_at=created_at, components=components,
+                      stage=stage)
+        self.memory.set(key, value, created_at=created_at)
+
+    async def aget(self, key: str) -> Optional[str]:
+        return (await self.alookup(key))[0]
+
+    async def alookup(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """Async variant of lookup: memory hits are answered without leaving the event loop."""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value, "memory"
+        entry = await self.disk.aget_entry(key)
+        if entry is None:
+            self._count("misses")
+            return None, None
+        self._count("disk_hits")
+        self.memory.set(key, entry[0], created_at=entry[1])
+        return entry[0], "disk"
+
+    async def aset(self, key: str, value: str, **metadata) -> None:
+        await self.disk.aset(key, value, **metadata)
+        self.memory.set(key, value, created_at=metadata.get("created_at"))
+
+    async def afind_by_prompt(self, prompt_digest: str) -> List[Dict[str, str]]:
+        return await self.disk.afind_by_prompt(prompt_digest)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def find_by_prompt(self, prompt_digest: str) -> List[Dict[str, str]]:
+        return self.disk.find_by_prompt(prompt_digest)
+
+    def close(self) -> None:
+        self.disk.close()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the tier counters."""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.memory.evictions,
+                "entries_held": len(self.memory),
+                "bytes_held": self.memory.bytes_held,
+            }
+
+
+def create_cache(backend: str, directory: str, ttl: float = None, max_bytes: int = None) -> CacheBackend:
+    """
+    Creates a cache backend by name.
+
+    Args:
+        backend: "sqlite" (default store) or "json" (legacy one-file-per-response).
+        directory: Directory holding the cache.
+        ttl: Entry lifetime in seconds (sqlite only).
+        max_bytes: Total size cap in bytes (sqlite only).
+
+    Returns:
+        The cache backend.
+    """
+    if backend == "sqlite":
+        return SQLiteCache(os.path.join(directory, "cache.db"), ttl=ttl, max_bytes=max_bytes)
+    if backend == "json":
+        return JsonFileCache(directory)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def migrate_json_cache(directory: str, target: CacheBackend, model: str = "gpt-4",
+                       remove: bool = False) -> int:
+    """
+    Imports the legacy cache/<key>.json files into another backend.
+
+    Args:
+        directory: Directory holding the legacy JSON files.
+        target: Backend receiving the entries.
+        model: Model recorded for the imported entries.
+        remove: Delete each JSON file once it has been imported.
+
+    Returns:
+        The number of imported entries.
+    """
+    imported = 0
+    for filename in glob.glob(os.path.join(directory, "*.json")):
+        key = os.path.splitext(os.path.basename(filename))[0]
+        try:
+            with open(filename, 'r') as cache_file:
+                value = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Skipping unreadable cache file {filename}: {str(e)}")
+            continue
+        target.set(key, value, model=model, created_at=os.path.getmtime(filename))
+        imported += 1
+        if remove:
+            os.remove(filename)
+    logger.info(f"Imported {imported} cache entries from {directory}")
+    return imported
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import legacy cache/*.json files into the SQLite cache.")
+    parser.add_argument("directory", nargs="?", default="cache")
+    parser.add_argument("--remove", action="store_true", help="delete the JSON files after importing them")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = create_cache("sqlite", args.directory)
+    print(f"Imported {migrate_json_cache(args.directory, store, remove=args.remove)} entries")
+    store.close()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional
+
+# Bump when the normalization or the key layout changes, so old entries stop matching
+CACHE_KEY_VERSION = 1
+
+# Components compared to explain a cache miss, in reporting order
+KEY_COMPONENTS = ("version", "model", "system", "params")
+
+_SPACES = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Canonicalizes a prompt so that cosmetic edits do not change its cache key.
+
+    Leading/trailing whitespace is stripped from every line, runs of spaces and tabs
+    are collapsed, and runs of blank lines are reduced to a single blank line. This
+    makes the indented f-string prompts independent of the code indentation.
+
+    Args:
+        text: The prompt text.
+
+    Returns:
+        The normalized prompt.
+    """
+    lines = [_SPACES.sub(" ", line).strip() for line in text.replace("\r\n", "\n").split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    return [{"role": message["role"], "content": normalize_prompt(message["content"])}
+            for message in messages]
+
+
+def _digest(value) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CacheKey:
+    """
+    Versioned cache key over the full request.
+
+    Attributes:
+        key: The hex digest used to store the response.
+        components: Per-component digests (version, model, system, prompt, params).
+    """
+
+    def __init__(self, model: str, messages: List[Dict[str, str]], params: Optional[dict] = None) -> None:
+        system = [m["content"] for m in messages if m["role"] == "system"]
+        conversation = [m for m in messages if m["role"] != "system"]
+        self.components = {
+            "version": str(CACHE_KEY_VERSION),
+            "model": model,
+            "system": _digest(system),
+            "prompt": _digest(conversation),
+            "params": _digest({k: v for k, v in (params or {}).items() if v is not None}),
+        }
+        self.key = _digest(self.components)
+
+    def diff(self, other: Dict[str, str]) -> List[str]:
+        """Returns the names of the components that differ from another key's components."""
+        return [name for name in KEY_COMPONENTS if self.components.get(name) != other.get(name)]
+
+
+def build_cache_key(model: str, messages: List[Dict[str, str]], **params) -> CacheKey:
+    """
+    Builds the cache key for a chat completion request.
+
+    Args:
+        model: The model name.
+        messages: The chat messages, already normalized.
+        **params: Sampling parameters such as max_tokens or temperature.
+
+    Returns:
+        The cache key.
+    """
+    return CacheKey(model, messages, params)
+
+
+def legacy_cache_key(prompt: str) -> str:
+    """Key used before versioning: the md5 of the raw user prompt only."""
+    return hashlib.md5(prompt.encode('utf-8')).hexdigest()
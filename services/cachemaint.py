@@ -0,0 +1,282 @@
+"""
+Maintenance of the SQLite response cache: statistics, pruning, compaction and
+portable bundles.
+
+A bundle is a gzip-compressed JSONL file: a header line, one line per entry and
+a trailer holding the entry count and the SHA-256 of the entry lines. Importing
+stages the entries outside the cache while checking them against the trailer, and
+stores them only once the whole bundle has been verified, so a truncated or
+corrupted bundle is rejected as a whole. Shipping a bundle from a warm node lets a new
+worker answer the requests another node already paid for from its cache.
+"""
+import fnmatch
+import gzip
+import hashlib
+import json
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from services.cache import SQLiteCache
+from services.cachekey import CACHE_KEY_VERSION
+
+BUNDLE_FORMAT = "genai-cache-bundle"
+BUNDLE_VERSION = 1
+
+# Upper bounds (seconds) of the age histogram buckets
+AGE_BUCKETS = (("<1h", 3600), ("<1d", 86400), ("<7d", 7 * 86400), ("<30d", 30 * 86400), (">=30d", None))
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+_SIZES = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3}
+
+
+def parse_duration(text: str) -> float:
+    """Parses "90", "45m", "12h", "30d" or "2w" into seconds."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", text.lower())
+    if not match:
+        raise ValueError(f"Invalid duration: {text}")
+    return float(match.group(1)) * _UNITS[match.group(2) or "s"]
+
+
+def parse_size(text: str) -> int:
+    """Parses "1000000", "512KB", "500MB" or "2G" into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-z]*)\s*", text.lower())
+    if not match or match.group(2) not in _SIZES:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * _SIZES[match.group(2)])
+
+
+def _age_bucket(age: float) -> str:
+    for name, bound in AGE_BUCKETS:
+        if bound is None or age < bound:
+            return name
+
+
+def cache_stats(cache: SQLiteCache, now: float = None) -> dict:
+    """
+    Summarizes the cache.
+
+    Returns:
+        disk_bytes, entries, value_bytes, reused (entries read at least once), hits
+        (reads), the age histogram by AGE_BUCKETS (by creation) and per-stage
+        entries, bytes, hits and tokens. Entries written before stages were
+        recorded are counted under "(unknown)".
+    """
+    now = now or time.time()
+    ages = dict.fromkeys((name for name, _ in AGE_BUCKETS), 0)
+    stages = defaultdict(lambda: {"entries": 0, "bytes": 0, "hits": 0, "prompt_tokens": 0, "completion_tokens": 0})
+    entries = cache.entries()
+    for entry in entries:
+        ages[_age_bucket(now - entry["created_at"])] += 1
+        stage = stages[entry["stage"] or "(unknown)"]
+        stage["entries"] += 1
+        stage["bytes"] += entry["size"]
+        stage["hits"] += entry["hits"] or 0
+        stage["prompt_tokens"] += entry["prompt_tokens"] or 0
+        stage["completion_tokens"] += entry["completion_tokens"] or 0
+    return {"disk_bytes": cache.disk_bytes(), "entries": len(entries),
+            "value_bytes": sum(entry["size"] for entry in entries),
+            "reused": sum(1 for entry in entries if entry["hits"]),
+            "hits": sum(entry["hits"] or 0 for entry in entries),
+            "ages": ages, "stages": dict(stages)}
+
+
+def format_stats(stats: dict) -> str:
+    reused = f"{stats['reused'] / stats['entries']:.1%}" if stats["entries"] else "n/a"
+    lines = [f"entries: {stats['entries']} ({stats['value_bytes']} bytes of responses, "
+             f"{stats['disk_bytes']} bytes on disk)",
+             f"reused:  {stats['reused']} entries read at least once ({reused}), {stats['hits']} reads",
+             "age:     " + "  ".join(f"{name} {count}" for name, count in stats["ages"].items())]
+    rows = sorted(stats["stages"].items(), key=lambda item: item[1]["bytes"], reverse=True)
+    width = max([len("stage")] + [len(stage) for stage, _ in rows])
+    lines.append(f"{'stage':<{width}}  {'entries':>8} {'bytes':>10} {'hits':>7} {'prompt_tok':>11} {'compl_tok':>10}")
+    for stage, row in rows:
+        lines.append(f"{stage:<{width}}  {row['entries']:>8} {row['bytes']:>10} {row['hits']:>7} "
+                     f"{row['prompt_tokens']:>11} {row['completion_tokens']:>10}")
+    return "\n".join(lines)
+
+
+def orphaned(entries: List[dict]) -> List[str]:
+    """
+    Returns the keys of entries no current request can reach: keys built with an
+    outdated key version, and prompt versions superseded by a later variant of
+    the same prompt (other model, system message or parameters) and not read
+    since that variant was stored. Legacy entries without key components are kept.
+    """
+    keys = [entry["key"] for entry in entries
+            if entry["components"] and entry["components"].get("version") != str(CACHE_KEY_VERSION)]
+    outdated = set(keys)
+    variants = defaultdict(list)
+    for entry in entries:
+        if entry["prompt_hash"] and entry["key"] not in outdated:
+            variants[entry["prompt_hash"]].append(entry)
+    for group in variants.values():
+        newest = max(entry["created_at"] for entry in group)
+        keys += [entry["key"] for entry in group
+                 if entry["created_at"] < newest and entry["accessed_at"] < newest]
+    return keys
+
+
+def prune(cache: SQLiteCache, older_than: float = None, max_bytes: int = None, orphans: bool = False,
+          dry_run: bool = False) -> Dict[str, int]:
+    """
+    Removes entries by age, total size and reachability.
+
+    Args:
+        cache: The cache to prune.
+        older_than: Remove entries not read for this many seconds.
+        max_bytes: Remove the least recently read entries until the responses fit.
+        orphans: Remove the entries returned by orphaned().
+        dry_run: Only count what would be removed.
+
+    Returns:
+        The entries removed per reason, their bytes and the entries left.
+    """
+    entries = cache.entries()
+    removed = {}
+    if older_than is not None:
+        cutoff = time.time() - older_than
+        removed.update((entry["key"], "age") for entry in entries if entry["accessed_at"] < cutoff)
+    if orphans:
+        for key in orphaned(entries):
+            removed.setdefault(key, "orphan")
+    if max_bytes is not None:
+        kept = sorted((entry for entry in entries if entry["key"] not in removed), key=lambda e: e["accessed_at"])
+        total = sum(entry["size"] for entry in kept)
+        for entry in kept:
+            if total <= max_bytes:
+                break
+            removed[entry["key"]] = "size"
+            total -= entry["size"]
+    if not dry_run:
+        cache.delete_keys(list(removed))
+    sizes = {entry["key"]: entry["size"] for entry in entries}
+    result = {reason: 0 for reason in ("age", "orphan", "size")}
+    for reason in removed.values():
+        result[reason] += 1
+    result["bytes"] = sum(sizes[key] for key in removed)
+    result["left"] = len(entries) - len(removed)
+    return result
+
+
+def compact(cache: SQLiteCache) -> Dict[str, int]:
+    """Compacts the database and returns its size on disk before and after."""
+    before = cache.disk_bytes()
+    cache.compact()
+    return {"before": before, "after": cache.disk_bytes()}
+
+
+def export_bundle(cache: SQLiteCache, path: str, stage: str = None, newer_than: float = None) -> int:
+    """
+    Writes the entries to a compressed, checksummed bundle.
+
+    Args:
+        cache: The cache to export.
+        path: The bundle to write (conventionally *.jsonl.gz).
+        stage: Only export entries whose stage matches this pattern (e.g. "catalog:*").
+        newer_than: Only export entries created within this many seconds.
+
+    Returns:
+        The number of exported entries.
+    """
+    cutoff = time.time() - newer_than if newer_than is not None else None
+    digest = hashlib.sha256()
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({"format": BUNDLE_FORMAT, "bundle_version": BUNDLE_VERSION,
+                            "cache_key_version": CACHE_KEY_VERSION, "created_at": time.time()}) + "\n")
+        for entry in cache.dump():
+            if stage is not None and not fnmatch.fnmatchcase(entry["stage"] or "", stage):
+                continue
+            if cutoff is not None and entry["created_at"] < cutoff:
+                continue
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+            digest.update(line.encode("utf-8"))
+            f.write(line)
+            count += 1
+        f.write(json.dumps({"entries": count, "sha256": digest.hexdigest()}) + "\n")
+    return count
+
+
+def _bundle_entries(path: str):
+    """Yields (line, entry) for the entry lines of a bundle, then (None, trailer)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "null")
+        if not isinstance(header, dict) or header.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"{path} is not a cache bundle")
+        if header.get("bundle_version") != BUNDLE_VERSION:
+            raise ValueError(f"{path}: unsupported bundle version {header.get('bundle_version')}")
+        previous = None
+        for line in f:
+            if previous is not None:
+                yield previous, json.loads(previous)
+            previous = line
+        if previous is None:
+            raise ValueError(f"{path}: the bundle is truncated")
+        yield None, json.loads(previous)
+
+
+def _verified_entries(path: str, counter: Dict[str, int]):
+    """
+    Yields the entries of a bundle while checking them against its trailer, so a
+    bundle is read once. counter["entries"] holds the number yielded.
+
+    Raises:
+        ValueError: After the last entry, if the bundle is not a bundle, truncated
+            or corrupted.
+    """
+    digest = hashlib.sha256()
+    trailer: Optional[dict] = None
+    counter["entries"] = 0
+    try:
+        for line, entry in _bundle_entries(path):
+            if line is None:
+                trailer = entry
+            else:
+                digest.update(line.encode("utf-8"))
+                counter["entries"] += 1
+                yield entry
+    except (OSError, EOFError, json.JSONDecodeError) as e:
+        raise ValueError(f"{path}: unreadable bundle ({str(e)})")
+    if not trailer or trailer.get("entries") != counter["entries"] or trailer.get("sha256") != digest.hexdigest():
+        raise ValueError(f"{path}: checksum mismatch, the bundle is truncated or corrupted")
+
+
+def verify_bundle(path: str) -> int:
+    """
+    Checks the entry count and checksum of a bundle.
+
+    Returns:
+        The number of entries.
+
+    Raises:
+        ValueError: The bundle is not a bundle, truncated or corrupted.
+    """
+    counter = {}
+    for _ in _verified_entries(path, counter):
+        pass
+    return counter["entries"]
+
+
+def import_bundle(cache: SQLiteCache, path: str, overwrite: bool = False) -> Dict[str, int]:
+    """
+    Stores the entries of a bundle, verifying the bundle as it is read. The entries
+    are staged first and copied into the cache in short transactions only once the
+    trailer has been checked (see SQLiteCache.load), so other processes keep
+    writing to the cache during the import.
+
+    Args:
+        cache: The cache to fill.
+        path: The bundle written by export_bundle.
+        overwrite: Replace entries the cache already has instead of keeping them.
+
+    Returns:
+        The entries in the bundle and the entries imported.
+
+    Raises:
+        ValueError: The bundle is not a bundle, truncated or corrupted; nothing is imported.
+    """
+    counter = {}
+    imported = cache.load(_verified_entries(path, counter), overwrite=overwrite)
+    return {"entries": counter["entries"], "imported": imported}
@@ -0,0 +1,146 @@
+import logging
+import os
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_logging_configured = False
+
+
+class Config:
+    """
+    Settings of the API client and the response cache.
+
+    Nothing is read or created when this module is imported; use Config.from_env()
+    (which also loads a .env file) or build one explicitly and pass it to
+    services.openaiapi.configure().
+
+    Args:
+        api_key: The OpenAI API key. Only required once an API call is made.
+        cache_dir: Directory holding the cache and its lock files.
+        cache_backend: "sqlite" (single-file store) or "json" (legacy one file per response).
+        cache_ttl: Entry lifetime in seconds.
+        cache_max_bytes: Total size cap of the persistent cache.
+        memory_entries: Entry limit of the in-process LRU tier.
+        memory_bytes: Byte limit of the in-process LRU tier.
+        backend: "openai", or "fake" for the deterministic offline stand-in.
+        base_url: Alternative API endpoint, e.g. the local stub of services.fakeserver.
+        fake_latency: Latency distribution of the "fake" backend (see backends.Latency).
+        rate_limit_rpm: Client-side requests/min budget.
+        rate_limit_tpm: Client-side estimated tokens/min budget.
+        max_concurrency: Upper bound of concurrent API calls (adapted down on 429s).
+        max_retries: Retries of rate-limited or transient failures before giving up.
+        prompt_layout: "inline" (criteria in the user message) or "prefix" (static criteria
+            in the system message, see genma.stage_messages).
+        telemetry_path: JSONL file the telemetry spans are exported to (none by default).
+        log_prompts: How prompts appear in the log: "truncate", "hash" or "full".
+        request_timeout: Timeout of a single API call in seconds.
+        run_timeout: Deadline of SolutionGenerator.generate in seconds (none by default).
+        hedge_requests: Send a duplicate of calls slower than hedge_percentile.
+        hedge_percentile: Observed latency percentile after which a call is hedged.
+        hedge_min_samples: Calls to observe before hedging starts.
+        routing_profile: Name of the per-stage model/max_tokens profile (see services.routing).
+        routing_file: JSON file with additional routing profiles.
+        http_max_connections: Connection limit of the HTTP pool shared by the API calls.
+        http_keepalive_connections: Idle connections kept open for reuse.
+        http_keepalive_expiry: Seconds an idle connection is kept open.
+        http_connect_timeout: Timeout of establishing a connection in seconds.
+    """
+
+    def __init__(self, api_key: str = None, cache_dir: str = "cache", cache_backend: str = "sqlite",
+                 cache_ttl: float = None, cache_max_bytes: int = None, memory_entries: int = 1024,
+                 memory_bytes: int = 64 * 1024 * 1024, backend: str = "openai", base_url: str = None,
+                 fake_latency: str = "fixed:0", rate_limit_rpm: float = 500, rate_limit_tpm: float = 40000,
+                 max_concurrency: int = 16, max_retries: int = 6, prompt_layout: str = "inline",
+                 telemetry_path: str = None, log_prompts: str = "truncate", request_timeout: float = 120.0,
+                 run_timeout: float = None, hedge_requests: bool = False, hedge_percentile: float = 0.95,
+                 hedge_min_samples: int = 20, routing_profile: str = "default", routing_file: str = None,
+                 http_max_connections: int = 200, http_keepalive_connections: int = 100,
+                 http_keepalive_expiry: float = 30.0, http_connect_timeout: float = 10.0) -> None:
+        self.api_key = api_key
+        self.cache_dir = cache_dir
+        self.cache_backend = cache_backend
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.backend = backend
+        self.base_url = base_url
+        self.fake_latency = fake_latency
+        self.rate_limit_rpm = rate_limit_rpm
+        self.rate_limit_tpm = rate_limit_tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.prompt_layout = prompt_layout
+        self.telemetry_path = telemetry_path
+        self.log_prompts = log_prompts
+        self.request_timeout = request_timeout
+        self.run_timeout = run_timeout
+        self.hedge_requests = hedge_requests
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.routing_profile = routing_profile
+        self.routing_file = routing_file
+        self.http_max_connections = http_max_connections
+        self.http_keepalive_connections = http_keepalive_connections
+        self.http_keepalive_expiry = http_keepalive_expiry
+        self.http_connect_timeout = http_connect_timeout
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Builds the configuration from the environment and an optional .env file."""
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        return cls(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            cache_dir=os.getenv('CACHE_DIR', 'cache'),
+            cache_backend=os.getenv('CACHE_BACKEND', 'sqlite'),
+            cache_ttl=float(os.getenv('CACHE_TTL')) if os.getenv('CACHE_TTL') else None,
+            cache_max_bytes=int(os.getenv('CACHE_MAX_BYTES')) if os.getenv('CACHE_MAX_BYTES') else None,
+            memory_entries=int(os.getenv('CACHE_MEMORY_ENTRIES', 1024)),
+            memory_bytes=int(os.getenv('CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+            backend=os.getenv('LLM_BACKEND', 'openai'),
+            base_url=os.getenv('OPENAI_BASE_URL') or None,
+            fake_latency=os.getenv('FAKE_LATENCY', 'fixed:0'),
+            rate_limit_rpm=float(os.getenv('RATE_LIMIT_RPM', 500)),
+            rate_limit_tpm=float(os.getenv('RATE_LIMIT_TPM', 40000)),
+            max_concurrency=int(os.getenv('MAX_CONCURRENCY', 16)),
+            max_retries=int(os.getenv('MAX_RETRIES', 6)),
+            prompt_layout=os.getenv('PROMPT_LAYOUT', 'inline'),
+            telemetry_path=os.getenv('TELEMETRY_FILE') or None,
+            log_prompts=os.getenv('LOG_PROMPTS', 'truncate'),
+            request_timeout=float(os.getenv('REQUEST_TIMEOUT', 120)),
+            run_timeout=float(os.getenv('RUN_TIMEOUT')) if os.getenv('RUN_TIMEOUT') else None,
+            hedge_requests=os.getenv('HEDGE_REQUESTS', '').lower() in ('1', 'true', 'yes'),
+            hedge_percentile=float(os.getenv('HEDGE_PERCENTILE', 0.95)),
+            hedge_min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+            routing_profile=os.getenv('ROUTING_PROFILE', 'default'),
+            routing_file=os.getenv('ROUTING_FILE') or None,
+            http_max_connections=int(os.getenv('HTTP_MAX_CONNECTIONS', 200)),
+            http_keepalive_connections=int(os.getenv('HTTP_KEEPALIVE_CONNECTIONS', 100)),
+            http_keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30)),
+            http_connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', 10)),
+        )
+
+
+def setup_logging(filename: str = 'ebook_generation.log', level: int = logging.INFO) -> None:
+    """
+    Configures root logging to a file and the console. Only the first call has an effect.
+
+    Entry points call this explicitly; importing the packages leaves logging alone.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+
+    logging.basicConfig(level=level,
+                        format=LOG_FORMAT,
+                        filename=filename,
+                        filemode='w')
+
+    # Add console handler
+    console = logging.StreamHandler()
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.getLogger('').addHandler(console)
@@ -0,0 +1,59 @@
+"""
+End-to-end deadlines.
+
+A deadline is set around a unit of work (e.g. SolutionGenerator.generate) and
+kept in a context variable, so every stage, worker thread (the thread pools copy
+the caller's context) and API call below it sees the same time budget. Waiting
+for rate-limit budgets, retry backoff and per-call timeouts are all capped by
+the remaining time.
+"""
+import contextlib
+import contextvars
+import time
+from typing import Optional
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline of the current run has passed."""
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    Runs the block with a deadline seconds from now. An enclosing, earlier deadline
+    still applies; None leaves the current deadline unchanged.
+    """
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline, or None without one."""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def check(what: str = "operation") -> None:
+    """Raises DeadlineExceeded if the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+
+
+def cap(timeout: Optional[float]) -> Optional[float]:
+    """Returns timeout limited to the time left until the deadline (None if neither is set)."""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.0)
+    return left if timeout is None else min(timeout, left)
@@ -0,0 +1,66 @@
+"""
+The event loop behind the synchronous API.
+
+connect_api runs aconnect_api on one background event loop per process, so every
+synchronous caller shares that loop's HTTP connection pool and an in-flight call
+holds no thread while it waits on the network. Coroutines run in a copy of the
+caller's context, so the run deadline and the current telemetry span carry over.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_loop = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the background event loop, starting its thread on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="api-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coroutine: Awaitable[T]) -> T:
+    """
+    Runs a coroutine on the background loop and blocks until it has finished.
+
+    Raises:
+        RuntimeError: Called from a coroutine running on the background loop
+            itself, which would deadlock; await the coroutine instead.
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coroutine.close()
+        raise RuntimeError("Blocking call on the API event loop; await the async variant instead")
+
+    result = Future()
+
+    def start() -> None:
+        # Runs inside the caller's context: the task copies it when created
+        task = loop.create_task(coroutine)
+        task.add_done_callback(lambda done: _settle(done, result))
+
+    loop.call_soon_threadsafe(contextvars.copy_context().run, start)
+    return result.result()
+
+
+def _settle(task: asyncio.Task, result: Future) -> None:
+    if task.cancelled():
+        result.cancel()
+    elif task.exception() is not None:
+        result.set_exception(task.exception())
+    else:
+        result.set_result(task.result())
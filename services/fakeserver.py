@@ -0,0 +1,192 @@
+"""
+Localhost OpenAI-compatible HTTP stub backed by FakeBackend.
+
+Serves POST /v1/chat/completions (plain and server-sent-event streaming) and
+GET /v1/models. Injected rate limits are answered with 429 and a Retry-After
+header, injected errors with 500. Point the real client at it with
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any OPENAI_API_KEY.
+
+Usage:
+    python -m services.fakeserver --port 8089 --latency lognormal:0.8,0.5 --rate-limit-rate 0.05
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.backends import FakeBackend, RateLimitError, TransientError
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    backend: FakeBackend = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, kind: str, headers: dict = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": kind, "code": None}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4", "object": "model"}]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "gpt-4")
+        messages = request.get("messages", [])
+        try:
+            if request.get("stream"):
+                self._stream(model, messages, request)
+            else:
+                completion = self.backend.complete(model, messages)
+                self._send_json(200, _completion_body(model, completion))
+        except RateLimitError as e:
+            self._send_error(429, str(e), "rate_limit_exceeded", {"Retry-After": str(e.retry_after)})
+        except TransientError as e:
+            self._send_error(500, str(e), "server_error")
+
+    def _stream(self, model: str, messages: list, request: dict) -> None:
+        chunks = self.backend.stream(model, messages)
+        # Pull the first chunk before sending headers, so injected errors become HTTP errors
+        try:
+            first = next(chunks)
+        except StopIteration as stop:
+            first, completion = None, stop.value
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        response_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        if first is not None:
+            self._event(_chunk_body(response_id, model, {"role": "assistant", "content": first}))
+            while True:
+                try:
+                    text = next(chunks)
+                except StopIteration as stop:
+                    completion = stop.value
+                    break
+                self._event(_chunk_body(response_id, model, {"content": text}))
+        self._event(_chunk_body(response_id, model, {}, finish_reason="stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._event({"id": response_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [], "usage": _usage(completion)})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _event(self, body: dict) -> None:
+        self._write_chunk(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _usage(completion) -> dict:
+    return {"prompt_tokens": completion.prompt_tokens, "completion_tokens": completion.completion_tokens,
+            "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": completion.cached_tokens or 0}}
+
+
+def _completion_body(model: str, completion) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": completion.text},
+                     "finish_reason": "stop"}],
+        "usage": _usage(completion),
+    }
+
+
+def _chunk_body(response_id: str, model: str, delta: dict, finish_reason: str = None) -> dict:
+    return {"id": response_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+class _Server(ThreadingHTTPServer):
+    # The default listen backlog (5) refuses connections when async clients open hundreds at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeServer:
+    """
+    Runs the stub on a background thread.
+
+    Args:
+        backend: The fake answering the requests.
+        host: Interface to bind.
+        port: Port to bind; 0 picks a free one.
+    """
+
+    def __init__(self, backend: FakeBackend, host: str = "127.0.0.1", port: int = 0) -> None:
+        handler = type("Handler", (_Handler,), {"backend": backend})
+        self.httpd = _Server((host, port), handler)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--responses", help="JSON object mapping prompt substrings to canned responses")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    options = dict(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                   retry_after=args.retry_after, seed=args.seed)
+    fake = FakeBackend.from_file(args.responses, **options) if args.responses else FakeBackend(**options)
+    server = FakeServer(fake, args.host, args.port)
+    print(f"Serving fake OpenAI API on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
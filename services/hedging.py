@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from services import deadline
+from services.telemetry import Histogram
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """
+    Hedged requests: if a call is still running after the observed latency
+    percentile, an identical second call is started and whichever succeeds first
+    wins.
+
+    Hedge only the network call itself (inside a rate-limiter slot): its latency is
+    what the percentile is measured on, so time spent queueing or backing off never
+    triggers a hedge.
+
+    Args:
+        percentile: Latency percentile after which a call is hedged.
+        min_samples: Successful calls to observe before hedging starts.
+    """
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 20) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latency = Histogram()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._background = set()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds after which a call is hedged, or None while there are too few samples."""
+        with self._lock:
+            if self.latency.count < self.min_samples:
+                return None
+            return self.latency.percentile(self.percentile) / 1000
+
+    async def _atimed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        result = await fn()
+        with self._lock:
+            self.latency.add((time.perf_counter() - started) * 1000)
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], on_extra: Callable[[T], None] = None) -> T:
+        """
+        Awaits fn(), hedging it with a duplicate call if it is slower than the percentile.
+
+        Once one attempt of a hedged pair has succeeded, the other is left to finish
+        in the background: it has already been sent, so it is billed either way, and
+        on_extra is called with its result so its usage can be counted.
+        """
+        with self._lock:
+            self.calls += 1
+        hedge_after = self.delay()
+        if hedge_after is None:
+            return await self._atimed(fn)
+
+        # Tasks copy the caller's context (deadline, telemetry span)
+        primary = asyncio.ensure_future(self._atimed(fn))
+        done, _ = await asyncio.wait([primary], timeout=deadline.cap(hedge_after))
+        if done:
+            return primary.result()
+
+        deadline.check("hedging the request")
+        with self._lock:
+            self.hedged += 1
+        logger.info(f"Request slower than p{int(self.percentile * 100)} ({hedge_after:.2f}s); sending a hedge")
+        hedge = asyncio.ensure_future(self._atimed(fn))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline.cap(None),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    deadline.check("either hedged request completed")
+                winner = None
+                for task in done:
+                    if task.exception() is None:
+                        winner = winner or task
+                    else:
+                        error = error or task.exception()
+                if winner is not None:
+                    if winner is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    for other in (done | pending) - {winner}:
+                        self._report_extra(other, on_extra)
+                    pending = set()
+                    return winner.result()
+        finally:
+            # Failing or cancelled before any attempt succeeded
+            for loser in pending:
+                loser.cancel()
+        raise error
+
+    def _report_extra(self, task: asyncio.Future, on_extra: Callable[[T], None]) -> None:
+        def report(finished: asyncio.Future) -> None:
+            self._background.discard(finished)
+            if not finished.cancelled() and finished.exception() is None and on_extra is not None:
+                on_extra(finished.result())
+
+        # The loop only keeps weak references to tasks
+        self._background.add(task)
+        task.add_done_callback(report)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"calls": self.calls, "hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                    "hedge_after_ms": round(self.latency.percentile(self.percentile), 2)
+                    if self.latency.count >= self.min_samples else None}
+
+
+class NoHedger:
+    """Hedger stand-in that runs every call once."""
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], on_extra: Callable[[T], None] = None) -> T:
+        return await fn()
+
+    def stats(self) -> Dict[str, float]:
+        return {}
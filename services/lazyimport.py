@@ -0,0 +1,40 @@
+"""
+Lazy package exports.
+
+A package's public names are imported on first access, so importing the package
+itself is cheap and has no side effects.
+"""
+import importlib
+import sys
+
+
+def attach(package: str, names: dict) -> tuple:
+    """
+    Builds the module-level __getattr__, __dir__ and __all__ of a lazy package.
+
+    Usage, in the package's __init__.py:
+        __getattr__, __dir__, __all__ = attach(__name__, {"genma": ".genma", "TaskGraph": ".scheduler"})
+
+    Args:
+        package: The package's __name__.
+        names: Relative module of each public name. A name equal to the last part
+            of its module is the module itself; any other is an attribute of it.
+
+    Returns:
+        The __getattr__, __dir__ and __all__ of the package.
+    """
+    namespace = sys.modules[package].__dict__
+
+    def __getattr__(name):
+        if name not in names:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        module = importlib.import_module(names[name], package)
+        value = module if module.__name__.rsplit('.', 1)[-1] == name else getattr(module, name)
+        # Cached on the package, so later accesses skip __getattr__
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(names))
+
+    return __getattr__, __dir__, list(names)
@@ -1,89 +1,488 @@
+import asyncio
 import os
 import logging
-import hashlib
 import json
+import threading
+import weakref
+from collections import Counter
 
+from services.backends import FakeBackend, LLMBackend, OpenAIBackend, RequestDeferred
+from services.cache import MemoryCache, TieredCache, create_cache
+from services.cachekey import build_cache_key, legacy_cache_key, normalize_messages
+from services import deadline, eventloop
+from services.config import Config
+from services.hedging import Hedger, NoHedger
+from services.ratelimit import AdaptiveLimiter, estimate_tokens
+from services.routing import RoutingProfile, get_profile
+from services.singleflight import AsyncSingleFlight, akey_lock, key_lock
+from services import telemetry
+from services.usage import UsageTracker
 
-from openai import OpenAI
-from dotenv import load_dotenv
+# Client, configuration and cache are created on first use (see configure)
+_init_lock = threading.Lock()
+_config = None
+_client = None
+# AsyncOpenAI clients by event loop: a client's connection pool belongs to one loop
+_async_clients = weakref.WeakKeyDictionary()
+_cache = None
+_backend = None
+_limiter = None
+_hedger = None
+_routing = None
 
+def configure(config: Config = None) -> None:
+    """
+    Sets the configuration used by the API client and the cache.
 
+    Without an explicit call, Config.from_env() is used on first use. Calling this
+    again closes the current cache and drops the client, so they are rebuilt with
+    the new settings.
+    """
+    global _config, _client, _async_clients, _cache, _backend, _limiter, _hedger, _routing
+    with _init_lock:
+        if _cache is not None:
+            _cache.close()
+        _config = config
+        telemetry.export_to(config.telemetry_path if config else None)
+        _client = None
+        _async_clients = weakref.WeakKeyDictionary()
+        _cache = None
+        _backend = None
+        _limiter = None
+        _hedger = None
+        _routing = None
 
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    filename='ebook_generation.log',
-                    filemode='w')
+def set_backend(backend: LLMBackend) -> None:
+    """Routes every uncached request through backend (e.g. a FakeBackend for load tests)."""
+    global _backend
+    with _init_lock:
+        _backend = backend
 
-# Add console handler
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
+def get_backend() -> LLMBackend:
+    """Returns the backend requests are dispatched through, creating it on first use."""
+    global _backend
+    config = get_config()
+    with _init_lock:
+        if _backend is None:
+            if config.backend == "fake":
+                _backend = FakeBackend(latency=config.fake_latency)
+            elif config.backend == "openai":
+                _backend = OpenAIBackend(get_client, get_async_client)
+            else:
+                raise ValueError(f"Unknown LLM backend: {config.backend}")
+        return _backend
 
+def get_config() -> Config:
+    global _config
+    with _init_lock:
+        if _config is None:
+            _config = Config.from_env()
+            telemetry.export_to(_config.telemetry_path)
+        return _config
 
+def set_limiter(limiter) -> None:
+    """Replaces the process-wide rate limiter (e.g. with ratelimit.NoLimiter)."""
+    global _limiter
+    with _init_lock:
+        _limiter = limiter
 
+def get_limiter() -> AdaptiveLimiter:
+    """Returns the process-wide rate limiter every API call goes through."""
+    global _limiter
+    config = get_config()
+    with _init_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter(rpm=config.rate_limit_rpm, tpm=config.rate_limit_tpm,
+                                       max_concurrency=config.max_concurrency, max_retries=config.max_retries)
+        return _limiter
 
-load_dotenv()
+def set_hedger(hedger) -> None:
+    """Replaces the process-wide hedger (e.g. with hedging.NoHedger)."""
+    global _hedger
+    with _init_lock:
+        _hedger = hedger
 
-api_key = os.getenv('OPENAI_API_KEY')
-if not api_key:
-    raise Exception("OPENAI_API_KEY environment variable not set.")
+def get_hedger():
+    """Returns the hedger API calls go through (a NoHedger unless hedging is enabled)."""
+    global _hedger
+    config = get_config()
+    with _init_lock:
+        if _hedger is None:
+            if config.hedge_requests:
+                _hedger = Hedger(percentile=config.hedge_percentile, min_samples=config.hedge_min_samples)
+            else:
+                _hedger = NoHedger()
+        return _hedger
 
-client = OpenAI()
+def get_routing() -> RoutingProfile:
+    """Returns the routing profile selecting model and max_tokens per stage (see services.routing)."""
+    global _routing
+    config = get_config()
+    with _init_lock:
+        if _routing is None:
+            _routing = get_profile(config.routing_profile, config.routing_file)
+        return _routing
 
-CACHE_DIR = "cache"
-os.makedirs(CACHE_DIR, exist_ok=True)
+def route(stage=None):
+    """Returns the model, max_tokens and other routed parameters of a stage's requests."""
+    return {"model": DEFAULT_MODEL, "max_tokens": DEFAULT_MAX_TOKENS, **get_routing().resolve(stage or DEFAULT_STAGE)}
+
+def _call_timeout():
+    """Timeout of the next API call: the per-call timeout, capped by the run deadline."""
+    deadline.check("calling the API")
+    return deadline.cap(get_config().request_timeout)
+
+def _http_options(config: Config) -> dict:
+    """Connection pool settings of the HTTP clients: keep-alive, pool limits and timeouts."""
+    import httpx
+
+    return {"limits": httpx.Limits(max_connections=config.http_max_connections,
+                                   max_keepalive_connections=config.http_keepalive_connections,
+                                   keepalive_expiry=config.http_keepalive_expiry),
+            "timeout": httpx.Timeout(config.request_timeout, connect=config.http_connect_timeout),
+            "follow_redirects": True}
+
+def get_client():
+    """Returns the shared OpenAI client, creating it on first use."""
+    global _client
+    config = get_config()
+    with _init_lock:
+        if _client is None:
+            if not config.api_key:
+                raise Exception("OPENAI_API_KEY environment variable not set.")
+            import httpx
+            from openai import OpenAI
+
+            _client = OpenAI(api_key=config.api_key, base_url=config.base_url,
+                             http_client=httpx.Client(**_http_options(config)))
+        return _client
+
+def get_async_client():
+    """
+    Returns the AsyncOpenAI client of the running event loop, creating it on first use.
+
+    Every call on a loop shares the client's tuned connection pool, so hundreds of
+    concurrent requests reuse a bounded set of keep-alive connections.
+    """
+    loop = asyncio.get_running_loop()
+    config = get_config()
+    with _init_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            if not config.api_key:
+                raise Exception("OPENAI_API_KEY environment variable not set.")
+            import httpx
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(api_key=config.api_key, base_url=config.base_url,
+                                 http_client=httpx.AsyncClient(**_http_options(config)))
+            _async_clients[loop] = client
+        return client
+
+def get_cache() -> TieredCache:
+    """Returns the shared response cache, creating it on first use."""
+    global _cache
+    config = get_config()
+    with _init_lock:
+        if _cache is None:
+            os.makedirs(config.cache_dir, exist_ok=True)
+            _cache = TieredCache(
+                MemoryCache(max_entries=config.memory_entries, max_bytes=config.memory_bytes,
+                            ttl=config.cache_ttl),
+                create_cache(config.cache_backend, config.cache_dir,
+                             ttl=config.cache_ttl, max_bytes=config.cache_max_bytes))
+        return _cache
+
+def lock_dir() -> str:
+    return os.path.join(get_config().cache_dir, "locks")
+
+def __getattr__(name):
+    # Backwards compatible module attributes, resolved lazily
+    if name == "client":
+        return get_client()
+    if name == "cache":
+        return get_cache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+DEFAULT_SYSTEM = "You are a business idea generator."
+DEFAULT_MODEL = "gpt-4"
+DEFAULT_MAX_TOKENS = 500
+
+# Hit/miss accounting; misses are attributed to the key component that changed
+_stats_lock = threading.Lock()
+cache_stats = {"hits": 0, "legacy_hits": 0, "coalesced": 0, "misses": 0, "miss_reasons": Counter()}
+
+# Concurrent identical requests on an event loop share one in-flight call
+_inflight = AsyncSingleFlight()
+
+# Token usage per pipeline stage (the stage argument of connect_api)
+token_usage = UsageTracker()
+DEFAULT_STAGE = "other"
+
+def get_cache_key(prompt):
+    # Hash the prompt to create a unique key (pre-versioning layout)
+    return legacy_cache_key(prompt)
 
 def get_cache_filename(prompt):
-    logging.info("""Generate a unique cache filename based on the prompt.""")
-    # Hash the prompt to create a unique filename
-    prompt_hash = hashlib.md5(prompt.encode('utf-8')).hexdigest()
-    return os.path.join(CACHE_DIR, f"{prompt_hash}.json")
+    # Generate a unique cache filename based on the prompt
+    return os.path.join(get_config().cache_dir, f"{get_cache_key(prompt)}.json")
 
 def save_to_cache(filename, data):
-    logging.info("""Save API response to cache.""")
+    # Save API response to cache
     with open(filename, 'w') as cache_file:
         json.dump(data, cache_file)
 
 def load_from_cache(filename):
-    logging.info("""Load API response from cache.""")
+    # Load API response from cache
     with open(filename, 'r') as cache_file:
         return json.load(cache_file)
 
+def get_cache_stats():
+    """Returns a snapshot of the cache hit/miss counters."""
+    with _stats_lock:
+        return {**cache_stats, "miss_reasons": dict(cache_stats["miss_reasons"]), "tiers": get_cache().stats()}
 
-def connect_api(system="You are a business idea generator.",prompt=""):
-    logging.info(f"Processing prompt: {prompt}")
+def get_usage():
+    """Returns a snapshot of the per-stage token usage (see services.usage)."""
+    return token_usage.snapshot()
 
-    # Generate cache filename
-    cache_filename = get_cache_filename(prompt)
+def get_routing_report():
+    """Returns the realized model, latency and completion tokens per stage (see UsageTracker.routing)."""
+    return token_usage.routing()
 
-    # Check if cached response exists
-    if os.path.exists(cache_filename):
-        logging.info("Loading response from cache.")
-        response_data = load_from_cache(cache_filename)
-    else:
-        logging.info("Cache miss. Calling OpenAI API.")
-        messages = [
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt}
-        ]
+def _record(outcome, reasons=()):
+    with _stats_lock:
+        cache_stats[outcome] += 1
+        cache_stats["miss_reasons"].update(reasons)
+
+def _miss_reasons(key, candidates):
+    """Names the key components that differ from entries cached for the same prompt."""
+    if not candidates:
+        return ["prompt"]
+    return min((key.diff(components) for components in candidates), key=len) or ["prompt"]
+
+def _explain_miss(key):
+    return _miss_reasons(key, get_cache().find_by_prompt(key.components["prompt"]))
+
+async def _aexplain_miss(key):
+    return _miss_reasons(key, await get_cache().afind_by_prompt(key.components["prompt"]))
+
+def _legacy_eligible(system, model, params):
+    # Entries written before versioned keys only hashed the raw prompt; they are
+    # valid for requests using the defaults they were generated with
+    return system == DEFAULT_SYSTEM and model == DEFAULT_MODEL and params == {"max_tokens": DEFAULT_MAX_TOKENS}
+
+def _lookup(key, system, prompt, model, params):
+    """Returns the cached response and the tier it came from ("memory", "disk" or "legacy"), or (None, None)."""
+    response_data, tier = get_cache().lookup(key.key)
+    if response_data is not None:
+        _record("hits")
+        return response_data, tier
+    if _legacy_eligible(system, model, params):
+        response_data = get_cache().get(legacy_cache_key(prompt))
+        if response_data is not None:
+            _record("legacy_hits")
+            get_cache().set(key.key, response_data, model=model, components=key.components)
+            return response_data, "legacy"
+    return None, None
+
+async def _alookup(key, system, prompt, model, params):
+    """Async variant of _lookup, through the async cache interface."""
+    response_data, tier = await get_cache().alookup(key.key)
+    if response_data is not None:
+        _record("hits")
+        return response_data, tier
+    if _legacy_eligible(system, model, params):
+        response_data = await get_cache().aget(legacy_cache_key(prompt))
+        if response_data is not None:
+            _record("legacy_hits")
+            await get_cache().aset(key.key, response_data, model=model, components=key.components)
+            return response_data, "legacy"
+    return None, None
+
+def _account(stage, model, completion, span):
+    """Records the token usage of an API call per stage, for the cost summary and on its span."""
+    _account_usage(stage, model, completion, span.elapsed_ms())
+    span.set(prompt_tokens=completion.prompt_tokens or 0, completion_tokens=completion.completion_tokens or 0,
+             cached_tokens=completion.cached_tokens or 0)
+
+def _account_usage(stage, model, completion, latency_ms=None):
+    token_usage.record_call(stage, completion.prompt_tokens, completion.completion_tokens,
+                            completion.cached_tokens, model=model, latency_ms=latency_ms)
+    telemetry.get_telemetry().record_usage(model, completion.prompt_tokens, completion.completion_tokens,
+                                           completion.cached_tokens)
+
+def _describe(prompt):
+    return telemetry.redact(prompt, get_config().log_prompts)
+
+def _valid(response_data, validate):
+    """Whether a response passes the caller's check; a cached one that fails is requested again."""
+    if validate is None:
+        return True
+    try:
+        validate(response_data)
+    except Exception as e:
+        logging.warning(f"Cached response rejected ({str(e)}); requesting it again.")
+        return False
+    return True
+
+
+async def _fetch(cache_key, messages, model, params, stage, span, validate=None):
+    """
+    Calls the API for a missed key, holding the cross-process lock for that key.
+    A response failing validate raises before it is cached.
+    """
+    async with akey_lock(lock_dir(), cache_key.key):
+        # Another process may have produced the response while we waited for the lock
+        response_data = await get_cache().aget(cache_key.key)
+        if response_data is not None and _valid(response_data, validate):
+            _record("coalesced")
+            token_usage.record_hit(stage)
+            span.set(cache="coalesced")
+            logging.info("Response produced by another worker; loaded from cache.")
+            return response_data
+
+        reasons = await _aexplain_miss(cache_key)
+        _record("misses", reasons)
+        span.set(cache="miss")
+        logging.info(f"Cache miss ({', '.join(reasons)} changed). Calling OpenAI API.")
         try:
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                max_tokens=500
-            )
-            response_data = response.choices[0].message.content
-            save_to_cache(cache_filename, response_data)
+            with telemetry.span("llm.api", stage=stage, model=model) as api_span:
+                # Only the network call is hedged, within the slot the limiter granted;
+                # the losing attempt of a hedged pair is billed too, so its usage is counted
+                completion = await get_limiter().acall(lambda: get_hedger().acall(
+                    lambda: get_backend().acomplete(model, messages, timeout=_call_timeout(), **params),
+                    on_extra=lambda extra: _account_usage(stage, model, extra)),
+                    estimate_tokens(messages, params.get("max_tokens")))
+                _account(stage, model, completion, api_span)
+            response_data = completion.text
+            if validate is not None:
+                validate(response_data)
+            await get_cache().aset(cache_key.key, response_data, model=model,
+                            prompt_tokens=completion.prompt_tokens,
+                            completion_tokens=completion.completion_tokens,
+                            components=cache_key.components, stage=stage)
             logging.info("Response saved to cache.")
+        except RequestDeferred:
+            raise
         except Exception as e:
             logging.error(f"Error generating outline: {str(e)}")
             raise
-    return response_data  
+        return response_data
+
+
+def _request(system, prompt, model, max_tokens, params, stage):
+    # Model and max_tokens not given explicitly come from the routing profile of the stage
+    routed = route(stage)
+    model = model or routed["model"]
+    max_tokens = max_tokens or routed["max_tokens"]
+    messages = normalize_messages([
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt}
+    ])
+    extra = {name: value for name, value in routed.items() if name not in ("model", "max_tokens")}
+    params = {"max_tokens": max_tokens, **extra, **params}
+    return model, messages, params, build_cache_key(model, messages, **params)
+
+def request_fingerprint(system=DEFAULT_SYSTEM,prompt="",model=None,max_tokens=None,stage=DEFAULT_STAGE,**params):
+    """
+    Identifies a connect_api request by everything that determines its response:
+    model, normalized messages and parameters (the versioned cache key).
+    """
+    return _request(system, prompt, model, max_tokens, params, stage)[3].key
+
+
+async def aconnect_api(system=DEFAULT_SYSTEM,prompt="",model=None,max_tokens=None,
+                       stage=DEFAULT_STAGE,validate=None,**params):
+    """
+    Returns the response to a prompt, from the cache or the API.
+
+    Misses are sent through the backend's async client, so a single event loop can
+    keep hundreds of requests in flight (bounded by MAX_CONCURRENCY and the rate
+    limits) without a thread per request.
+
+    validate, if given, is called with the response text and raises if it is
+    unusable (for instance truncated JSON): such a response is not cached, and a
+    cached one failing it is requested again.
+    """
+    logging.info(f"Processing prompt: {_describe(prompt)}")
+
+    # Generate cache key over the full request
+    model, messages, params, cache_key = _request(system, prompt, model, max_tokens, params, stage)
+
+    with telemetry.span("llm.request", stage=stage, model=model) as span:
+        # Check if cached response exists
+        response_data, tier = await _alookup(cache_key, system, prompt, model, params)
+        if response_data is not None and _valid(response_data, validate):
+            logging.info("Loading response from cache.")
+            token_usage.record_hit(stage)
+            span.set(cache=tier)
+        else:
+            response_data, shared = await _inflight.do(
+                cache_key.key, lambda: _fetch(cache_key, messages, model, params, stage, span, validate))
+            if shared:
+                _record("coalesced")
+                token_usage.record_hit(stage)
+                span.set(cache="coalesced")
+    return response_data
+
+def connect_api(system=DEFAULT_SYSTEM,prompt="",model=None,max_tokens=None,
+                stage=DEFAULT_STAGE,validate=None,**params):
+    """Synchronous aconnect_api, run on the shared API event loop (see services.eventloop)."""
+    return eventloop.run(aconnect_api(system=system, prompt=prompt, model=model, max_tokens=max_tokens,
+                                      stage=stage, validate=validate, **params))
         
+def connect_api_stream(system=DEFAULT_SYSTEM,prompt="",model=None,max_tokens=None,
+                       stage=DEFAULT_STAGE,**params):
+    """
+    Streaming variant of connect_api: yields the response text as it arrives.
+
+    A cached response is yielded in one piece. On a miss the completion is streamed
+    from the API and the complete text is cached once the stream has finished.
+    """
+    logging.info(f"Processing prompt (streaming): {_describe(prompt)}")
+
+    model, messages, params, cache_key = _request(system, prompt, model, max_tokens, params, stage)
+
+    response_data, tier = _lookup(cache_key, system, prompt, model, params)
+    if response_data is not None:
+        logging.info("Loading response from cache.")
+        token_usage.record_hit(stage)
+        yield response_data
+        return
+
+    with key_lock(lock_dir(), cache_key.key):
+        response_data = get_cache().get(cache_key.key)
+        if response_data is not None:
+            _record("coalesced")
+            token_usage.record_hit(stage)
+            yield response_data
+            return
+
+        reasons = _explain_miss(cache_key)
+        _record("misses", reasons)
+        logging.info(f"Cache miss ({', '.join(reasons)} changed). Streaming from OpenAI API.")
+        try:
+            with telemetry.span("llm.stream", stage=stage, model=model) as span:
+                completion = yield from get_limiter().stream(
+                    lambda: get_backend().stream(model, messages, timeout=_call_timeout(), **params),
+                    estimate_tokens(messages, params.get("max_tokens")))
+                _account(stage, model, completion, span)
+        except RequestDeferred:
+            raise
+        except Exception as e:
+            logging.error(f"Error generating outline: {str(e)}")
+            raise
+        get_cache().set(cache_key.key, completion.text, model=model,
+                        prompt_tokens=completion.prompt_tokens,
+                        completion_tokens=completion.completion_tokens,
+                        components=cache_key.components, stage=stage)
+        logging.info("Streamed response saved to cache.")
+
 if __name__ == '__main__':
+    from services.config import setup_logging
+
+    setup_logging()
     prompt='Generate 10 business idea with AI'
     response=connect_api(prompt)
     print(f'Response:{response}')
\ No newline at end of file
@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Generator, List, TypeVar
+
+from services import deadline, telemetry
+from services.backends import Completion, RateLimitError, TransientError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Tasks waiting for a concurrency slot re-check this often; slots are released by
+# threads and tasks alike, so there is no single event loop to notify
+SLOT_POLL_INTERVAL = 0.02
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_min.
+
+    Args:
+        rate_per_min: Tokens added per minute.
+        capacity: Maximum burst. Defaults to one minute's worth.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: float = None) -> None:
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, amount: float) -> float:
+        """Takes amount tokens if available; otherwise returns the seconds until they are."""
+        # A request larger than the bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """Blocks until amount tokens are available and takes them."""
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            deadline.check("the rate limit budget allowed the request")
+            time.sleep(deadline.cap(min(wait, 1.0)))
+
+    async def aacquire(self, amount: float = 1.0) -> None:
+        """Async variant of acquire, waiting without blocking the event loop."""
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return
+            deadline.check("the rate limit budget allowed the request")
+            await asyncio.sleep(deadline.cap(min(wait, 1.0)))
+
+    def adjust(self, amount: float) -> None:
+        """Takes (positive) or returns (negative) tokens after the real cost is known."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int = 0) -> int:
+    """Rough token estimate of a request: ~4 characters per prompt token plus the completion budget."""
+    return sum(len(m["content"]) for m in messages) // 4 + (max_tokens or 0)
+
+
+class AdaptiveLimiter:
+    """
+    Client-side limiter shared by every API call of the process.
+
+    Requests/min and tokens/min budgets are enforced with token buckets. Concurrency
+    is adapted AIMD-style: each success raises the limit by 1/limit, each 429 halves
+    it. Rate-limited and transient failures are retried with exponential backoff and
+    full jitter; a Retry-After value pauses every caller until it has passed. Waiting
+    and retrying give up once the deadline of the current run (services.deadline) passes.
+
+    Args:
+        rpm: Requests per minute.
+        tpm: Estimated tokens per minute.
+        max_concurrency: Upper bound of the adaptive concurrency limit.
+        min_concurrency: Lower bound of the adaptive concurrency limit.
+        max_retries: Attempts after the first one before giving up.
+        base_delay: First backoff delay in seconds.
+        max_delay: Backoff cap in seconds.
+    """
+
+    def __init__(self, rpm: float = 500, tpm: float = 40000, max_concurrency: int = 16, min_concurrency: int = 1,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self, estimated_tokens: int):
+        """Waits for a concurrency slot and the rate budgets, then holds the slot."""
+        with self._cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    break
+                deadline.check("a concurrency slot was free")
+                self._cond.wait(timeout=deadline.cap(pause if pause > 0 else None))
+            self.in_flight += 1
+        try:
+            self.requests.acquire(1)
+            self.tokens.acquire(estimated_tokens)
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, estimated_tokens: int):
+        """Async variant of slot, waiting without blocking the event loop."""
+        while True:
+            with self._cond:
+                pause = self.paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    break
+            deadline.check("a concurrency slot was free")
+            await asyncio.sleep(deadline.cap(pause if pause > 0 else SLOT_POLL_INTERVAL))
+        try:
+            await self.requests.aacquire(1)
+            await self.tokens.aacquire(estimated_tokens)
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def _on_success(self, estimated_tokens: int, completion) -> None:
+        if isinstance(completion, Completion) and completion.prompt_tokens is not None:
+            self.tokens.adjust(completion.prompt_tokens + (completion.completion_tokens or 0) - estimated_tokens)
+        with self._cond:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _on_failure(self, error: Exception, attempt: int) -> float:
+        """Updates the limiter state after a retryable failure and returns the delay before retrying."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        span = telemetry.current_span()
+        if span is not None:
+            span.increment("retries")
+        with self._cond:
+            self.retries += 1
+            if isinstance(error, RateLimitError):
+                self.rate_limited += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if error.retry_after:
+                    delay = max(delay, error.retry_after)
+                    self.paused_until = max(self.paused_until, time.monotonic() + error.retry_after)
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            raise deadline.DeadlineExceeded(f"Deadline exceeded while retrying after {type(error).__name__}") from error
+        logger.warning(f"{type(error).__name__} (attempt {attempt + 1}/{self.max_retries + 1}), "
+                       f"retrying in {delay:.1f}s; concurrency limit {int(self.limit)}")
+        return delay
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        """Awaits fn() within the budgets, retrying rate-limited and transient failures."""
+        attempt = 0
+        while True:
+            try:
+                async with self.aslot(estimated_tokens):
+                    result = await fn()
+            except (RateLimitError, TransientError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._on_failure(e, attempt))
+                attempt += 1
+                continue
+            self._on_success(estimated_tokens, result)
+            return result
+
+    def stream(self, make_stream: Callable[[], Generator[str, None, Completion]],
+               estimated_tokens: int = 0) -> Generator[str, None, Completion]:
+        """
+        Streaming variant of acall. Failures before the first chunk are retried;
+        once text has been yielded the stream is not restarted.
+        """
+        attempt = 0
+        started = False
+        while True:
+            try:
+                with self.slot(estimated_tokens):
+                    chunks = make_stream()
+                    try:
+                        first = next(chunks)
+                    except StopIteration as stop:
+                        self._on_success(estimated_tokens, stop.value)
+                        return stop.value
+                    started = True
+                    yield first
+                    completion = yield from chunks
+            except (RateLimitError, TransientError) as e:
+                if attempt >= self.max_retries or started:
+                    raise
+                time.sleep(self._on_failure(e, attempt))
+                attempt += 1
+                continue
+            self._on_success(estimated_tokens, completion)
+            return completion
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {"concurrency_limit": int(self.limit), "in_flight": self.in_flight,
+                    "retries": self.retries, "rate_limited": self.rate_limited}
+
+
+class NoLimiter:
+    """Limiter stand-in that applies no budgets and no retries."""
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], estimated_tokens: int = 0) -> T:
+        return await fn()
+
+    def stream(self, make_stream: Callable[[], Generator[str, None, Completion]],
+               estimated_tokens: int = 0) -> Generator[str, None, Completion]:
+        return (yield from make_stream())
+
+    def stats(self) -> Dict[str, float]:
+        return {}
@@ -0,0 +1,101 @@
+"""
+Per-stage request routing.
+
+A routing profile sets the model, max_tokens and temperature of each request by
+its stage: the genma stages ("queries", "agents", "plans_and_skills",
+"orchestration") and the catalog topics ("catalog:<topic>"). Routes are keyed by
+stage name or fnmatch pattern ("catalog:*", "*"). Every matching route applies,
+the more specific ones overriding the others field by field; fields no route
+sets keep the connect_api defaults.
+"""
+import fnmatch
+import json
+from typing import Any, Dict
+
+ROUTE_FIELDS = ("model", "max_tokens", "temperature")
+
+DEFAULT_PROFILE = "default"
+
+PRESETS = {
+    # The connect_api defaults, with room for the JSON stages so their objects are not truncated
+    "default": {
+        "queries": {"max_tokens": 800},
+        "agents": {"max_tokens": 800},
+        "plans_and_skills": {"max_tokens": 1000},
+        "orchestration": {"max_tokens": 1500},
+    },
+    # Small model everywhere, with room for the long JSON stages
+    "fast": {
+        "*": {"model": "gpt-4o-mini"},
+        "plans_and_skills": {"max_tokens": 800},
+        "orchestration": {"max_tokens": 1200},
+    },
+    # Small model for the list stages, larger one where the design is decided
+    "balanced": {
+        "*": {"model": "gpt-4o"},
+        "queries": {"model": "gpt-4o-mini"},
+        "catalog:*": {"model": "gpt-4o-mini", "max_tokens": 700},
+        "agents": {"max_tokens": 800},
+        "plans_and_skills": {"max_tokens": 800},
+        "orchestration": {"max_tokens": 1500},
+    },
+    # Flagship model and generous budgets
+    "quality": {
+        "*": {"model": "gpt-4o", "max_tokens": 1000},
+        "catalog:*": {"temperature": 0.7},
+        "plans_and_skills": {"max_tokens": 1500},
+        "orchestration": {"max_tokens": 2000, "temperature": 0.2},
+    },
+}
+
+
+def _specificity(pattern: str) -> tuple:
+    # Exact names after patterns; among patterns, more literal characters win
+    wildcards = sum(pattern.count(char) for char in "*?[")
+    return (wildcards == 0, len(pattern) - wildcards)
+
+
+class RoutingProfile:
+    """
+    Request parameters by stage.
+
+    Args:
+        name: The profile name, for reporting.
+        routes: Route fields (model, max_tokens, temperature) by stage name or pattern.
+    """
+
+    def __init__(self, name: str, routes: Dict[str, Dict[str, Any]]) -> None:
+        for pattern, route in routes.items():
+            unknown = sorted(set(route) - set(ROUTE_FIELDS))
+            if unknown:
+                raise ValueError(f"Routing profile '{name}', route '{pattern}': unknown fields {unknown}")
+        self.name = name
+        self.routes = routes
+
+    def resolve(self, stage: str) -> Dict[str, Any]:
+        """Returns the route fields set for stage, merged from every matching route."""
+        resolved = {}
+        for pattern in sorted((p for p in self.routes if fnmatch.fnmatchcase(stage, p)), key=_specificity):
+            resolved.update(self.routes[pattern])
+        return resolved
+
+
+def load_profiles(path: str = None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Returns the presets, plus the profiles of a JSON file mapping profile names to
+    routes ({"mine": {"*": {"model": "gpt-4o-mini"}, "orchestration": {...}}}).
+    A profile in the file replaces the preset of the same name.
+    """
+    profiles = dict(PRESETS)
+    if path:
+        with open(path) as f:
+            profiles.update(json.load(f))
+    return profiles
+
+
+def get_profile(name: str = DEFAULT_PROFILE, path: str = None) -> RoutingProfile:
+    """Builds the named profile from the presets and the optional profiles file."""
+    profiles = load_profiles(path)
+    if name not in profiles:
+        raise ValueError(f"Unknown routing profile: {name} (known: {', '.join(sorted(profiles))})")
+    return RoutingProfile(name, profiles[name])
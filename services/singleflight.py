@@ -0,0 +1,178 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Bounds of the polling interval of akey_lock while another process holds the lock
+LOCK_POLL_MIN = 0.005
+LOCK_POLL_MAX = 0.1
+
+
+class AsyncSingleFlight:
+    """
+    Deduplicates concurrent calls for the same key within a process: concurrent
+    awaits of a key on an event loop share one in-flight call (or its exception).
+    Calls on different event loops are not shared.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Awaits fn() once for all concurrent callers of key on the running loop.
+
+        Returns:
+            A tuple (result, shared) where shared is True if the result came from
+            another caller's in-flight call.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._calls.get((loop, key))
+            leader = future is None
+            if leader:
+                future = loop.create_future()
+                self._calls[(loop, key)] = future
+
+        if not leader:
+            try:
+                # A follower giving up must not cancel the leader's call
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The leader was cancelled, not this caller: make the call again
+            return await self.do(key, fn)
+
+        try:
+            future.set_result(await fn())
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[(loop, key)]
+        return future.result(), False
+
+
+def _lock_path(directory: str, key: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{hashlib.md5(key.encode('utf-8')).hexdigest()}.lock")
+
+
+def _unlock(lock_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _is_current(lock_file, path: str) -> bool:
+    """Whether a locked file is still the one at path (the previous holder removes it on release)."""
+    if fcntl is None:
+        return True
+    try:
+        return os.path.samestat(os.fstat(lock_file.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def _release(lock_file, path: str) -> None:
+    if fcntl is not None:
+        # Removed while still held: a waiter that opened this file sees it is stale and
+        # retries on a fresh one, so the lock directory only holds the keys in flight
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+    _unlock(lock_file)
+    lock_file.close()
+
+
+def _lock(lock_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    else:
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                # LK_LOCK gives up after ~10 seconds; keep waiting
+                continue
+
+
+@contextlib.contextmanager
+def key_lock(directory: str, key: str):
+    """
+    Holds an exclusive cross-process lock for key on this host.
+
+    Every key has its own lock file, so only holders of the same key wait for
+    each other.
+
+    Args:
+        directory: Directory holding the lock files.
+        key: The key to lock.
+    """
+    path = _lock_path(directory, key)
+    while True:
+        lock_file = open(path, "a+b")
+        _lock(lock_file)
+        if _is_current(lock_file, path):
+            break
+        _unlock(lock_file)
+        lock_file.close()
+    try:
+        yield
+    finally:
+        _release(lock_file, path)
+
+
+def _try_lock(lock_file) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+@contextlib.asynccontextmanager
+async def akey_lock(directory: str, key: str):
+    """
+    Async variant of key_lock. The lock is polled without blocking, so a task
+    waiting for another process holds no thread and can be cancelled.
+    """
+    path = _lock_path(directory, key)
+    delay = LOCK_POLL_MIN
+    while True:
+        lock_file = open(path, "a+b")
+        try:
+            while not _try_lock(lock_file):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX)
+        except BaseException:
+            lock_file.close()
+            raise
+        if _is_current(lock_file, path):
+            break
+        _unlock(lock_file)
+        lock_file.close()
+    try:
+        yield
+    finally:
+        _release(lock_file, path)
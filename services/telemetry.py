@@ -0,0 +1,332 @@
+"""
+Lightweight tracing, latency histograms and cost accounting.
+
+span() measures a block (a run, a pipeline stage, an API call) and nests under
+the span open in the current context. Finished spans feed per-name latency
+histograms. When an export file is configured, they are also queued for a
+background thread that appends them as OTLP-style JSON lines; the traced code
+never waits on the file, and spans are dropped (and counted) if the queue is full.
+"""
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# USD per million tokens: (input, cached input, output). Longest matching prefix wins.
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+# Relative width of the histogram buckets, i.e. the worst-case percentile error
+HISTOGRAM_GROWTH = 1.05
+
+_current = contextvars.ContextVar("telemetry_span", default=None)
+
+
+def redact(text: str, mode: str = "truncate", limit: int = 80) -> str:
+    """
+    Shortens a prompt for logging.
+
+    Args:
+        text: The prompt.
+        mode: "truncate" (first limit characters and a digest), "hash" (length and
+            digest only) or "full".
+        limit: Characters kept by "truncate".
+    """
+    if mode == "full":
+        return text
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    if mode == "hash":
+        return f"<{len(text)} chars, sha256:{digest}>"
+    flat = " ".join(text.split())
+    if len(flat) <= limit:
+        return flat
+    return f"{flat[:limit]}... <{len(text)} chars, sha256:{digest}>"
+
+
+def price(model: str):
+    """Returns the (input, cached input, output) price per million tokens of a model, or None."""
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model and model.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return None
+
+
+class Histogram:
+    """
+    Fixed-memory latency histogram with logarithmic buckets.
+
+    Percentiles are the upper bound of the bucket they fall in, so they are at
+    most HISTOGRAM_GROWTH - 1 too high.
+    """
+
+    def __init__(self) -> None:
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value_ms: float) -> None:
+        index = math.floor(math.log(max(value_ms, 0.001)) / math.log(HISTOGRAM_GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(HISTOGRAM_GROWTH ** (index + 1), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {"count": self.count, "p50": round(self.percentile(0.50), 2), "p95": round(self.percentile(0.95), 2),
+                "p99": round(self.percentile(0.99), 2), "max": round(self.max, 2), "total": round(self.total, 2)}
+
+
+class Span:
+    """One timed operation. Attributes can be set while it is open."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any], trace_id: str, parent_id: Optional[str]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._started = time.perf_counter()
+        self.duration_ms = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the span started (its duration once ended)."""
+        if self.duration_ms is not None:
+            return self.duration_ms
+        return (time.perf_counter() - self._started) * 1000
+
+    def end(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.end_ns = self.start_ns + int(self.duration_ms * 1e6)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in the field layout of the OTLP JSON encoding."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "status": {"code": 1 if self.status == "ok" else 2},
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+
+
+def _otlp_value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonlExporter:
+    """
+    Appends finished spans to a JSONL file from a background thread.
+
+    Args:
+        path: The file to append to.
+        max_queue: Spans waiting to be written; further spans are dropped.
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000) -> None:
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="telemetry-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        with open(self.path, "a") as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    break
+                f.write(json.dumps(span.to_otlp()) + "\n")
+                # Write whatever else is queued before flushing
+                while True:
+                    try:
+                        span = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if span is None:
+                        f.flush()
+                        return
+                    f.write(json.dumps(span.to_otlp()) + "\n")
+                f.flush()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Writes the queued spans and stops the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+        if self.dropped:
+            logger.warning(f"Telemetry exporter dropped {self.dropped} spans")
+
+
+class Telemetry:
+    """Span recorder of the process: latency histograms, token cost and an optional exporter."""
+
+    def __init__(self, exporter: JsonlExporter = None) -> None:
+        self.exporter = exporter
+        self.trace_id = uuid.uuid4().hex
+        self._histograms: Dict[str, Histogram] = {}
+        self._tokens: Dict[str, Dict[str, int]] = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current.get()
+        span = Span(name, attributes, self.trace_id, parent.span_id if parent else None)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+            self._finish(span)
+
+    def add_listener(self, listener: Callable[[Span], None]) -> None:
+        """Calls listener with every finished span, on the thread that ended it."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Span], None]) -> None:
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            self._histograms.setdefault(span.name, Histogram()).add(span.duration_ms)
+            listeners = list(self._listeners)
+        if self.exporter is not None:
+            self.exporter.export(span)
+        for listener in listeners:
+            try:
+                listener(span)
+            except Exception:
+                logger.exception(f"Telemetry listener failed on span {span.name}")
+
+    def record_usage(self, model: str, prompt_tokens: int = None, completion_tokens: int = None,
+                     cached_tokens: int = None) -> None:
+        """Adds the token usage of one API call to the cost accounting."""
+        with self._lock:
+            tokens = self._tokens.setdefault(model, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                                                     "completion_tokens": 0})
+            tokens["calls"] += 1
+            tokens["prompt_tokens"] += prompt_tokens or 0
+            tokens["cached_tokens"] += cached_tokens or 0
+            tokens["completion_tokens"] += completion_tokens or 0
+
+    def summary(self) -> Dict[str, Any]:
+        """Latency percentiles (ms) per span name and the token cost per model."""
+        with self._lock:
+            spans = {name: histogram.summary() for name, histogram in self._histograms.items()}
+            cost = {}
+            for model, tokens in self._tokens.items():
+                prices = price(model)
+                usd = None
+                if prices:
+                    uncached = tokens["prompt_tokens"] - tokens["cached_tokens"]
+                    usd = round((uncached * prices[0] + tokens["cached_tokens"] * prices[1]
+                                 + tokens["completion_tokens"] * prices[2]) / 1e6, 4)
+                cost[model] = {**tokens, "usd": usd}
+        return {"spans": spans, "cost": cost,
+                "dropped_spans": self.exporter.dropped if self.exporter is not None else 0}
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """A latency percentile (ms) of the spans recorded under name, or None before any."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            return histogram.percentile(q) if histogram and histogram.count else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._tokens.clear()
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry() -> Telemetry:
+    return _telemetry
+
+
+def export_to(path: Optional[str]) -> None:
+    """Starts exporting spans to a JSONL file (None stops exporting)."""
+    previous = _telemetry.exporter
+    _telemetry.exporter = JsonlExporter(path) if path else None
+    if previous is not None:
+        previous.close()
+
+
+def span(name: str, **attributes):
+    """Context manager timing a block as a span of the process telemetry."""
+    return _telemetry.span(name, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    lines = [f"{'span':<16} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}"]
+    for name, stats in sorted(summary["spans"].items()):
+        lines.append(f"{name:<16} {stats['count']:>7} {stats['p50']:>10} {stats['p95']:>10} "
+                     f"{stats['p99']:>10} {stats['max']:>10}")
+    for model, cost in summary["cost"].items():
+        usd = "n/a" if cost["usd"] is None else f"${cost['usd']:.4f}"
+        lines.append(f"cost {model}: {usd} ({cost['calls']} calls, {cost['prompt_tokens']} prompt tokens "
+                     f"of which {cost['cached_tokens']} cached, {cost['completion_tokens']} completion tokens)")
+    return "\n".join(lines)
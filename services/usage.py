@@ -0,0 +1,95 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+from services.telemetry import Histogram
+
+COUNTERS = ("calls", "cache_hits", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+
+class UsageTracker:
+    """
+    Thread-safe per-stage token accounting.
+
+    API calls add the prompt/completion token counts reported in the response usage
+    (cached_tokens is the part of the prompt served from the provider's prefix cache);
+    responses loaded from the local cache only count as cache_hits. The latency and
+    model of the API calls are kept per stage too, to tune the routing profiles.
+    """
+
+    def __init__(self) -> None:
+        self._stages = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self._latency = defaultdict(Histogram)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, stage: str, prompt_tokens: int = None, completion_tokens: int = None,
+                    cached_tokens: int = None, model: str = None, latency_ms: float = None) -> None:
+        with self._lock:
+            counters = self._stages[stage]
+            counters["calls"] += 1
+            counters["prompt_tokens"] += prompt_tokens or 0
+            counters["cached_tokens"] += cached_tokens or 0
+            counters["completion_tokens"] += completion_tokens or 0
+            if model:
+                self._models[stage] = model
+            if latency_ms is not None:
+                self._latency[stage].add(latency_ms)
+
+    def record_hit(self, stage: str) -> None:
+        with self._lock:
+            self._stages[stage]["cache_hits"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Returns a copy of the counters of every stage."""
+        with self._lock:
+            return {stage: dict(counters) for stage, counters in self._stages.items()}
+
+    def routing(self) -> Dict[str, Dict[str, object]]:
+        """Per stage: the model called, API calls, p50/p95 latency (ms) and mean completion tokens."""
+        with self._lock:
+            report = {}
+            for stage, counters in self._stages.items():
+                if not counters["calls"]:
+                    continue
+                latency = self._latency.get(stage)
+                timed = latency is not None and latency.count
+                report[stage] = {"model": self._models.get(stage), "calls": counters["calls"],
+                                 "p50_ms": round(latency.percentile(0.50), 1) if timed else None,
+                                 "p95_ms": round(latency.percentile(0.95), 1) if timed else None,
+                                 "completion_tokens": round(counters["completion_tokens"] / counters["calls"])}
+            return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._latency.clear()
+            self._models.clear()
+
+
+def totals(snapshot: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    return {name: sum(counters[name] for counters in snapshot.values()) for name in COUNTERS}
+
+
+def format_usage(snapshot: Dict[str, Dict[str, int]]) -> str:
+    """Formats a snapshot as a table, stages sorted by prompt tokens."""
+    rows = sorted(snapshot.items(), key=lambda item: item[1]["prompt_tokens"], reverse=True)
+    rows.append(("total", totals(snapshot)))
+    width = max([len("stage")] + [len(stage) for stage, _ in rows])
+    lines = [f"{'stage':<{width}}  " + "  ".join(f"{name:>10}" for name in COUNTERS)]
+    for stage, counters in rows:
+        cells = (f"{counters[name]:>{max(len(name), 10)}}" for name in COUNTERS)
+        lines.append(f"{stage:<{width}}  " + "  ".join(cells))
+    return "\n".join(lines)
+
+
+def format_routing(profile: str, report: Dict[str, Dict[str, object]]) -> str:
+    """Formats UsageTracker.routing() as a table, slowest stages first."""
+    rows = sorted(report.items(), key=lambda item: item[1]["p95_ms"] or 0, reverse=True)
+    width = max([len("stage")] + [len(stage) for stage, _ in rows])
+    lines = [f"routing profile: {profile}",
+             f"{'stage':<{width}}  {'model':<14} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'tokens/call':>12}"]
+    for stage, row in rows:
+        lines.append(f"{stage:<{width}}  {row['model'] or '':<14} {row['calls']:>6} {str(row['p50_ms']):>9} "
+                     f"{str(row['p95_ms']):>9} {row['completion_tokens']:>12}")
+    return "\n".join(lines)